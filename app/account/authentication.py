@@ -0,0 +1,109 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.functions import Coalesce
+from django.utils.functional import LazyObject, empty
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import get_profile
+
+# Claims that let a token stand in for its user without a query
+TOKEN_VERSION_CLAIM = "ver"
+USER_CLAIMS = ("email", "is_staff")
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def add_user_claims(token, user):
+    """Put what StatelessJWTAuthentication needs into ``token``"""
+    token[TOKEN_VERSION_CLAIM] = get_profile(user).token_version
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+def token_version_is_current(user_id, version):
+    """Whether tokens of ``version`` still hold, cached for a few seconds"""
+    key = (user_id, version)
+    now = time.monotonic()
+
+    with _versions_lock:
+        cached = _versions.get(key)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+
+    # Users whose profile is not made yet have never had a token revoked
+    current = (User.objects
+               .filter(pk=user_id, is_active=True)
+               .values_list(Coalesce("profile__token_version", 0), flat=True)
+               .first())
+    valid = current == version
+
+    with _versions_lock:
+        if len(_versions) >= 10000:
+            for stale in [k for k, v in _versions.items() if v[1] <= now]:
+                del _versions[stale]
+        _versions[key] = (valid, now + settings.AUTH_TOKEN_CACHE_SECONDS)
+
+    return valid
+
+
+class TokenUser(LazyObject):
+    """The user of a verified token, built from its claims.
+
+    ``id``, ``pk``, ``email`` and ``is_staff`` are answered from the token;
+    anything else loads the User row on first use, so views that only
+    need to know who is calling run without a user query.
+    """
+
+    def __init__(self, user_id, claims):
+        super().__init__()
+        self.__dict__["_claims"] = {
+            "id": user_id,
+            "pk": user_id,
+            "is_authenticated": True,
+            "is_anonymous": False,
+            **{claim: claims[claim] for claim in USER_CLAIMS},
+        }
+
+    def __getattr__(self, name):
+        if self._wrapped is empty and name in self._claims:
+            return self._claims[name]
+        return super().__getattr__(name)
+
+    def __bool__(self):
+        return True
+
+    def _setup(self):
+        self._wrapped = User.objects.get(pk=self._claims["id"])
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that trusts the user claims of its tokens.
+
+    Revocation is checked against Profile.token_version, which is cached
+    per process for AUTH_TOKEN_CACHE_SECONDS. Tokens issued without the
+    claims fall back to loading the user.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, TypeError, ValueError):
+            return super().get_user(validated_token)
+
+        if not token_version_is_current(
+                user_id, validated_token.get(TOKEN_VERSION_CLAIM, 0)):
+            raise AuthenticationFailed(_("Token has been revoked"),
+                                       code="token_revoked")
+
+        if not all(claim in validated_token for claim in USER_CLAIMS):
+            return super().get_user(validated_token)
+
+        return TokenUser(user_id, validated_token)
@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from .hashing import make_password, verify_password
+
+UserModel = get_user_model()
+
+
+class PooledModelBackend(ModelBackend):
+    """ModelBackend that checks passwords in the hashing pool and upgrades
+    hashes that fall behind the hasher policy.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Hash anyway, so the response time does not tell whether
+            # the user exists
+            make_password(password)
+            return None
+
+        is_correct, rehashed = verify_password(password, user.password)
+        if not is_correct or not self.user_can_authenticate(user):
+            return None
+
+        if rehashed:
+            # update() skips the pre_save receiver: the password is the
+            # same, so the user's tokens stay valid
+            UserModel._default_manager.filter(
+                pk=user.pk, password=user.password
+            ).update(password=rehashed)
+            user.password = rehashed
+
+        return user
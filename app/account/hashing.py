@@ -0,0 +1,103 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+_pool = None
+_slots = None
+_lock = threading.Lock()
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many logins at once, please try again shortly"
+    default_code = "hashing_busy"
+
+
+def get_pool():
+    """The process pool and the semaphore that bounds its queue"""
+    global _pool, _slots
+
+    with _lock:
+        if _pool is None:
+            # forkserver children do not inherit the worker's threads or
+            # database connections
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=django.setup
+            )
+            _slots = threading.BoundedSemaphore(
+                max(settings.PASSWORD_HASH_QUEUE,
+                    settings.PASSWORD_HASH_WORKERS)
+            )
+
+    return _pool, _slots
+
+
+def run(function, *args):
+    """Run ``function`` in the pool, or inline without hash workers.
+
+    Raises HashingBusy, a 503, when the queue stays full for
+    PASSWORD_HASH_WAIT_SECONDS; waiting longer would only pin the
+    request worker too.
+    """
+    global _pool
+
+    if not settings.PASSWORD_HASH_WORKERS:
+        return function(*args)
+
+    pool, slots = get_pool()
+    if not slots.acquire(timeout=settings.PASSWORD_HASH_WAIT_SECONDS):
+        raise HashingBusy()
+
+    try:
+        return pool.submit(function, *args).result()
+
+    except BrokenProcessPool:
+        # A killed worker breaks the pool for good; start a new one
+        with _lock:
+            if _pool is pool:
+                _pool = None
+        raise
+
+    finally:
+        slots.release()
+
+
+def make_password(password):
+    """django.contrib.auth.hashers.make_password, off the request thread"""
+    return run(hashers.make_password, password)
+
+
+def make_passwords(passwords):
+    """Hash many passwords at once, spread over every pool process"""
+    if not settings.PASSWORD_HASH_WORKERS:
+        return [hashers.make_password(password) for password in passwords]
+
+    pool, _ = get_pool()
+    return list(pool.map(hashers.make_password, passwords, chunksize=16))
+
+
+def verify_password(password, encoded):
+    """Check ``password`` against the ``encoded`` hash.
+
+    Returns ``(is_correct, rehashed)``; ``rehashed`` is a new hash when the
+    stored one does not follow the hasher policy any more, else None.
+    """
+    return run(check_and_rehash, password, encoded)
+
+
+def check_and_rehash(password, encoded):
+    rehashed = []
+    is_correct = hashers.check_password(
+        password, encoded,
+        setter=lambda raw: rehashed.append(hashers.make_password(raw))
+    )
+    return is_correct, (rehashed[0] if rehashed else None)
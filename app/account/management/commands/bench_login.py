@@ -0,0 +1,98 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from account.hashing import make_password
+from account.serializers import ClaimsTokenObtainPairSerializer
+
+USERNAME = "bench-login-{n}@example.invalid"
+
+
+class Command(BaseCommand):
+    help = ("Measure login throughput and latency with concurrent logins, "
+            "in process or against a running server")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url",
+                            help="Base URL of a running server, e.g. "
+                                 "http://localhost:8000; logins run in "
+                                 "this process without it")
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--password", default="bench-login-password")
+        parser.add_argument("--keep-users", action="store_true",
+                            help="Leave the benchmark users in place")
+
+    def handle(self, *args, **options):
+        if min(options["users"], options["requests"],
+               options["concurrency"]) < 1:
+            raise CommandError("--users, --requests and --concurrency have "
+                               "to be at least 1")
+
+        password = options["password"]
+        usernames = [USERNAME.format(n=n) for n in range(options["users"])]
+
+        encoded = make_password(password)
+        existing = set(User.objects.filter(username__in=usernames)
+                       .values_list("username", flat=True))
+        for username in usernames:
+            if username not in existing:
+                User.objects.create(username=username, email=username,
+                                    password=encoded)
+
+        if options["url"]:
+            session = requests.Session()
+            url = options["url"].rstrip("/") + "/api/token/"
+
+            def login(username):
+                res = session.post(url, json={"username": username,
+                                              "password": password})
+                return res.status_code == 200
+
+        else:
+            def login(username):
+                try:
+                    serializer = ClaimsTokenObtainPairSerializer(data={
+                        "username": username, "password": password
+                    })
+                    return serializer.is_valid()
+                finally:
+                    close_old_connections()
+
+        def timed(n):
+            start = time.monotonic()
+            try:
+                ok = login(usernames[n % len(usernames)])
+            except Exception:
+                ok = False
+            return time.monotonic() - start, ok
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(options["concurrency"]) as executor:
+            results = list(executor.map(timed, range(options["requests"])))
+        elapsed = time.monotonic() - start
+
+        if not options["keep_users"]:
+            User.objects.filter(username__in=usernames).delete()
+
+        latencies = sorted(seconds for seconds, _ in results)
+        errors = sum(1 for _, ok in results if not ok)
+
+        def percentile(share):
+            return latencies[min(len(latencies) - 1,
+                                 int(len(latencies) * share))] * 1000
+
+        self.stdout.write(
+            "{count} logins, {concurrency} at a time, {errors} failed\n"
+            "{rate:.1f} logins/s, latency p50 {p50:.0f}ms, "
+            "p95 {p95:.0f}ms, max {max:.0f}ms".format(
+                count=len(results), concurrency=options["concurrency"],
+                errors=errors, rate=len(results) / elapsed,
+                p50=percentile(0.5), p95=percentile(0.95),
+                max=latencies[-1] * 1000
+            ))
@@ -0,0 +1,56 @@
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from rest_framework.request import Request
+
+from utils.throttling import (CacheBackend, LocalBuckets,
+                              SharedMemoryBackend, token_bucket)
+
+
+class Command(BaseCommand):
+    help = ("Measure the per request overhead of the rate limiter, tier by "
+            "tier, in microseconds")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calls", type=int, default=100000)
+        parser.add_argument("--clients", type=int, default=1000,
+                            help="Distinct client keys the calls rotate "
+                                 "through")
+
+    def handle(self, *args, **options):
+        calls = options["calls"]
+        keys = ["bench:{n}".format(n=n) for n in range(options["clients"])]
+        # High enough that every call is allowed and does the full work
+        rate, burst = 1e9, 1e9
+
+        for name, backend in [("local dict", LocalBuckets()),
+                              ("shared memory", SharedMemoryBackend()),
+                              ("cache", CacheBackend())]:
+            start = time.perf_counter()
+            for n in range(calls):
+                backend.take(keys[n % len(keys)], rate, burst,
+                             time.time())
+            self.report(name, start, calls)
+
+        throttle = token_bucket("bench")()
+        factory = RequestFactory()
+        requests = []
+        for n in range(len(keys)):
+            request = Request(factory.post(
+                "/", REMOTE_ADDR="10.0.{0}.{1}".format(n // 256, n % 256)
+            ))
+            request.user = AnonymousUser()
+            requests.append(request)
+
+        with override_settings(RATE_LIMITS={"bench": (60e9, 1e9)}):
+            start = time.perf_counter()
+            for n in range(calls):
+                throttle.allow_request(requests[n % len(requests)], None)
+            self.report("throttle, local + shared", start, calls)
+
+    def report(self, name, start, calls):
+        self.stdout.write("{name:<26} {us:8.2f} us/call".format(
+            name=name, us=(time.perf_counter() - start) / calls * 1e6
+        ))
@@ -0,0 +1,84 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from account.hashing import make_passwords
+from account.models import Profile
+
+
+class Command(BaseCommand):
+    help = ("Create users and their profiles from a CSV file with email, "
+            "first_name, last_name and optionally password columns. "
+            "Users whose email is taken already are skipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Users created per transaction")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["path"], newline="") as source:
+                rows = list(csv.DictReader(source))
+        except OSError as e:
+            raise CommandError(str(e))
+
+        if rows and "email" not in rows[0]:
+            raise CommandError("The file needs an email column")
+
+        batch_size = options["batch_size"]
+        created = skipped = 0
+
+        for start in range(0, len(rows), batch_size):
+            count = self.import_batch(rows[start:start + batch_size])
+            created += count
+            skipped += len(rows[start:start + batch_size]) - count
+
+        self.stdout.write(self.style.SUCCESS(
+            "Imported {created} users, skipped {skipped}".format(
+                created=created, skipped=skipped)
+            ))
+
+    def import_batch(self, rows):
+        by_email = {}
+        for row in rows:
+            email = (row.get("email") or "").strip()
+            if email:
+                by_email.setdefault(email, row)
+
+        taken = set(User.objects.filter(username__in=list(by_email))
+                    .values_list("username", flat=True))
+        new = [(email, row) for email, row in by_email.items()
+               if email not in taken]
+        if not new:
+            return 0
+
+        # Rows without a password get an unusable one and can use
+        # forgot_password to set theirs
+        passwords = make_passwords([row.get("password") or None
+                                    for _, row in new])
+
+        with transaction.atomic():
+            User.objects.bulk_create([
+                User(username=email,
+                     email=email,
+                     first_name=row.get("first_name", ""),
+                     last_name=row.get("last_name", ""),
+                     password=password)
+                for (email, row), password in zip(new, passwords)
+            ], ignore_conflicts=True)
+
+            # Ids are read back as not every database returns them
+            # from a bulk insert
+            user_ids = list(User.objects
+                            .filter(username__in=[email for email, _ in new],
+                                    profile__isnull=True)
+                            .values_list("id", flat=True))
+
+            Profile.objects.bulk_create([Profile(user_id=user_id)
+                                         for user_id in user_ids],
+                                        ignore_conflicts=True)
+
+        return len(user_ids)
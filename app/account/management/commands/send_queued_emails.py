@@ -0,0 +1,49 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from account.outbox import send_next_batch
+
+
+class Command(BaseCommand):
+    help = ("Send the emails queued in the outbox over one SMTP connection. "
+            "Several workers can run side by side.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true",
+                            help="Keep polling instead of exiting once "
+                                 "the outbox is empty")
+        parser.add_argument("--interval", type=float, default=1.0,
+                            help="Seconds to wait when the outbox is empty")
+        parser.add_argument("--batch-size", type=int, default=50,
+                            help="Emails sent per transaction")
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        sent = 0
+
+        while True:
+            # The connection stays open while there is mail to send and
+            # is closed when the outbox runs dry, before the SMTP server
+            # times the idle client out.
+            try:
+                while True:
+                    count = send_next_batch(connection,
+                                            options["batch_size"])
+                    if not count:
+                        break
+                    sent += count
+            finally:
+                connection.close()
+
+            if not options["loop"]:
+                break
+
+            close_old_connections()
+            time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS(
+            "Handled {count} queued emails".format(count=sent)
+        ))
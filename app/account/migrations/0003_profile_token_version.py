@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-19 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0002_rename_reset_pasword_expire_profile_reset_password_expire"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="token_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
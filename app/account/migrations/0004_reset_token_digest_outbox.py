@@ -0,0 +1,83 @@
+# Generated by Django 5.0.6 on 2026-10-19 02:13
+
+import hashlib
+
+import django.utils.timezone
+
+from django.db import migrations, models
+
+
+def hash_reset_tokens(apps, schema_editor):
+    # Outstanding reset tokens keep working once stored as digests
+    Profile = apps.get_model("account", "Profile")
+
+    for profile in Profile.objects.exclude(reset_password_token=""):
+        profile.reset_password_token = hashlib.sha256(
+            profile.reset_password_token.encode()
+        ).hexdigest()
+        profile.save(update_fields=["reset_password_token"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0003_profile_token_version"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="profile",
+            name="reset_password_token",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=64
+            ),
+        ),
+        migrations.RunPython(hash_reset_tokens, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name="OutgoingEmail",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("subject", models.CharField(max_length=255)),
+                ("body", models.TextField()),
+                ("from_email", models.CharField(max_length=255)),
+                ("to", models.JSONField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Pending"),
+                            ("SENT", "Sent"),
+                            ("FAILED", "Failed"),
+                        ],
+                        default="PENDING",
+                        max_length=20,
+                    ),
+                ),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True, default="")),
+                (
+                    "available_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("sent_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "PENDING")),
+                        fields=["available_at"],
+                        name="outgoing_email_pending",
+                    )
+                ],
+            },
+        ),
+    ]
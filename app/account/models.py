@@ -1,7 +1,11 @@
+import hashlib
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import post_init, post_save, pre_save
+from django.utils import timezone
 
 # Create your models here.
 
@@ -11,23 +15,106 @@ class Profile(models.Model):
                                 related_name="profile",
                                 on_delete=models.CASCADE
                                 )
-    reset_password_token = models.CharField(max_length=50,
+    # sha256 of the emailed token, see reset_token_digest
+    reset_password_token = models.CharField(max_length=64,
                                             default="",
-                                            blank=True
+                                            blank=True,
+                                            db_index=True
                                             )
     reset_password_expire = models.DateTimeField(null=True, blank=True)
+    # Bumped to invalidate the user's tokens, see account.authentication
+    token_version = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return str(self.user.get_full_name())
 
 
-@receiver(post_save, sender=User)
-def save_profile(sender, instance, created, **kwargs):
+class EmailStatus(models.TextChoices):
+    PENDING = "PENDING"
+    SENT = "SENT"
+    FAILED = "FAILED"
+
+
+class OutgoingEmail(models.Model):
+    """Outbox of emails, sent by the send_queued_emails worker"""
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField()
+    status = models.CharField(
+        max_length=20,
+        choices=EmailStatus.choices,
+        default=EmailStatus.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(default="", blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["available_at"],
+                         condition=models.Q(status="PENDING"),
+                         name="outgoing_email_pending"
+                         ),
+        ]
+
+    def __str__(self):
+        return str(self.subject)
+
+
+def reset_token_digest(token):
+    """What is stored of a password reset token; a leaked table can not
+    be used to reset passwords.
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
 
-    print("instance", instance)
+def get_profile(user):
+    """The user's Profile, created on first use.
 
-    user = instance
+    register creates it with the user; users made elsewhere, e.g. by
+    createsuperuser or the admin, get theirs here.
+    """
+    try:
+        return user.profile
+    except Profile.DoesNotExist:
+        profile, _ = Profile.objects.get_or_create(user=user)
+        return profile
 
-    if created:
-        profile = Profile(user=user)
-        profile.save()
+
+# User fields the tokens depend on
+TOKEN_FIELDS = ("password", "email", "is_staff", "is_active")
+
+
+@receiver(post_init, sender=User)
+def remember_token_fields(sender, instance, **kwargs):
+    # Deferred fields are left out rather than loaded
+    instance._token_fields = {field: instance.__dict__.get(field)
+                              for field in TOKEN_FIELDS}
+
+
+@receiver(pre_save, sender=User)
+def revoke_tokens(sender, instance, **kwargs):
+    """Tokens carry the email and is_staff, so changes to them, to
+    is_active or to the password invalidate the tokens issued so far.
+    """
+    if instance.pk is None or instance._state.adding:
+        return
+
+    if all(instance._token_fields[field] == instance.__dict__.get(field)
+           for field in TOKEN_FIELDS):
+        return
+
+    revoked = Profile.objects.filter(user_id=instance.pk).update(
+        token_version=F("token_version") + 1
+    )
+    if not revoked:
+        Profile.objects.get_or_create(user_id=instance.pk,
+                                      defaults={"token_version": 1})
+
+
+@receiver(post_save, sender=User)
+def reset_token_fields(sender, instance, **kwargs):
+    remember_token_fields(sender, instance)
@@ -0,0 +1,81 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailStatus, OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, body, from_email, to):
+    """Store an email for the send_queued_emails worker.
+
+    Written in the caller's transaction, so an email about something that
+    is rolled back is never sent.
+    """
+    return OutgoingEmail.objects.create(subject=subject,
+                                        body=body,
+                                        from_email=from_email,
+                                        to=list(to)
+                                        )
+
+
+def send_next_batch(connection, batch_size=50):
+    """Send up to ``batch_size`` due emails over ``connection``, which is
+    left open for the next batch.
+
+    Returns how many were handled, 0 when the outbox is empty. Rows are
+    locked while they are sent, so several workers can run; a crash
+    between sending and the commit sends those emails again.
+    """
+    with transaction.atomic():
+        emails = list(OutgoingEmail.objects
+                      .select_for_update(skip_locked=True)
+                      .filter(status=EmailStatus.PENDING,
+                              available_at__lte=timezone.now())
+                      .order_by("available_at")[:batch_size])
+
+        for email in emails:
+            email.attempts += 1
+
+            try:
+                # Opens the connection unless it is open already
+                connection.open()
+                connection.send_messages([EmailMessage(email.subject,
+                                                       email.body,
+                                                       email.from_email,
+                                                       email.to
+                                                       )])
+
+            except Exception as e:
+                logger.exception("Email %s failed", email.pk)
+                email.last_error = repr(e)
+
+                if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                    email.status = EmailStatus.FAILED
+                else:
+                    email.available_at = timezone.now() + timedelta(
+                        seconds=2 ** email.attempts
+                    )
+
+                # The server may have dropped us; reconnect for the next
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+            else:
+                email.status = EmailStatus.SENT
+                email.sent_at = timezone.now()
+                email.last_error = ""
+
+        OutgoingEmail.objects.bulk_update(emails, ["status", "attempts",
+                                                   "last_error",
+                                                   "available_at",
+                                                   "sent_at"])
+
+    return len(emails)
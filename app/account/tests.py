@@ -1,3 +1,363 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password, PBKDF2PasswordHasher
+import io
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from order.models import Order
+from utils.throttling import (LocalBuckets, SharedMemoryBackend,
+                              reset_rate_limits)
+from . import authentication, hashing
+from .models import EmailStatus, OutgoingEmail, Profile
 
 # Create your tests here.
+
+
+def setUpModule():
+    reset_rate_limits()
+
+
+@override_settings(AUTH_TOKEN_CACHE_SECONDS=0)
+class StatelessJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="c@example.com",
+                                        email="c@example.com",
+                                        password=make_password("secret1")
+                                        )
+        Order.objects.create(user=self.user, total_amount=10)
+        self.client = APIClient()
+        authentication._versions.clear()
+
+    def login(self, password="secret1"):
+        res = self.client.post("/api/token/", {"username": "c@example.com",
+                                               "password": password})
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Bearer " + res.data["access"]
+        )
+
+    def test_views_that_only_need_the_id_skip_the_user_query(self):
+        self.login()
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get("/api/orders/")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["count"], 1)
+        # Only the token version check touches auth_user
+        self.assertFalse([q for q in queries
+                          if '"auth_user"."password"' in q["sql"]])
+
+    @override_settings(AUTH_TOKEN_CACHE_SECONDS=60)
+    def test_token_version_is_cached(self):
+        self.login()
+        self.client.get("/api/orders/")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/orders/")
+
+        self.assertFalse([q for q in queries
+                          if "token_version" in q["sql"]])
+
+    def test_user_is_loaded_when_a_view_needs_it(self):
+        self.login()
+
+        res = self.client.get("/api/me/")
+
+        self.assertEqual(res.data["email"], "c@example.com")
+
+    def test_password_change_revokes_issued_tokens(self):
+        self.login()
+        self.user.set_password("secret2")
+        self.user.save()
+
+        res = self.client.get("/api/me/")
+
+        self.assertEqual(res.status_code, 401)
+
+        self.login("secret2")
+        self.assertEqual(self.client.get("/api/me/").status_code, 200)
+
+    def test_email_change_revokes_issued_tokens(self):
+        self.login()
+
+        res = self.client.put("/api/me/update/", {
+            "first_name": "C", "last_name": "D", "username": "d@example.com",
+            "email": "d@example.com", "password": "",
+        }, format="json")
+        self.assertEqual(res.status_code, 200)
+
+        # The old token still says c@example.com
+        self.assertEqual(self.client.get("/api/me/").status_code, 401)
+
+        res = self.client.post("/api/token/", {"username": "d@example.com",
+                                               "password": "secret1"})
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Bearer " + res.data["access"]
+        )
+        self.assertEqual(self.client.get("/api/me/").data["email"],
+                         "d@example.com")
+
+    def test_staff_claim_is_revoked_with_the_staff_flag(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.login()
+        self.assertEqual(self.client.get("/api/reports/sales/").status_code,
+                         200)
+
+        self.user.is_staff = False
+        self.user.save()
+
+        self.assertEqual(self.client.get("/api/reports/sales/").status_code,
+                         401)
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000, PASSWORD_HASH_WORKERS=2)
+class PasswordHashingTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username="c@example.com",
+            password=PBKDF2PasswordHasher().encode("secret1", "salt",
+                                                   iterations=500)
+        )
+        self.client = APIClient()
+
+    def login(self, password="secret1"):
+        return self.client.post("/api/token/", {"username": "c@example.com",
+                                                "password": password})
+
+    def test_register_and_login_hash_in_the_pool(self):
+        res = self.client.post("/api/register/", {
+            "first_name": "Ann", "last_name": "Lee",
+            "email": "ann@example.com", "password": "secret1"
+        })
+        self.assertEqual(res.status_code, 201)
+
+        user = User.objects.get(username="ann@example.com")
+        self.assertTrue(user.check_password("secret1"))
+
+        res = self.client.post("/api/token/", {"username": "ann@example.com",
+                                               "password": "secret1"})
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(PASSWORD_HASH_WORKERS=0)
+    def test_outdated_hashes_are_upgraded_at_login(self):
+        self.assertEqual(self.login("wrong").status_code, 401)
+        self.user.refresh_from_db()
+        self.assertIn("$500$", self.user.password)
+
+        self.assertEqual(self.login().status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertIn("$1000$", self.user.password)
+        self.assertTrue(self.user.check_password("secret1"))
+        # Same password, so the tokens already issued stay valid
+        self.assertEqual(self.user.profile.token_version, 0)
+
+    def test_full_queue_answers_503(self):
+        _, slots = hashing.get_pool()
+        taken = 0
+        while slots.acquire(blocking=False):
+            taken += 1
+
+        try:
+            with override_settings(PASSWORD_HASH_WAIT_SECONDS=0.01):
+                res = self.login()
+        finally:
+            for _ in range(taken):
+                slots.release()
+
+        self.assertEqual(res.status_code, 503)
+
+
+@override_settings(PASSWORD_HASH_WORKERS=0)
+class PasswordResetTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="c@example.com",
+                                        email="c@example.com"
+                                        )
+        Profile.objects.create(user=self.user)
+        self.client = APIClient()
+
+    def request_token(self):
+        # User, savepoint, token, outbox row, release; no SMTP
+        with self.assertNumQueries(5):
+            res = self.client.post("/api/forgot_password/",
+                                   {"email": "c@example.com"})
+        self.assertEqual(res.status_code, 200)
+
+        return OutgoingEmail.objects.get().body.rsplit(" ", 1)[1]
+
+    def reset(self, token):
+        return self.client.post(
+            "/api/reset_password/{token}/".format(token=token),
+            {"password": "secret2", "confirmPassword": "secret2"}
+        )
+
+    def test_token_is_stored_as_a_digest_and_mailed_later(self):
+        token = self.request_token()
+
+        self.assertEqual(mail.outbox, [])
+        self.assertNotEqual(Profile.objects.get().reset_password_token,
+                            token)
+
+        call_command("send_queued_emails", stdout=mock.Mock())
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(token, mail.outbox[0].body)
+        self.assertEqual(OutgoingEmail.objects.get().status, EmailStatus.SENT)
+
+        self.assertEqual(self.reset(token).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("secret2"))
+        self.assertEqual(self.reset(token).status_code, 404)
+
+    def test_expired_token_is_refused(self):
+        token = self.request_token()
+        Profile.objects.update(
+            reset_password_expire=timezone.now() - timedelta(minutes=1)
+        )
+
+        res = self.reset(token)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.data, {"error": "Token is expired"})
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_sends_are_retried_then_parked(self):
+        self.request_token()
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend"
+                        ".send_messages", side_effect=OSError("down")), \
+                self.assertLogs("account.outbox", "ERROR"):
+            call_command("send_queued_emails", stdout=mock.Mock())
+            email = OutgoingEmail.objects.get()
+            self.assertEqual((email.status, email.attempts),
+                             (EmailStatus.PENDING, 1))
+
+            OutgoingEmail.objects.update(available_at=timezone.now())
+            call_command("send_queued_emails", stdout=mock.Mock())
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts),
+                         (EmailStatus.FAILED, 2))
+        self.assertIn("down", email.last_error)
+
+
+@override_settings(PASSWORD_HASH_WORKERS=0)
+class ProfileTests(TestCase):
+
+    def test_register_creates_the_profile_with_the_user(self):
+        res = APIClient().post("/api/register/", {
+            "first_name": "Ann", "last_name": "Lee",
+            "email": "ann@example.com", "password": "secret1"
+        })
+
+        self.assertEqual(res.status_code, 201)
+        self.assertTrue(Profile.objects.filter(
+            user__username="ann@example.com").exists())
+
+    def test_saving_a_user_is_a_single_query(self):
+        user = User.objects.get(pk=User.objects.create(username="a").pk)
+        user.first_name = "Ann"
+
+        with self.assertNumQueries(1):
+            user.save()
+
+        self.assertFalse(Profile.objects.exists())
+
+    def test_import_creates_users_and_profiles_in_bulk(self):
+        User.objects.create(username="taken@example.com")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "users.csv")
+            with open(path, "w") as target:
+                target.write("email,first_name,last_name,password\n"
+                             "ann@example.com,Ann,Lee,secret1\n"
+                             "bob@example.com,Bob,Day,\n"
+                             "taken@example.com,Tim,Ken,secret1\n"
+                             "ann@example.com,Ann,Again,secret2\n")
+
+            out = io.StringIO()
+            with CaptureQueriesContext(connection) as queries:
+                call_command("import_users", path, stdout=out)
+
+        self.assertIn("Imported 2 users, skipped 2", out.getvalue())
+        self.assertLess(len(queries), 10)
+
+        ann = User.objects.get(username="ann@example.com")
+        self.assertEqual(ann.last_name, "Lee")
+        self.assertTrue(ann.check_password("secret1"))
+        self.assertFalse(
+            User.objects.get(username="bob@example.com").has_usable_password()
+        )
+        self.assertEqual(Profile.objects.count(), 2)
+
+
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        reset_rate_limits()
+        self.client = APIClient()
+
+    @override_settings(RATE_LIMITS={"forgot_password": (6, 2)})
+    def test_bursts_beyond_the_bucket_get_429(self):
+        statuses = [self.client.post("/api/forgot_password/",
+                                     {"email": "nobody@example.com"}
+                                     ).status_code
+                    for _ in range(3)]
+
+        self.assertEqual(statuses, [404, 404, 429])
+
+        res = self.client.post("/api/forgot_password/",
+                               {"email": "nobody@example.com"})
+        self.assertEqual(res["Retry-After"], "10")
+
+        # Other clients have buckets of their own
+        res = self.client.post("/api/forgot_password/",
+                               {"email": "nobody@example.com"},
+                               REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(res.status_code, 404)
+
+    @override_settings(RATE_LIMITS={"forgot_password": (6, 2)})
+    def test_forwarded_for_does_not_make_a_new_client(self):
+        statuses = [self.client.post("/api/forgot_password/",
+                                     {"email": "nobody@example.com"},
+                                     HTTP_X_FORWARDED_FOR="10.1.0.{n}".format(
+                                         n=n)
+                                     ).status_code
+                    for n in range(3)]
+
+        self.assertEqual(statuses, [404, 404, 429])
+
+    def test_buckets_refill_at_the_rate(self):
+        for buckets in (LocalBuckets(), SharedMemoryBackend()):
+            buckets.reset()
+            self.assertEqual(buckets.take("k", 0.5, 2, 100.0), (True, 0.0))
+            self.assertEqual(buckets.take("k", 0.5, 2, 100.0), (True, 0.0))
+            self.assertEqual(buckets.take("k", 0.5, 2, 101.0), (False, 1.0))
+            self.assertEqual(buckets.take("k", 0.5, 2, 102.0), (True, 0.0))
+
+    def test_shared_memory_is_shared_between_processes(self):
+        SharedMemoryBackend().reset()
+        pid = os.fork()
+        if pid == 0:
+            SharedMemoryBackend().take("k", 1, 1, time.time())
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        allowed, _ = SharedMemoryBackend().take("k", 1, 1, time.time())
+        self.assertFalse(allowed)
@@ -1,17 +1,23 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import (api_view, permission_classes,
+                                       throttle_classes)
 from .serializers import SignUpSerializer, UserSerializer
 from rest_framework.response import Response
 from django.contrib.auth.models import User
-from django.contrib.auth.hashers import make_password
+from .hashing import make_password
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
 from django.utils.crypto import get_random_string
-from django.core.mail import send_mail
-from datetime import datetime, timedelta
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models.functions import Now
+from datetime import timedelta
+from .models import Profile, reset_token_digest
+from .outbox import queue_email
 from django.utils import timezone
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
+from utils.throttling import token_bucket
 
 
 # Create your views here.
@@ -19,6 +25,7 @@ from drf_yasg.utils import swagger_auto_schema
 
 @swagger_auto_schema(method='POST', request_body=SignUpSerializer)
 @api_view(["POST"])
+@throttle_classes([token_bucket("register")])
 def register(request):
     """Register User"""
     data = request.data
@@ -29,13 +36,17 @@ def register(request):
 
         if not User.objects.filter(username=data["email"]).exists():
 
-            user = User.objects.create(
-                first_name=data["first_name"],
-                last_name=data["last_name"],
-                email=data["email"],
-                username=data["email"],
-                password=make_password(data["password"]),
-            )
+            password = make_password(data["password"])
+
+            with transaction.atomic():
+                user = User.objects.create(
+                    first_name=data["first_name"],
+                    last_name=data["last_name"],
+                    email=data["email"],
+                    username=data["email"],
+                    password=password,
+                )
+                Profile.objects.create(user=user)
 
             return Response({"details": "User Registered"},
                             status=status.HTTP_201_CREATED
@@ -108,6 +119,7 @@ def update_user(request):
     )
 )
 @api_view(["POST"])
+@throttle_classes([token_bucket("forgot_password")])
 def forgot_password(request):
     """Forgot Password EndPoint"""
     data = request.data
@@ -117,19 +129,21 @@ def forgot_password(request):
     token = get_random_string(length=40)
     expire_date = timezone.now() + timedelta(minutes=30)
 
-    user.profile.reset_password_token = token
-    user.profile.reset_password_expire = expire_date
+    body = "Your password reset token is: {token}".format(token=token)
 
-    user.profile.save()
+    with transaction.atomic():
+        reset = {"reset_password_token": reset_token_digest(token),
+                 "reset_password_expire": expire_date}
 
-    body = "Your password reset token is: {token}".format(token=token)
+        if not Profile.objects.filter(user=user).update(**reset):
+            Profile.objects.create(user=user, **reset)
 
-    send_mail(
-        "Requested Password Reset Link",
-        body,
-        "noreply@ecommerceapi.com",
-        [data["email"]]
-    )
+        queue_email(
+            "Requested Password Reset Link",
+            body,
+            "noreply@ecommerceapi.com",
+            [data["email"]]
+        )
 
     return Response(
         {"details": "Password reset email sent to: {email}".format(
@@ -154,12 +168,17 @@ def reset_password(request, token):
     """Reset User Password"""
     data = request.data
 
-    user = get_object_or_404(User, profile__reset_password_token=token)
+    profile = get_object_or_404(
+        Profile.objects.select_related("user").annotate(
+            is_expired=ExpressionWrapper(Q(reset_password_expire__lte=Now()),
+                                         output_field=BooleanField()
+                                         )
+        ),
+        reset_password_token=reset_token_digest(token)
+    )
+    user = profile.user
 
-    if (
-        user.profile.reset_password_expire.replace(tzinfo=None) <
-        datetime.now()
-         ):
+    if profile.is_expired:
         return Response({"error": "Token is expired"},
                         status=status.HTTP_400_BAD_REQUEST
                         )
@@ -170,10 +189,10 @@ def reset_password(request, token):
                         )
 
     user.password = make_password(data["password"])
-    user.profile.reset_password_token = ""
-    user.profile.reset_password_expire = None
+    profile.reset_password_token = ""
+    profile.reset_password_expire = None
 
-    user.profile.save()
+    profile.save()
     user.save()
 
     return Response({"details": "Password is now updated"})
@@ -0,0 +1,107 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from benchmarks.runner import BenchmarkRunner, dataset_size, report
+from benchmarks.scenarios import (benchmarked_url_names, build_scenarios,
+                                  create_fixtures)
+from benchmarks.standins import local_services
+
+
+class Command(BaseCommand):
+    help = ("Benchmark every endpoint of the product, order and account "
+            "URLconfs in process, against local stand-ins for S3, SMTP and "
+            "Stripe, and write latency percentiles and query counts as "
+            "JSON. Nothing the run does is committed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=30,
+                            help="Timed requests per endpoint")
+        parser.add_argument("--warmup", type=int, default=3,
+                            help="Untimed requests per endpoint first")
+        parser.add_argument("--only",
+                            help="Comma separated URL names to run")
+        parser.add_argument("--output",
+                            help="File to write the JSON results to")
+        parser.add_argument("--compare",
+                            help="JSON results of an earlier run to "
+                                 "compare with")
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 1 or options["warmup"] < 0:
+            raise CommandError("--iterations has to be at least 1 and "
+                               "--warmup at least 0")
+
+        baseline = None
+        if options["compare"]:
+            try:
+                with open(options["compare"]) as source:
+                    baseline = json.load(source)["endpoints"]
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError("Can not read {path}: {e}".format(
+                    path=options["compare"], e=e))
+
+        dataset = dataset_size()
+        runner = BenchmarkRunner(options["iterations"], options["warmup"])
+
+        with local_services(), transaction.atomic():
+            scenarios = build_scenarios(create_fixtures())
+
+            missing = benchmarked_url_names() - {s.name for s in scenarios}
+            if missing:
+                raise CommandError("No scenario for {names}".format(
+                    names=", ".join(sorted(missing))))
+
+            if options["only"]:
+                only = set(options["only"].split(","))
+                scenarios = [s for s in scenarios if s.name in only]
+
+            self.stdout.write("{0:<26} {1:>6} {2:>9} {3:>9} {4:>9} "
+                              "{5:>8}".format("endpoint", "status", "p50 ms",
+                                              "p95 ms", "p99 ms",
+                                              "queries"))
+            results = runner.run(scenarios, log=self.log_result)
+
+            transaction.set_rollback(True)
+
+        document = report(results, options["iterations"],
+                          options["warmup"], dataset)
+        if options["output"]:
+            with open(options["output"], "w") as target:
+                json.dump(document, target, indent=2)
+
+        if baseline:
+            self.compare(baseline, results)
+
+        failed = [name for name, result in results.items()
+                  if result["unexpected_status"]]
+        if failed:
+            self.stderr.write("Unexpected status codes from {names}".format(
+                names=", ".join(failed)))
+
+    def log_result(self, name, result):
+        latency = result["latency_ms"]
+        self.stdout.write("{0:<26} {1:>6} {2:>9.2f} {3:>9.2f} {4:>9.2f} "
+                          "{5:>8}".format(name, result["status"],
+                                          latency["p50"], latency["p95"],
+                                          latency["p99"],
+                                          result["queries"]["max"]))
+
+    def compare(self, baseline, results):
+        self.stdout.write("\n{0:<26} {1:>10} {2:>10} {3:>8} {4:>9}".format(
+            "endpoint", "p50 before", "p50 now", "change", "queries"))
+
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+
+            old = before["latency_ms"]["p50"]
+            new = result["latency_ms"]["p50"]
+            change = (new - old) / old * 100 if old else 0.0
+            self.stdout.write(
+                "{0:<26} {1:>10.2f} {2:>10.2f} {3:>+7.1f}% {4:>4} -> "
+                "{5:<3}".format(name, old, new, change,
+                                before["queries"]["max"],
+                                result["queries"]["max"]))
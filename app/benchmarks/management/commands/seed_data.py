@@ -0,0 +1,53 @@
+import io
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.seeding import Seeder
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with generated users, products, reviews and "
+            "orders for benchmarks; the same --seed gives the same data")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--reviews-per-product", type=int, default=5)
+        parser.add_argument("--orders", type=int, default=200000)
+        parser.add_argument("--items-per-order", type=int, default=4,
+                            help="Most lines in one order")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="Rows per INSERT and transaction")
+
+    def handle(self, *args, **options):
+        if min(options["users"], options["products"], options["orders"],
+               options["reviews_per_product"],
+               options["items_per_order"]) < 0:
+            raise CommandError("Sizes can not be negative")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size has to be at least 1")
+
+        seeder = Seeder(seed=options["seed"],
+                        batch_size=options["batch_size"],
+                        log=self.stdout.write if options["verbosity"] > 1
+                        else None)
+
+        seeder.users(options["users"])
+        seeder.products(options["products"], options["reviews_per_product"])
+        seeder.orders(options["orders"], options["items_per_order"])
+
+        # Tables the API keeps up to date as orders come in
+        output = self.stdout if options["verbosity"] > 1 else io.StringIO()
+        call_command("rebuild_order_summaries", stdout=output)
+        call_command("update_sales_rollups", "--rebuild", stdout=output)
+        # The seeded orders were all placed just now and are committed
+        call_command("build_recommendations", "--rebuild",
+                     "--settle-seconds", "0", stdout=output)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Seeded {users} users, {products} products and {orders} orders"
+            .format(users=options["users"], products=options["products"],
+                    orders=options["orders"])
+        ))
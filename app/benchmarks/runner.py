@@ -0,0 +1,172 @@
+import platform
+import statistics
+import subprocess
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from account.serializers import ClaimsTokenObtainPairSerializer
+from order.models import Order, OrderItem
+from product.models import Product, Review
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values, share):
+    """Nearest rank percentile of sorted ``values``"""
+    index = max(0, min(len(values) - 1,
+                       int(round(share / 100 * len(values))) - 1))
+    return values[index]
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def dataset_size():
+    return {"users": User.objects.count(),
+            "products": Product.objects.count(),
+            "reviews": Review.objects.count(),
+            "orders": Order.objects.count(),
+            "order_items": OrderItem.objects.count()}
+
+
+class BenchmarkRunner:
+    """Drive scenarios through the real URLconf and middleware, in
+    process, and time them.
+
+    Every request runs in a transaction that is rolled back, so each
+    iteration sees the same data and destructive endpoints can repeat.
+    """
+
+    def __init__(self, iterations=30, warmup=3):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.tokens = {}
+        # Clients build the middleware chain on their first request, so
+        # one is kept per user
+        self.clients = {}
+        self.async_client = AsyncClient(raise_request_exception=False)
+
+    def token(self, user):
+        if user.pk not in self.tokens:
+            self.tokens[user.pk] = str(
+                ClaimsTokenObtainPairSerializer.get_token(user).access_token
+            )
+        return self.tokens[user.pk]
+
+    def client(self, user):
+        key = user.pk if user is not None else None
+        if key not in self.clients:
+            client = self.clients[key] = APIClient(
+                raise_request_exception=False)
+            if user is not None:
+                client.credentials(
+                    HTTP_AUTHORIZATION="Bearer " + self.token(user))
+        return self.clients[key]
+
+    def send(self, scenario):
+        if scenario.stream:
+            return async_to_sync(self.first_chunk)(scenario)
+
+        client = self.client(scenario.user)
+
+        body = scenario.body()
+        if scenario.format == "stripe":
+            return client.post(scenario.path, body.payload,
+                               content_type="application/json",
+                               HTTP_STRIPE_SIGNATURE=body.signature)
+        if body is None:
+            return getattr(client, scenario.method)(scenario.path)
+        return getattr(client, scenario.method)(scenario.path, body,
+                                                format=scenario.format)
+
+    async def first_chunk(self, scenario):
+        response = await self.async_client.get(
+            scenario.path,
+            headers={"Authorization": "Bearer " + self.token(scenario.user)})
+        if response.streaming:
+            stream = response.streaming_content
+            await anext(stream)
+            await stream.aclose()
+        return response
+
+    def measure(self, scenario):
+        """``(seconds, status, queries)`` of one rolled back request"""
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = self.send(scenario)
+                seconds = time.perf_counter() - start
+            transaction.set_rollback(True)
+
+        return seconds, response.status_code, len(queries)
+
+    def run(self, scenarios, log=None):
+        results = {}
+
+        for scenario in scenarios:
+            for _ in range(self.warmup):
+                self.measure(scenario)
+
+            samples = [self.measure(scenario)
+                       for _ in range(self.iterations)]
+            results[scenario.name] = summarize(scenario, samples)
+
+            if log:
+                log(scenario.name, results[scenario.name])
+
+        return results
+
+
+def summarize(scenario, samples):
+    latencies = sorted(seconds * 1000 for seconds, _, _ in samples)
+    statuses = Counter(status for _, status, _ in samples)
+    queries = [count for _, _, count in samples]
+
+    return {
+        "method": scenario.method.upper(),
+        "path": scenario.path,
+        "status": statuses.most_common(1)[0][0],
+        "unexpected_status": sum(count for status, count in statuses.items()
+                                 if status != scenario.status),
+        "latency_ms": {
+            "min": round(latencies[0], 3),
+            "mean": round(statistics.fmean(latencies), 3),
+            **{"p{n}".format(n=n): round(percentile(latencies, n), 3)
+               for n in PERCENTILES},
+            "max": round(latencies[-1], 3),
+        },
+        "queries": {"min": min(queries), "max": max(queries),
+                    "mean": round(statistics.fmean(queries), 2)},
+    }
+
+
+def report(results, iterations, warmup, dataset):
+    """The JSON document of a run, comparable across commits"""
+    return {
+        "commit": current_commit(),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "iterations": iterations,
+        "warmup": warmup,
+        "dataset": dataset,
+        "endpoints": results,
+    }
@@ -0,0 +1,227 @@
+import hashlib
+import hmac
+import json
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+
+from account.hashing import make_password
+from account.models import Profile, reset_token_digest
+from order.models import Order, OrderItem
+from product.models import (Product, ProductImages, ProductRecommendation,
+                            Review)
+from .standins import WEBHOOK_SECRET
+
+# URLconfs whose every endpoint needs a scenario
+BENCHMARKED_URLCONFS = ("product.urls", "order.urls", "account.urls")
+
+PASSWORD = "benchmark-password"
+RESET_TOKEN = "benchmark-reset-token"
+
+SHIPPING = {
+    "street": "1 Main St",
+    "city": "Springfield",
+    "state": "IL",
+    "zip_code": "62701",
+    "phone_no": "555-0100",
+    "country": "US",
+}
+
+# Smallest valid PNG, for image uploads
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000100e5270de4000000"
+    "0049454e44ae426082"
+)
+
+
+class Scenario:
+    """One request to benchmark.
+
+    ``data`` may be a callable returning the body, for bodies that can
+    only be sent once such as uploads. ``stream`` requests are timed to
+    their first chunk.
+    """
+
+    def __init__(self, name, method, path, user=None, data=None,
+                 format="json", status=200, stream=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.user = user
+        self.data = data
+        self.format = format
+        self.status = status
+        self.stream = stream
+
+    def body(self):
+        return self.data() if callable(self.data) else self.data
+
+
+def benchmarked_url_names():
+    """URL names of every endpoint in BENCHMARKED_URLCONFS"""
+    names = set()
+
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns)
+            elif isinstance(pattern, URLPattern) and pattern.name:
+                names.add(pattern.name)
+
+    for urlconf in BENCHMARKED_URLCONFS:
+        walk(get_resolver(urlconf).url_patterns)
+    return names
+
+
+def create_fixtures():
+    """Rows the scenarios act on, next to whatever seed_data made"""
+    password = make_password(PASSWORD)
+    owner = User.objects.create(username="owner@benchmark.invalid",
+                                email="owner@benchmark.invalid",
+                                first_name="Owner", last_name="Bench",
+                                password=password)
+    admin = User.objects.create(username="admin@benchmark.invalid",
+                                email="admin@benchmark.invalid",
+                                password=password, is_staff=True)
+    Profile.objects.create(user=owner,
+                           reset_password_token=reset_token_digest(
+                               RESET_TOKEN),
+                           reset_password_expire=timezone.now() +
+                           timedelta(days=1))
+    Profile.objects.create(user=admin)
+
+    product, other = [
+        Product.objects.create(name=name, description="Benchmark product",
+                               price=25, brand="Acme",
+                               category="Electronics", stock=10 ** 6,
+                               user=owner)
+        for name in ("Benchmark lamp", "Benchmark bulb")
+    ]
+    image = ProductImages.objects.create(
+        product=product,
+        image=SimpleUploadedFile("lamp.png", PNG, "image/png")
+    )
+    Review.objects.create(product=product, user=owner, rating=4,
+                          comment="Bright")
+    ProductRecommendation.objects.create(product=product, recommended=other,
+                                         score=3)
+
+    order = Order.objects.create(user=owner, total_amount=50, **SHIPPING)
+    OrderItem.objects.create(order=order, product=product, name=product.name,
+                             price=25, quantity=2)
+
+    return SimpleNamespace(owner=owner, admin=admin, product=product,
+                           image=image, order=order)
+
+
+def signed_event(session_id):
+    """A checkout.session.completed delivery, signed as Stripe does"""
+    payload = json.dumps({
+        "id": "evt_benchmark",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {"object": {"id": session_id,
+                            "object": "checkout.session",
+                            "amount_total": 2500,
+                            "metadata": SHIPPING}},
+    })
+    timestamp = int(time.time())
+    signature = hmac.new(
+        WEBHOOK_SECRET.encode(),
+        "{t}.{payload}".format(t=timestamp, payload=payload).encode(),
+        hashlib.sha256
+    ).hexdigest()
+
+    return payload, "t={t},v1={sig}".format(t=timestamp, sig=signature)
+
+
+def build_scenarios(f):
+    """A Scenario for every endpoint, acting on the fixtures ``f``"""
+    product = "/api/products/{id}/".format(id=f.product.id)
+    order = "/api/orders/{id}/".format(id=f.order.id)
+    line = {"product": f.product.id, "quantity": 1, "price": 25}
+    payload, signature = signed_event("cs_benchmark")
+
+    return [
+        # product.urls
+        Scenario("products", "get", "/api/products/"),
+        Scenario("new_product", "post", "/api/products/new/", f.owner, {
+            "name": "New lamp", "description": "Fresh", "price": 30,
+            "brand": "Acme", "category": "Electronics", "stock": 5,
+        }),
+        Scenario("upload_product_images", "post",
+                 "/api/products/upload_images/", f.owner,
+                 lambda: {"product": f.product.id,
+                          "images": SimpleUploadedFile("new.png", PNG,
+                                                       "image/png")},
+                 format="multipart"),
+        Scenario("delete_single_image", "delete",
+                 "/api/products/delete_image/{id}/".format(id=f.image.id),
+                 f.owner),
+        Scenario("get_product_detail", "get", product),
+        Scenario("product_recommendations", "get",
+                 product + "recommendations/"),
+        Scenario("update_product", "put", product + "update/", f.owner, {
+            "name": "Benchmark lamp", "description": "Benchmark product",
+            "price": 26, "brand": "Acme", "category": "Electronics",
+            "stock": 10 ** 6, "ratings": 4,
+        }),
+        Scenario("delete_product", "delete", product + "delete/", f.owner),
+        Scenario("create_update_review", "post",
+                 "/api/{id}/reviews/".format(id=f.product.id), f.owner,
+                 {"rating": 5, "comment": "Even brighter"}),
+        Scenario("delete_review", "delete",
+                 "/api/{id}/reviews/delete/".format(id=f.product.id),
+                 f.owner),
+
+        # account.urls
+        Scenario("register", "post", "/api/register/", None, {
+            "first_name": "New", "last_name": "User",
+            "email": "new@benchmark.invalid", "password": PASSWORD,
+        }, status=201),
+        Scenario("current_user", "get", "/api/me/", f.owner),
+        Scenario("update_user", "put", "/api/me/update/", f.owner, {
+            "first_name": "Owner", "last_name": "Bench",
+            "email": f.owner.email, "username": f.owner.username,
+            "password": "",
+        }),
+        Scenario("forgot_password", "post", "/api/forgot_password/", None,
+                 {"email": f.owner.email}),
+        Scenario("reset_password", "post",
+                 "/api/reset_password/{token}/".format(token=RESET_TOKEN),
+                 None, {"password": PASSWORD, "confirmPassword": PASSWORD}),
+
+        # order.urls
+        Scenario("new_order", "post", "/api/orders/new/", f.owner,
+                 {**SHIPPING, "orderItems": [line]}),
+        Scenario("get_orders", "get", "/api/orders/", f.owner),
+        Scenario("order_events", "get", "/api/orders/events/", f.owner,
+                 stream=True),
+        Scenario("order_events_ticket", "post", "/api/orders/events/ticket/",
+                 f.owner),
+        Scenario("bulk_process_orders", "post", "/api/orders/bulk/process/",
+                 f.admin, {"status": "SHIPPED", "orders": [f.order.id]}),
+        Scenario("get_order", "get", order, f.owner),
+        Scenario("process_order", "put", order + "process/", f.admin,
+                 {"status": "SHIPPED"}),
+        Scenario("delete_order", "delete", order + "delete/", f.owner),
+        Scenario("create_checkout_session", "post",
+                 "/api/create-checkout-session/", f.owner,
+                 {**SHIPPING, "orderItems": [line]}),
+        Scenario("stripe_webhook", "post", "/api/order/webhook/", None,
+                 SimpleNamespace(payload=payload, signature=signature),
+                 format="stripe"),
+        Scenario("order_summary", "get", "/api/me/orders/summary/",
+                 f.owner),
+        Scenario("sales_report", "get", "/api/reports/sales/", f.admin),
+
+        # The login behind every session
+        Scenario("token_obtain_pair", "post", "/api/token/", None,
+                 {"username": f.owner.username, "password": PASSWORD}),
+    ]
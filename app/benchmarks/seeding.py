@@ -0,0 +1,175 @@
+import random
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+
+from account.hashing import make_password
+from account.models import Profile
+from order.models import Order, OrderItem, OrderStatus, PaymentStatus
+from product.models import Category, Product, Review
+
+# Seeded users log in with this password
+SEED_PASSWORD = "seed-password"
+SEED_EMAIL = "user{n}@seed.invalid"
+
+BRANDS = ("Acme", "Globex", "Initech", "Umbrella", "Hooli", "Stark",
+          "Wayne", "Wonka", "Tyrell", "Soylent")
+NOUNS = ("Lamp", "Laptop", "Headphones", "Chair", "Poster", "Coffee",
+         "Keyboard", "Camera", "Blender", "Backpack", "Monitor", "Tea")
+ADJECTIVES = ("Compact", "Deluxe", "Classic", "Smart", "Eco", "Pro",
+              "Portable", "Vintage", "Wireless", "Organic")
+COMMENTS = ("Does what it says.", "Great value for the price.",
+            "Arrived late but works fine.", "Would buy again.",
+            "Not what I expected.", "Five stars, no notes.")
+CITIES = (("Springfield", "IL", "62701"), ("Portland", "OR", "97201"),
+          ("Austin", "TX", "73301"), ("Boston", "MA", "02108"),
+          ("Denver", "CO", "80201"))
+
+
+def insert(model, objects, batch_size):
+    """bulk_create ``objects``; returns their ids in order.
+
+    Ids are read back when the database does not return them, which
+    assumes nobody else inserts into the table meanwhile.
+    """
+    if not objects:
+        return []
+
+    last_id = model.objects.aggregate(last=Max("id"))["last"] or 0
+    created = model.objects.bulk_create(objects, batch_size=batch_size)
+    if created[0].pk is not None:
+        return [obj.pk for obj in created]
+
+    return list(model.objects.filter(id__gt=last_id).order_by("id")
+                .values_list("id", flat=True))
+
+
+def batches(count, batch_size):
+    for start in range(0, count, batch_size):
+        yield start, min(batch_size, count - start)
+
+
+class Seeder:
+    """Fills an empty database with a reproducible catalog and history.
+
+    The same ``seed`` and sizes always give the same rows, so benchmark
+    runs on different commits compare like with like.
+    """
+
+    def __init__(self, seed=0, batch_size=5000, log=None):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.user_ids = []
+        # (id, name, price in cents) of the seeded products
+        self.catalog = []
+
+    def users(self, count):
+        password = make_password(SEED_PASSWORD)
+        offset = User.objects.filter(
+            username__endswith="@seed.invalid").count()
+
+        for start, size in batches(count, self.batch_size):
+            with transaction.atomic():
+                ids = insert(User, [
+                    User(username=SEED_EMAIL.format(n=offset + n),
+                         email=SEED_EMAIL.format(n=offset + n),
+                         first_name="User",
+                         last_name=str(offset + n),
+                         password=password)
+                    for n in range(start, start + size)
+                ], self.batch_size)
+                Profile.objects.bulk_create([Profile(user_id=user_id)
+                                             for user_id in ids])
+            self.user_ids += ids
+            self.log("users {done}/{count}".format(done=start + size,
+                                                   count=count))
+
+    def products(self, count, reviews_per_product):
+        categories = [choice for choice, _ in Category.choices]
+
+        for start, size in batches(count, self.batch_size):
+            rows = []
+            ratings = []
+            for _ in range(size):
+                stars = [self.random.randint(1, 5) for _ in range(
+                    min(reviews_per_product, len(self.user_ids)))]
+                ratings.append(stars)
+                rows.append(Product(
+                    name="{adjective} {noun} {n}".format(
+                        adjective=self.random.choice(ADJECTIVES),
+                        noun=self.random.choice(NOUNS),
+                        n=self.random.randint(100, 999)),
+                    description="A seeded product for benchmarks.",
+                    price=Decimal(self.random.randint(199, 99999)) / 100,
+                    brand=self.random.choice(BRANDS),
+                    category=self.random.choice(categories),
+                    stock=self.random.randint(0, 500),
+                    ratings=(Decimal(sum(stars)) / len(stars)).quantize(
+                        Decimal("0.01")) if stars else 0,
+                    user_id=(self.random.choice(self.user_ids)
+                             if self.user_ids else None),
+                ))
+
+            with transaction.atomic():
+                ids = insert(Product, rows, self.batch_size)
+                reviews = []
+                for product_id, stars in zip(ids, ratings):
+                    reviewers = self.random.sample(self.user_ids, len(stars))
+                    reviews += [Review(product_id=product_id,
+                                       user_id=user_id,
+                                       rating=rating,
+                                       comment=self.random.choice(COMMENTS))
+                                for user_id, rating in zip(reviewers, stars)]
+                Review.objects.bulk_create(reviews,
+                                           batch_size=self.batch_size)
+
+            self.catalog += [(product_id, row.name, int(row.price * 100))
+                             for product_id, row in zip(ids, rows)]
+            self.log("products {done}/{count}".format(done=start + size,
+                                                      count=count))
+
+    def orders(self, count, items_per_order):
+        if not self.user_ids or not self.catalog:
+            return
+
+        for start, size in batches(count, self.batch_size):
+            lines = []
+            rows = []
+            for _ in range(size):
+                picked = self.random.sample(
+                    self.catalog, min(self.random.randint(1, items_per_order),
+                                      len(self.catalog)))
+                quantities = [self.random.randint(1, 3) for _ in picked]
+                city, state, zip_code = self.random.choice(CITIES)
+                paid = self.random.random() < 0.8
+
+                lines.append(list(zip(picked, quantities)))
+                rows.append(Order(
+                    street="{n} Main St".format(
+                        n=self.random.randint(1, 999)),
+                    city=city, state=state, zip_code=zip_code,
+                    phone_no="555-0100", country="US",
+                    total_amount=sum(cents * quantity for
+                                     (_, _, cents), quantity in
+                                     zip(picked, quantities)) // 100,
+                    payment_status=(PaymentStatus.PAID if paid
+                                    else PaymentStatus.UNPAID),
+                    status=self.random.choice(OrderStatus.values),
+                    user_id=self.random.choice(self.user_ids),
+                ))
+
+            with transaction.atomic():
+                ids = insert(Order, rows, self.batch_size)
+                OrderItem.objects.bulk_create([
+                    OrderItem(order_id=order_id, product_id=product_id,
+                              name=name, price=Decimal(cents) / 100,
+                              quantity=quantity)
+                    for order_id, order_lines in zip(ids, lines)
+                    for (product_id, name, cents), quantity in order_lines
+                ], batch_size=self.batch_size)
+
+            self.log("orders {done}/{count}".format(done=start + size,
+                                                    count=count))
@@ -0,0 +1,71 @@
+import os
+from contextlib import ExitStack, contextmanager
+
+import stripe
+from django.conf import settings
+from django.test.utils import override_settings
+
+from order.fake_stripe import FakeStripeServer
+from order.stripe_client import StripeHTTPClient
+
+WEBHOOK_SECRET = "whsec_benchmarks"
+
+IN_MEMORY_STORAGE = "django.core.files.storage.InMemoryStorage"
+LOCMEM_EMAIL = "django.core.mail.backends.locmem.EmailBackend"
+
+
+@contextmanager
+def stripe_pointed_at(server):
+    """Send the stripe library's calls to ``server`` for the block"""
+    saved = {name: getattr(stripe, name) for name in
+             ("api_base", "api_key", "default_http_client",
+              "max_network_retries")}
+    stripe.api_base = server.url
+    stripe.api_key = "sk_test_benchmarks"
+    stripe.default_http_client = StripeHTTPClient(timeout=(1, 5))
+    stripe.max_network_retries = 0
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(stripe, name, value)
+
+
+@contextmanager
+def webhook_secret():
+    saved = os.environ.get("STRIPE_WEBHOOK_SECRET")
+    os.environ["STRIPE_WEBHOOK_SECRET"] = WEBHOOK_SECRET
+    try:
+        yield
+    finally:
+        if saved is None:
+            del os.environ["STRIPE_WEBHOOK_SECRET"]
+        else:
+            os.environ["STRIPE_WEBHOOK_SECRET"] = saved
+
+
+@contextmanager
+def local_services():
+    """Run the block against local stand-ins for S3, SMTP and Stripe.
+
+    Uploads go to an in-memory storage, mail to the locmem backend and
+    Stripe calls to a FakeStripeServer over HTTP, so benchmarks measure
+    this code and not the network. Rate limits, strict query budgets and
+    profiling are off. Yields the fake Stripe server.
+    """
+    server = FakeStripeServer().start()
+
+    with ExitStack() as stack:
+        stack.callback(server.stop)
+        stack.enter_context(stripe_pointed_at(server))
+        stack.enter_context(webhook_secret())
+        stack.enter_context(override_settings(
+            STORAGES={**settings.STORAGES,
+                      "default": {"BACKEND": IN_MEMORY_STORAGE}},
+            EMAIL_BACKEND=LOCMEM_EMAIL,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+            RATE_LIMITS={},
+            QUERY_BUDGETS_STRICT=False,
+            PROFILE_DIR="",
+        ))
+        yield server
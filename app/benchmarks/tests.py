@@ -0,0 +1,93 @@
+import io
+import json
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from order.models import DailyCategorySales, Order, UserOrderSummary
+from product.models import Product, Review
+from utils.throttling import reset_rate_limits
+from .scenarios import benchmarked_url_names
+
+# Create your tests here.
+
+
+def setUpModule():
+    reset_rate_limits()
+
+
+def seed(seed=7):
+    call_command("seed_data", "--users", "6", "--products", "12",
+                 "--reviews-per-product", "3", "--orders", "10",
+                 "--items-per-order", "3", "--batch-size", "5",
+                 "--seed", str(seed), stdout=io.StringIO())
+
+
+class SeedDataTests(TestCase):
+
+    def test_seeds_every_table(self):
+        seed()
+
+        self.assertEqual(User.objects.count(), 6)
+        self.assertEqual(Product.objects.count(), 12)
+        self.assertEqual(Review.objects.count(), 36)
+        self.assertEqual(Order.objects.count(), 10)
+        self.assertTrue(Order.objects.filter(orderitems__isnull=False)
+                        .exists())
+        self.assertTrue(UserOrderSummary.objects.exists())
+        self.assertTrue(DailyCategorySales.objects.exists())
+        self.assertEqual(User.objects.filter(profile__isnull=True).count(),
+                         0)
+
+    def test_same_seed_same_data(self):
+        def snapshot():
+            return list(Product.objects.order_by("id").values_list(
+                "name", "price", "category", "ratings"))
+
+        seed()
+        first = snapshot()
+        Order.objects.all().delete()
+        Product.objects.all().delete()
+        User.objects.all().delete()
+
+        seed()
+        self.assertEqual(snapshot(), first)
+
+
+class RunBenchmarksTests(TestCase):
+
+    def test_every_endpoint_is_benchmarked(self):
+        seed()
+        products = Product.objects.count()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            out = io.StringIO()
+            call_command("run_benchmarks", "--iterations", "2",
+                         "--warmup", "0", "--output", path, stdout=out,
+                         stderr=out)
+            with open(path) as source:
+                results = json.load(source)
+
+            call_command("run_benchmarks", "--iterations", "1",
+                         "--warmup", "0", "--only", "products",
+                         "--compare", path, stdout=out)
+
+        self.assertNotIn("Unexpected", out.getvalue())
+        self.assertEqual(set(results["endpoints"]),
+                         benchmarked_url_names() | {"token_obtain_pair"})
+        self.assertEqual(results["dataset"]["products"], 12)
+        for name, result in results["endpoints"].items():
+            self.assertEqual(result["unexpected_status"], 0, name)
+            self.assertLessEqual(result["latency_ms"]["p50"],
+                                 result["latency_ms"]["p99"])
+        self.assertGreater(results["endpoints"]["products"]["queries"]["max"],
+                           0)
+
+        # Nothing the run did is left behind
+        self.assertEqual(Product.objects.count(), products)
+        self.assertFalse(User.objects.filter(
+            username__endswith="@benchmark.invalid").exists())
@@ -56,10 +56,14 @@ INSTALLED_APPS = [
     "account.apps.AccountConfig",
     "rest_framework_simplejwt",
     "order.apps.OrderConfig",
+    "monitoring.apps.MonitoringConfig",
+    "benchmarks.apps.BenchmarksConfig",
     'drf_yasg',
 ]
 
 MIDDLEWARE = [
+    "monitoring.middleware.MetricsMiddleware",
+    "monitoring.slow_queries.SlowQueryMiddleware",
     "django.middleware.security.SecurityMiddleware",
     'whitenoise.middleware.WhiteNoiseMiddleware',
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -68,6 +72,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "monitoring.profiling.ProfilingMiddleware",
 ]
 
 # EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
@@ -86,6 +91,9 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 EMAIL_USE_TLS = True
 
+# Attempts before an email that keeps failing is parked as FAILED
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("EMAIL_OUTBOX_MAX_ATTEMPTS", 5))
+
 
 ROOT_URLCONF = "e_commerce_api.urls"
 
@@ -133,6 +141,46 @@ AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.NumericPasswordValidator", },
 ]
 
+# Hasher for new passwords: pbkdf2_sha256, scrypt, argon2 or bcrypt_sha256
+# (the last two need argon2-cffi or bcrypt). Passwords stored with the
+# others still verify and are rehashed with this one at the next login.
+PASSWORD_HASHER = os.environ.get("PASSWORD_HASHER", "pbkdf2_sha256")
+
+PASSWORD_HASHER_CLASSES = {
+    "pbkdf2_sha256": "account.hashers.PBKDF2PasswordHasher",
+    "scrypt": "django.contrib.auth.hashers.ScryptPasswordHasher",
+    "argon2": "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "bcrypt_sha256": "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "pbkdf2_sha1": "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+}
+
+PASSWORD_HASHERS = [PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    path for name, path in PASSWORD_HASHER_CLASSES.items()
+    if name != PASSWORD_HASHER
+]
+
+# PBKDF2 iterations of new hashes; older hashes are upgraded at login
+PASSWORD_PBKDF2_ITERATIONS = int(
+    os.environ.get("PASSWORD_PBKDF2_ITERATIONS", 720000)
+)
+
+# Processes per web worker that hash and check passwords, 0 to hash on
+# the request thread. With sync gunicorn workers leave it at 0: the
+# request waits for the hash either way and the pool only adds a round
+# trip (bench_login: 3.3 logins/s inline, 3.1 pooled). Turn it on for
+# threaded or ASGI workers, where it caps the hashes running at once and
+# turns a burst of logins into 503s instead of starving other requests.
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 0))
+
+# Password operations a web worker lets queue for the pool, and the
+# seconds a request waits for a place before it gets a 503
+PASSWORD_HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", 16))
+PASSWORD_HASH_WAIT_SECONDS = float(
+    os.environ.get("PASSWORD_HASH_WAIT_SECONDS", 5)
+)
+
+AUTHENTICATION_BACKENDS = ["account.backends.PooledModelBackend"]
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
@@ -155,7 +203,7 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 
 STORAGES = {
     "default": {
-        "BACKEND": "storages.backends.s3boto3.S3Boto3Storage",
+        "BACKEND": "monitoring.storage.TimedS3Storage",
     },
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
@@ -182,13 +230,18 @@ REST_FRAMEWORK = {
     "EXCEPTION_HANDLER":
     "utils.custom_exception_handler.custom_exception_handler",
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "account.authentication.StatelessJWTAuthentication",
     ),
     'DEFAULT_PARSER_CLASSES': (
         'rest_framework.parsers.JSONParser',
         'rest_framework.parsers.FormParser',
         'rest_framework.parsers.MultiPartParser',
-    )
+    ),
+    # Reverse proxies in front of the app that append to X-Forwarded-For.
+    # Rate limits key on the client address; with 0, as when gunicorn
+    # faces clients directly, the header is ignored since anyone can
+    # send it.
+    "NUM_PROXIES": int(os.environ.get("NUM_PROXIES", 0)),
 }
 
 SIMPLE_JWT = {
@@ -196,9 +249,176 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
     "BLACKLIST_AFTER_ROTATION": True,
     "AUTH_HEADER_TYPES": ("Bearer",),
-    "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken", )
+    "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken", ),
+    "TOKEN_OBTAIN_SERIALIZER":
+    "account.serializers.ClaimsTokenObtainPairSerializer",
+}
+
+# Token bucket limits per scope as (requests per minute, burst), per
+# client IP, or per user once signed in. Scopes left out are unlimited.
+RATE_LIMITS = {
+    "login": (30, 20),
+    "register": (10, 5),
+    "forgot_password": (5, 5),
+    "checkout": (30, 20),
+}
+
+# Where the buckets shared by the web workers live: SharedMemoryBackend
+# for the workers of one host, CacheBackend to share RATE_LIMIT_CACHE
+# between hosts
+RATE_LIMIT_BACKEND = os.environ.get(
+    "RATE_LIMIT_BACKEND", "utils.throttling.SharedMemoryBackend"
+)
+RATE_LIMIT_CACHE = os.environ.get("RATE_LIMIT_CACHE", "default")
+RATE_LIMIT_SHM_PATH = os.environ.get(
+    "RATE_LIMIT_SHM_PATH", "/dev/shm/e_commerce_api-ratelimit"
+)
+RATE_LIMIT_SHM_SLOTS = int(os.environ.get("RATE_LIMIT_SHM_SLOTS", 65536))
+
+# Seconds a process trusts that a token version has not been revoked
+AUTH_TOKEN_CACHE_SECONDS = int(os.environ.get("AUTH_TOKEN_CACHE_SECONDS", 30))
+
+# Minutes a Stripe checkout holds its stock. Stripe expires the session at
+# the same time and accepts 30 minutes to 24 hours.
+STOCK_RESERVATION_MINUTES = int(
+    os.environ.get("STOCK_RESERVATION_MINUTES", 35)
+)
+
+# Attempts before a Stripe event that keeps failing is parked as FAILED
+STRIPE_EVENT_MAX_ATTEMPTS = int(
+    os.environ.get("STRIPE_EVENT_MAX_ATTEMPTS", 8)
+)
+
+# Seconds a Stripe product id -> local product mapping is cached
+STRIPE_PRODUCT_CACHE_SECONDS = int(
+    os.environ.get("STRIPE_PRODUCT_CACHE_SECONDS", 3600)
+)
+
+# Seconds to wait for Stripe to accept a connection and to answer
+STRIPE_CONNECT_TIMEOUT = float(os.environ.get("STRIPE_CONNECT_TIMEOUT", 3))
+STRIPE_READ_TIMEOUT = float(os.environ.get("STRIPE_READ_TIMEOUT", 10))
+
+# Retries of a failed Stripe call, with jittered exponential backoff
+STRIPE_MAX_RETRIES = int(os.environ.get("STRIPE_MAX_RETRIES", 2))
+
+# Keep-alive connections to Stripe kept open per worker thread
+STRIPE_POOL_SIZE = int(os.environ.get("STRIPE_POOL_SIZE", 10))
+
+# Failures in a row after which Stripe calls fail fast, and for how long
+STRIPE_BREAKER_THRESHOLD = int(
+    os.environ.get("STRIPE_BREAKER_THRESHOLD", 5)
+)
+STRIPE_BREAKER_RESET_SECONDS = float(
+    os.environ.get("STRIPE_BREAKER_RESET_SECONDS", 30)
+)
+
+# Alternative Stripe API url, e.g. the fake_stripe server in load tests
+STRIPE_API_BASE = os.environ.get("STRIPE_API_BASE", "")
+
+# Row count above which an order listing shows PostgreSQL's estimate
+# instead of counting, and the seconds such an estimate is cached
+ORDER_COUNT_CACHE_SECONDS = int(
+    os.environ.get("ORDER_COUNT_CACHE_SECONDS", 60)
+)
+ORDER_COUNT_ESTIMATE_ABOVE = int(
+    os.environ.get("ORDER_COUNT_ESTIMATE_ABOVE", 1000000)
+)
+
+# Broker of the order event streams. LocalBroker only reaches subscribers
+# in the publishing process; use utils.pubsub.PostgresBroker when web,
+# ASGI and worker processes are separate.
+PUBSUB_BROKER = os.environ.get("PUBSUB_BROKER", "utils.pubsub.LocalBroker")
+
+# Seconds between keep-alive comments on idle order event streams
+ORDER_EVENTS_HEARTBEAT_SECONDS = int(
+    os.environ.get("ORDER_EVENTS_HEARTBEAT_SECONDS", 20)
+)
+
+# Seconds a ticket from orders/events/ticket/ can be used to open a stream
+ORDER_EVENTS_TICKET_SECONDS = int(
+    os.environ.get("ORDER_EVENTS_TICKET_SECONDS", 30)
+)
+
+# Orders one bulk status update may change
+BULK_ORDER_MAX_ROWS = int(os.environ.get("BULK_ORDER_MAX_ROWS", 10000))
+
+# Update the sales rollups in the transaction of every order (True), or
+# leave it to the update_sales_rollups batch job (False)
+SALES_ROLLUP_INLINE = os.environ.get("SALES_ROLLUP_INLINE", "True") == "True"
+
+# Hours a response is replayed for a repeated Idempotency-Key
+IDEMPOTENCY_KEY_HOURS = int(os.environ.get("IDEMPOTENCY_KEY_HOURS", 24))
+
+# Seconds after which a request holding an Idempotency-Key is presumed
+# dead and the key can be claimed again
+IDEMPOTENCY_LOCK_SECONDS = int(
+    os.environ.get("IDEMPOTENCY_LOCK_SECONDS", 120)
+)
+
+# Share of the requests timed by phase and checked for N+1 queries and
+# query budgets (0 to 1); every request is counted in /metrics either way.
+# Staff and profiled requests get the timings in a Server-Timing header.
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", 0.01))
+
+# Directory shared by the worker processes so /metrics adds them all up;
+# empty to report the metrics of the process that answers only
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+
+# Seconds between writes of a worker's metrics to METRICS_DIR
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 5))
+
+# Bearer token required to read /metrics, empty to turn /metrics off
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Times one statement may run in a sampled request before it is logged
+# as an N+1 query, 0 to not look for them
+NPLUSONE_THRESHOLD = int(os.environ.get("NPLUSONE_THRESHOLD", 4))
+
+# Most queries a sampled request may run, by URL name. Over budget views
+# are logged, or fail with QUERY_BUDGETS_STRICT, which tests turn on.
+QUERY_BUDGETS = {
+    "products": 5,
+    "get_product_detail": 5,
+    "product_recommendations": 3,
+    "get_orders": 5,
+    "get_order": 4,
+    "order_summary": 2,
+    "sales_report": 3,
+    "current_user": 2,
+    "token_obtain_pair": 8,
 }
 
+QUERY_BUDGETS_STRICT = os.environ.get("QUERY_BUDGETS_STRICT",
+                                      "False") == "True"
+
+TEST_RUNNER = "monitoring.runner.QueryBudgetTestRunner"
+
+# Milliseconds from which a query is captured with its plan for
+# `manage.py slow_queries` and /api/reports/slow-queries/, 0 to not
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 0))
+
+# Slow queries kept per process, the oldest are dropped
+SLOW_QUERY_BUFFER = int(os.environ.get("SLOW_QUERY_BUFFER", 100))
+
+# Milliseconds after which PostgreSQL cancels a query of a request, 0 for
+# no limit; STATEMENT_TIMEOUTS overrides it by URL name
+STATEMENT_TIMEOUT_MS = int(os.environ.get("STATEMENT_TIMEOUT_MS", 0))
+
+STATEMENT_TIMEOUTS = {}
+
+# Directory request profiles are written to; profiling is off when empty
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "")
+
+# Share of the requests profiled (0 to 1), besides those sent with a
+# token from `manage.py request_profiles token`
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+
+# Seconds a profiling token stays valid
+PROFILE_TOKEN_MAX_AGE = int(os.environ.get("PROFILE_TOKEN_MAX_AGE", 3600))
+
+# Profiles kept in PROFILE_DIR, the oldest are removed
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 500))
+
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
         'Bearer': {
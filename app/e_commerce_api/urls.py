@@ -20,6 +20,7 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from utils.throttling import token_bucket
 import os
 import dotenv
 dotenv.load_dotenv()
@@ -40,7 +41,11 @@ urlpatterns = [
     path("api/", include("product.urls")),
     path("api/", include("account.urls")),
     path("api/", include("order.urls")),
-    path('api/token/', TokenObtainPairView.as_view(),
+    path("", include("monitoring.urls")),
+    path('api/token/',
+         TokenObtainPairView.as_view(
+             throttle_classes=[token_bucket("login")]
+         ),
          name='token_obtain_pair'),
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0),
          name='schema-json'),
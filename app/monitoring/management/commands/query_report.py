@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.metrics import collect
+
+
+class Command(BaseCommand):
+    help = ("List the endpoints with the most queries per request, N+1 "
+            "queries and broken query budgets, from the metrics the workers "
+            "write to METRICS_DIR")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=20,
+                            help="Endpoints listed")
+
+    def handle(self, *args, **options):
+        if not settings.METRICS_DIR:
+            raise CommandError("Set METRICS_DIR to the directory the "
+                               "workers write their metrics to")
+
+        snapshot = collect()
+        endpoints = {}
+        for key, value in snapshot["phases"].items():
+            route, phase = key.split("|")
+            if phase in ("queries", "sampled"):
+                endpoints.setdefault(route, {"queries": 0, "sampled": 0,
+                                             "over_budget": 0,
+                                             "sources": {}})[phase] = value
+        for key, value in snapshot["repeated"].items():
+            route, source = key.split("|")
+            if route in endpoints:
+                endpoints[route]["sources"][source] = value
+        for route, value in snapshot["over_budget"].items():
+            if route in endpoints:
+                endpoints[route]["over_budget"] = value
+
+        if not endpoints:
+            raise CommandError("No sampled requests yet")
+
+        def badness(item):
+            stats = item[1]
+            return (stats["over_budget"] + sum(stats["sources"].values()),
+                    stats["queries"] / stats["sampled"])
+
+        self.stdout.write("{0:<40} {1:>8} {2:>9} {3:>11}  {4}".format(
+            "endpoint", "requests", "queries", "over budget", "N+1 from"))
+        ranked = sorted(endpoints.items(), key=badness, reverse=True)
+        for route, stats in ranked[:options["limit"]]:
+            self.stdout.write("{0:<40} {1:>8} {2:>9.1f} {3:>11}  {4}".format(
+                route, stats["sampled"], stats["queries"] / stats["sampled"],
+                stats["over_budget"],
+                ", ".join("{0} ({1})".format(source, count)
+                          for source, count in sorted(
+                              stats["sources"].items(),
+                              key=lambda item: -item[1])) or "-"
+            ))
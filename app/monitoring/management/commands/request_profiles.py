@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.profiling import (PROFILE_HEADER, list_profiles,
+                                  load_profile, sign_profile_token)
+
+SORT_KEYS = ("cumulative", "tottime", "ncalls")
+
+
+class Command(BaseCommand):
+    help = ("List, show and summarize the request profiles in PROFILE_DIR, "
+            "or print a header that has a request profiled")
+
+    def add_arguments(self, parser):
+        parser.add_argument("action",
+                            choices=("list", "show", "summary", "token"))
+        parser.add_argument("name", nargs="?",
+                            help="Profile to show, as listed")
+        parser.add_argument("--view",
+                            help="Only profiles of this URL name, e.g. "
+                                 "products or stripe_webhook")
+        parser.add_argument("--sort", choices=SORT_KEYS,
+                            default="cumulative")
+        parser.add_argument("--limit", type=int, default=20,
+                            help="Profiles listed or functions shown")
+
+    def handle(self, *args, **options):
+        if options["action"] == "token":
+            self.stdout.write("{header}: {token}".format(
+                header=PROFILE_HEADER, token=sign_profile_token()))
+            return
+
+        if not settings.PROFILE_DIR:
+            raise CommandError("PROFILE_DIR is not set")
+
+        profiles = list_profiles()
+        if options["view"]:
+            profiles = [profile for profile in profiles
+                        if profile["view"] == options["view"]]
+
+        if options["action"] == "list":
+            for profile in profiles[:options["limit"]]:
+                self.stdout.write(
+                    "{name}  {view} {status} {ms}ms".format(**profile))
+
+        elif options["action"] == "show":
+            if not options["name"]:
+                raise CommandError("Name the profile to show")
+            try:
+                stats = load_profile(options["name"], self.stdout)
+            except FileNotFoundError:
+                raise CommandError("No profile {name}".format(
+                    name=options["name"]))
+            stats.sort_stats(options["sort"]).print_stats(options["limit"])
+
+        else:
+            self.summarize(profiles, options)
+
+    def summarize(self, profiles, options):
+        if not profiles:
+            raise CommandError("No profiles to summarize")
+
+        by_view = {}
+        for profile in profiles:
+            by_view.setdefault(profile["view"], []).append(profile["ms"])
+
+        self.stdout.write("view                      profiles  median  "
+                          "max (ms)")
+        for view, times in sorted(by_view.items()):
+            times.sort()
+            self.stdout.write("{view:<25} {count:>8}  {median:>6}  "
+                              "{max:>6}".format(
+                                  view=view, count=len(times),
+                                  median=times[len(times) // 2],
+                                  max=times[-1]))
+
+        stats = load_profile(profiles[0]["name"], self.stdout)
+        for profile in profiles[1:]:
+            stats.add(load_profile(profile["name"]))
+
+        self.stdout.write("\nFunctions over all {count} profiles".format(
+            count=len(profiles)))
+        stats.sort_stats(options["sort"]).print_stats(options["limit"])
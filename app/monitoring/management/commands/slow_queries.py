@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.slow_queries import slow_queries
+
+
+class Command(BaseCommand):
+    help = ("Print the latest queries slower than SLOW_QUERY_MS with their "
+            "view, parameters and plan, as written to METRICS_DIR")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--view", help="Only queries of this URL name")
+        parser.add_argument("--limit", type=int, default=20)
+
+    def handle(self, *args, **options):
+        if not settings.METRICS_DIR:
+            raise CommandError("Set METRICS_DIR to the directory the "
+                               "workers write their slow queries to")
+
+        entries = slow_queries()
+        if options["view"]:
+            entries = [entry for entry in entries
+                       if entry["view"] == options["view"]]
+
+        for entry in entries[:options["limit"]]:
+            self.stdout.write(self.style.WARNING(
+                "{at}  {view}  {ms}ms".format(**entry)))
+            self.stdout.write(entry["sql"])
+            self.stdout.write("params: {params}".format(**entry))
+            self.stdout.write(entry["plan"] or "(plan pending)")
+            self.stdout.write("")
@@ -0,0 +1,367 @@
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Latency histograms, of the requests and of the calls to other services
+HISTOGRAMS = ("latency", "upstream_latency")
+
+# Counters kept besides the latency histograms, added up across workers.
+# breakers_open is 1 or 0 per worker, so the sum is the workers whose
+# circuit breaker is open.
+COUNTERS = ("requests", "phases", "repeated", "over_budget",
+            "upstream_rejected", "breakers_open")
+
+
+class Registry:
+    """Request metrics of this process.
+
+    With METRICS_DIR set the process also writes them to
+    ``METRICS_DIR/<pid>.json`` at most every METRICS_FLUSH_SECONDS, so
+    /metrics can add up every gunicorn worker whichever one it hits. The
+    file records when its process started, so the files of workers that
+    have exited are told apart even when a new one got the same pid.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while the file is written, so one thread writes at a time
+        self.flush_lock = threading.Lock()
+        self.flushed_at = 0.0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # {"route|method": [bucket counts..., sum]}
+            self.latency = {}
+            # {"route|method|status": count}
+            self.requests = {}
+            # {"route|phase": seconds}, and "route|queries" and
+            # "route|sampled": counts
+            self.phases = {}
+            # {"route|source": requests with N+1 queries from source}
+            self.repeated = {}
+            # {"route": requests over their query budget}
+            self.over_budget = {}
+            # {"service|outcome": [bucket counts..., sum]} of the calls to
+            # Stripe and the like, outcome being "ok" or "error"
+            self.upstream_latency = {}
+            # {"service": calls refused by the open circuit breaker}
+            self.upstream_rejected = {}
+            # {"service": 1 while its circuit breaker is open, else 0}
+            self.breakers_open = {}
+
+    def observe(self, route, method, status, seconds, timings=None,
+                repeated=(), over_budget=False):
+        """Count one request; ``timings`` of the sampled ones add phases,
+        ``repeated`` the sources of its N+1 queries"""
+        key = "{0}|{1}".format(route, method)
+
+        with self.lock:
+            add_to_histogram(self.latency, key, seconds)
+
+            status_key = "{0}|{1}".format(key, status)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+
+            if timings is not None:
+                for phase, phase_seconds in timings.phases.items():
+                    phase_key = "{0}|{1}".format(route, phase)
+                    self.phases[phase_key] = (
+                        self.phases.get(phase_key, 0.0) + phase_seconds)
+                for phase, value in (("queries", timings.queries),
+                                     ("sampled", 1)):
+                    phase_key = "{0}|{1}".format(route, phase)
+                    self.phases[phase_key] = (self.phases.get(phase_key, 0) +
+                                              value)
+
+            for source in repeated:
+                source_key = "{0}|{1}".format(route, source)
+                self.repeated[source_key] = (
+                    self.repeated.get(source_key, 0) + 1)
+            if over_budget:
+                self.over_budget[route] = self.over_budget.get(route, 0) + 1
+
+        if settings.METRICS_DIR:
+            self.flush()
+
+    def observe_call(self, service, seconds, error=False, breaker_open=False):
+        """Count one call to ``service``, e.g. Stripe, and the state of its
+        circuit breaker after it"""
+        key = "{0}|{1}".format(service, "error" if error else "ok")
+
+        with self.lock:
+            add_to_histogram(self.upstream_latency, key, seconds)
+            self.breakers_open[service] = int(breaker_open)
+
+        if settings.METRICS_DIR:
+            self.flush()
+
+    def reject_call(self, service):
+        """Count a call to ``service`` its open circuit breaker refused"""
+        with self.lock:
+            self.upstream_rejected[service] = (
+                self.upstream_rejected.get(service, 0) + 1)
+            self.breakers_open[service] = 1
+
+        if settings.METRICS_DIR:
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = {family: dict(getattr(self, family))
+                        for family in COUNTERS}
+            for family in HISTOGRAMS:
+                snapshot[family] = {key: list(histogram) for key, histogram
+                                    in getattr(self, family).items()}
+            return snapshot
+
+    def flush(self, force=False):
+        with self.flush_lock:
+            now = time.monotonic()
+            if (not force and
+                    now - self.flushed_at < settings.METRICS_FLUSH_SECONDS):
+                return
+            self.flushed_at = now
+
+            write_worker_file("", self.snapshot())
+
+
+def add_to_histogram(histograms, key, seconds):
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            break
+    else:
+        index = len(LATENCY_BUCKETS)
+    histogram[index] += 1
+    histogram[-1] += seconds
+
+
+registry = Registry()
+
+
+def process_started(pid):
+    """When process ``pid`` started, in clock ticks since boot, or None
+    when there is no such process"""
+    try:
+        with open("/proc/{0}/stat".format(pid)) as stat:
+            # The command name may hold spaces; starttime is the 20th
+            # field after it
+            return int(stat.read().rsplit(")", 1)[1].split()[19])
+    except FileNotFoundError:
+        if os.path.isdir("/proc"):
+            return None
+    except (OSError, IndexError, ValueError):
+        pass
+
+    # No procfs: all there is to tell is whether the pid is in use
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return 0
+
+
+def write_worker_file(prefix, data):
+    """Replace ``METRICS_DIR/<prefix><pid>.json`` with ``data``.
+
+    The file also records when this process started, see worker_files().
+    It is written to a temporary file of its own first, so concurrent
+    writers never see a half written file. Errors are logged rather than
+    raised: losing a write is better than failing the request.
+    """
+    path = os.path.join(settings.METRICS_DIR, "{prefix}{pid}.json".format(
+        prefix=prefix, pid=os.getpid()))
+    data = {**data, "started": process_started(os.getpid())}
+
+    try:
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=settings.METRICS_DIR,
+                                         prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as target:
+                json.dump(data, target)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+    except OSError:
+        logger.warning("Could not write %s", path, exc_info=True)
+
+
+def worker_files(prefix):
+    """The data of the ``METRICS_DIR/<prefix><pid>.json`` files written by
+    processes that are still running.
+
+    Files left by processes that are gone, or whose pid was taken by a
+    newer process, are removed.
+    """
+    for path in glob.glob(os.path.join(settings.METRICS_DIR,
+                                       prefix + "[0-9]*.json")):
+        pid = os.path.basename(path)[len(prefix):-len(".json")]
+        if not pid.isdigit():
+            continue
+
+        try:
+            with open(path) as source:
+                data = json.load(source)
+        except (OSError, ValueError):
+            continue
+
+        if data.get("started") != process_started(int(pid)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+
+        yield data
+
+
+def collect():
+    """Metrics of every process writing to METRICS_DIR, or of this one.
+
+    Files of processes that are gone are skipped and removed, so a
+    restart does not count their requests twice.
+    """
+    if not settings.METRICS_DIR:
+        return registry.snapshot()
+
+    registry.flush(force=True)
+    merged = {family: {} for family in HISTOGRAMS + COUNTERS}
+
+    for snapshot in worker_files(""):
+        for family in HISTOGRAMS:
+            for key, histogram in snapshot.get(family, {}).items():
+                total = merged[family].setdefault(key, [0] * len(histogram))
+                for index, value in enumerate(histogram):
+                    total[index] += value
+        for family in COUNTERS:
+            for key, value in snapshot.get(family, {}).items():
+                merged[family][key] = merged[family].get(key, 0) + value
+
+    return merged
+
+
+def escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def histogram_lines(name, labels, histogram):
+    """Bucket, sum and count lines of one histogram kept by Registry"""
+    lines = []
+    count = 0
+    for bound, value in zip(LATENCY_BUCKETS + ("+Inf",), histogram):
+        count += value
+        lines.append('{name}_bucket{{{labels},le="{le}"}} {count}'.format(
+            name=name, labels=labels, le=bound, count=count))
+    lines.append("{0}_sum{{{1}}} {2}".format(name, labels, histogram[-1]))
+    lines.append("{0}_count{{{1}}} {2}".format(name, labels, count))
+    return lines
+
+
+def render_prometheus(snapshot):
+    """The Prometheus text exposition of a collect() snapshot"""
+    lines = [
+        "# HELP http_request_duration_seconds Latency of the requests.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for key, histogram in sorted(snapshot["latency"].items()):
+        route, method = key.split("|")
+        lines += histogram_lines(
+            "http_request_duration_seconds",
+            'route="{0}",method="{1}"'.format(escape(route), method),
+            histogram)
+
+    lines += ["# HELP http_requests_total Requests by response status.",
+              "# TYPE http_requests_total counter"]
+    for key, value in sorted(snapshot["requests"].items()):
+        route, method, status = key.split("|")
+        lines.append('http_requests_total{{route="{0}",method="{1}",'
+                     'status="{2}"}} {3}'.format(escape(route), method,
+                                                 status, value))
+
+    phases = sorted(key.split("|") + [value]
+                    for key, value in snapshot["phases"].items())
+
+    lines += ["# HELP http_request_db_queries_total Database queries run "
+              "by the sampled requests.",
+              "# TYPE http_request_db_queries_total counter"]
+    for route, phase, value in phases:
+        if phase == "queries":
+            lines.append('http_request_db_queries_total{{route="{0}"}} '
+                         '{1}'.format(escape(route), value))
+
+    lines += ["# HELP http_request_phase_seconds_total Time the sampled "
+              "requests spent in the database, rendering, calls to Stripe "
+              "or S3 and the rest of the app.",
+              "# TYPE http_request_phase_seconds_total counter"]
+    for route, phase, value in phases:
+        if phase not in ("queries", "sampled"):
+            lines.append('http_request_phase_seconds_total{{route="{0}",'
+                         'phase="{1}"}} {2}'.format(escape(route), phase,
+                                                    value))
+
+    lines += ["# HELP http_requests_sampled_total Requests timed by phase.",
+              "# TYPE http_requests_sampled_total counter"]
+    for route, phase, value in phases:
+        if phase == "sampled":
+            lines.append('http_requests_sampled_total{{route="{0}"}} '
+                         '{1}'.format(escape(route), value))
+
+    lines += ["# HELP http_request_repeated_queries_total Sampled requests "
+              "that ran one statement over and over, by where it came from.",
+              "# TYPE http_request_repeated_queries_total counter"]
+    for key, value in sorted(snapshot["repeated"].items()):
+        route, source = key.split("|")
+        lines.append('http_request_repeated_queries_total{{route="{0}",'
+                     'source="{1}"}} {2}'.format(escape(route),
+                                                 escape(source), value))
+
+    lines += ["# HELP http_request_over_query_budget_total Sampled requests "
+              "that ran more queries than the budget of their view.",
+              "# TYPE http_request_over_query_budget_total counter"]
+    for route, value in sorted(snapshot["over_budget"].items()):
+        lines.append('http_request_over_query_budget_total{{route="{0}"}} '
+                     '{1}'.format(escape(route), value))
+
+    lines += ["# HELP upstream_call_duration_seconds Latency of the calls "
+              "to Stripe and other services, by whether they failed.",
+              "# TYPE upstream_call_duration_seconds histogram"]
+    for key, histogram in sorted(snapshot["upstream_latency"].items()):
+        service, outcome = key.split("|")
+        lines += histogram_lines(
+            "upstream_call_duration_seconds",
+            'service="{0}",outcome="{1}"'.format(escape(service), outcome),
+            histogram)
+
+    lines += ["# HELP upstream_calls_rejected_total Calls not made because "
+              "the circuit breaker of the service was open.",
+              "# TYPE upstream_calls_rejected_total counter"]
+    for service, value in sorted(snapshot["upstream_rejected"].items()):
+        lines.append('upstream_calls_rejected_total{{service="{0}"}} '
+                     '{1}'.format(escape(service), value))
+
+    lines += ["# HELP upstream_circuit_open Workers whose circuit breaker "
+              "for the service is open.",
+              "# TYPE upstream_circuit_open gauge"]
+    for service, value in sorted(snapshot["breakers_open"].items()):
+        lines.append('upstream_circuit_open{{service="{0}"}} '
+                     '{1}'.format(escape(service), value))
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,120 @@
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import timing
+from .metrics import registry
+from .profiling import PROFILE_FILE_HEADER, has_profile_token
+from .queries import QueryAudit, enforce_budget, over_budget
+
+# Route label of requests that matched no URL pattern
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def route_of(request):
+    """The URL pattern that served ``request``, e.g. api/orders/<str:pk>/"""
+    match = getattr(request, "resolver_match", None)
+    if match is None or not match.route:
+        return UNMATCHED_ROUTE
+    return "/" + match.route
+
+
+def view_name(request):
+    """URL name of the view that served ``request``, e.g. get_orders"""
+    match = getattr(request, "resolver_match", None)
+    if match is None or not match.url_name:
+        return UNMATCHED_ROUTE
+    return match.url_name
+
+
+def server_timing(timings, total):
+    """Server-Timing header value of a sampled request"""
+    entries = []
+    for phase, seconds in timings.phases.items():
+        entry = "{0};dur={1:.1f}".format(phase, seconds * 1000)
+        if phase == "db":
+            entry += ';desc="{0} queries"'.format(timings.queries)
+        entries.append(entry)
+    entries.append("total;dur={0:.1f}".format(total * 1000))
+
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """Count and time every request for /metrics.
+
+    A METRICS_SAMPLE_RATE share of the requests, and every request with
+    a profiling token, is also timed by phase: database queries,
+    rendering, and the Stripe and S3 calls wrapped in ``timing.timed``.
+    Those have their queries checked for N+1 patterns
+    (NPLUSONE_THRESHOLD) and against the QUERY_BUDGETS of their view;
+    staff and profiled requests get the timings in a Server-Timing
+    header. Keep it first in MIDDLEWARE so the time of the other
+    middleware counts too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+
+        if (random.random() >= settings.METRICS_SAMPLE_RATE and
+                not (settings.PROFILE_DIR and has_profile_token(request))):
+            response = self.get_response(request)
+            registry.observe(route_of(request), request.method,
+                             response.status_code,
+                             time.perf_counter() - start)
+            return response
+
+        token = timing.begin()
+        timings = timing.current()
+        audit = None
+        try:
+            with ExitStack() as wrappers:
+                connection = connections["default"]
+                wrappers.enter_context(
+                    connection.execute_wrapper(timings.record_query))
+                if settings.NPLUSONE_THRESHOLD:
+                    audit = QueryAudit(settings.NPLUSONE_THRESHOLD)
+                    wrappers.enter_context(connection.execute_wrapper(audit))
+
+                response = self.get_response(request)
+        finally:
+            timing.end(token)
+
+        total = time.perf_counter() - start
+        # Whatever the request did besides queries, rendering and outbound
+        # calls, serializers included
+        timings.add("app", max(0.0, total - sum(timings.phases.values())))
+        # Only set by now, DRF authenticates in the view
+        user = getattr(request, "user", None)
+        if getattr(user, "is_staff", False) or PROFILE_FILE_HEADER in response:
+            response["Server-Timing"] = server_timing(timings, total)
+
+        view = view_name(request)
+        repeated = audit.report(view) if audit else ()
+        broken = over_budget(view, timings.queries)
+        registry.observe(route_of(request), request.method,
+                         response.status_code, total, timings,
+                         repeated=repeated, over_budget=bool(broken))
+        if broken:
+            enforce_budget(broken)
+
+        return response
+
+    def process_template_response(self, request, response):
+        # Being first, this runs right before the response is rendered
+        timings = timing.current()
+        if timings is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                timings.add("render", time.perf_counter() - started)
+
+            response.add_post_render_callback(rendered)
+
+        return response
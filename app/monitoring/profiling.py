@@ -0,0 +1,151 @@
+import cProfile
+import gzip
+import io
+import marshal
+import os
+import pstats
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core import signing
+
+# Header carrying a token from sign_profile_token() to profile a request
+PROFILE_HEADER = "X-Profile-Token"
+# Response header naming the profile written for the request
+PROFILE_FILE_HEADER = "X-Profile"
+
+SIGNING_SALT = "monitoring.profiling"
+
+PROFILE_NAME = re.compile(
+    r"^(?P<stamp>\d{8}T\d{6}\.\d{6})-(?P<view>.+)-(?P<status>\d{3})-"
+    r"(?P<ms>\d+)ms\.prof\.gz$"
+)
+
+
+def sign_profile_token():
+    """A PROFILE_HEADER value valid for PROFILE_TOKEN_MAX_AGE seconds"""
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign("profile")
+
+
+def has_profile_token(request):
+    """Whether ``request`` carries a valid, unexpired profiling token"""
+    token = request.headers.get(PROFILE_HEADER)
+    if not token:
+        return False
+
+    try:
+        signing.TimestampSigner(salt=SIGNING_SALT).unsign(
+            token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def profile_requested(request):
+    """Whether ``request`` is to be profiled: it carries a valid token or
+    it falls in the PROFILE_SAMPLE_RATE share of the requests."""
+    if has_profile_token(request):
+        return True
+
+    rate = settings.PROFILE_SAMPLE_RATE
+    return bool(rate) and random.random() < rate
+
+
+def write_profile(profiler, view, status, seconds):
+    """Save the stats of ``profiler`` gzipped in PROFILE_DIR.
+
+    Returns the file name; the oldest profiles beyond PROFILE_KEEP are
+    removed.
+    """
+    directory = settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+
+    profiler.create_stats()
+    name = "{stamp}-{view}-{status}-{ms}ms.prof.gz".format(
+        stamp=datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%f"),
+        view=re.sub(r"[^\w.]", "_", view), status=status,
+        ms=int(seconds * 1000)
+    )
+    with gzip.open(os.path.join(directory, name), "wb") as target:
+        target.write(marshal.dumps(profiler.stats))
+
+    for stale in list_profiles()[settings.PROFILE_KEEP:]:
+        try:
+            os.remove(os.path.join(directory, stale["name"]))
+        except FileNotFoundError:
+            pass
+
+    return name
+
+
+def list_profiles():
+    """Profiles in PROFILE_DIR, newest first, with what their names tell"""
+    try:
+        names = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+
+    profiles = []
+    for name in names:
+        match = PROFILE_NAME.match(name)
+        if match:
+            profiles.append({
+                "name": name,
+                "taken_at": datetime.strptime(
+                    match["stamp"], "%Y%m%dT%H%M%S.%f"
+                ).replace(tzinfo=timezone.utc),
+                "view": match["view"],
+                "status": int(match["status"]),
+                "ms": int(match["ms"]),
+            })
+
+    return sorted(profiles, key=lambda profile: profile["name"],
+                  reverse=True)
+
+
+def load_profile(name, stream=None):
+    """pstats.Stats of the profile ``name`` in PROFILE_DIR"""
+    path = os.path.join(settings.PROFILE_DIR, os.path.basename(name))
+    with gzip.open(path, "rb") as source:
+        data = source.read()
+
+    stats = pstats.Stats(stream=stream or io.StringIO())
+    stats.stats = marshal.loads(data)
+    stats.get_top_level_stats()
+    return stats
+
+
+class ProfilingMiddleware:
+    """Run cProfile over the requests profile_requested() picks.
+
+    Keep it last in MIDDLEWARE: it then covers URL resolution, the view
+    and rendering the response. Profiles go to PROFILE_DIR, read them
+    with the request_profiles command. Without PROFILE_DIR it does
+    nothing but that one settings lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.PROFILE_DIR or not profile_requested(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        seconds = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match and match.url_name else "unmatched"
+        response[PROFILE_FILE_HEADER] = write_profile(
+            profiler, view, response.status_code, seconds)
+
+        return response
@@ -0,0 +1,106 @@
+import logging
+import os
+import re
+import sys
+
+from django.conf import settings
+from rest_framework.fields import Field
+
+logger = logging.getLogger(__name__)
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+IN_LISTS = re.compile(r"\bIN \((?:\?, )*\?\)", re.IGNORECASE)
+SPACES = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view ran more queries than its QUERY_BUDGETS entry allows"""
+
+
+def fingerprint(sql):
+    """``sql`` with its literals and parameters replaced by ``?``, so the
+    statements of one loop compare equal"""
+    sql = LITERALS.sub("?", sql)
+    sql = IN_LISTS.sub("IN (...)", sql)
+    return SPACES.sub(" ", sql).strip()
+
+
+def find_source():
+    """Where the current query comes from: the innermost serializer field
+    being rendered, e.g. ``ProductSerializer.reviews``, and the frames of
+    the project's own code, innermost last."""
+    source = None
+    stack = []
+
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        owner = frame.f_locals.get("self")
+
+        if (source is None and code.co_name == "to_representation" and
+                isinstance(owner, Field) and owner.field_name):
+            source = "{serializer}.{field}".format(
+                serializer=type(owner.parent).__name__,
+                field=owner.field_name)
+
+        if (code.co_filename.startswith(str(settings.BASE_DIR)) and
+                "site-packages" not in code.co_filename and
+                code.co_filename != __file__):
+            stack.append("{file}:{line} in {function}".format(
+                file=os.path.relpath(code.co_filename, settings.BASE_DIR),
+                line=frame.f_lineno, function=code.co_name))
+
+        frame = frame.f_back
+
+    return source or "view", stack[::-1]
+
+
+class QueryAudit:
+    """``connection.execute_wrapper`` hook that spots N+1 queries.
+
+    Statements are grouped by fingerprint(); one that runs more than
+    ``threshold`` times in the request is remembered with the place it
+    was first repeated from.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.counts = {}
+        # {fingerprint: (source, stack)}
+        self.repeated = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        key = fingerprint(sql)
+        count = self.counts[key] = self.counts.get(key, 0) + 1
+        if count == self.threshold + 1:
+            self.repeated[key] = find_source()
+
+        return execute(sql, params, many, context)
+
+    def report(self, view):
+        """Log the repeated statements; returns their sources"""
+        sources = []
+        for key, (source, stack) in self.repeated.items():
+            logger.warning(
+                "N+1 queries in %s: %s ran %d times from %s\n  %s",
+                view, key, self.counts[key], source, "\n  ".join(stack)
+            )
+            sources.append(source)
+        return sources
+
+
+def over_budget(view, queries):
+    """Why ``view`` broke its QUERY_BUDGETS entry, None when it did not"""
+    budget = settings.QUERY_BUDGETS.get(view)
+    if budget is None or queries <= budget:
+        return None
+
+    return "{view} ran {queries} queries, its budget is {budget}".format(
+        view=view, queries=queries, budget=budget)
+
+
+def enforce_budget(message):
+    """Fail the request with QUERY_BUDGETS_STRICT, as in tests; else log"""
+    if settings.QUERY_BUDGETS_STRICT:
+        raise QueryBudgetExceeded(message)
+    logger.error(message)
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """Test runner that fails any request over its QUERY_BUDGETS entry"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        # Budgets are only checked on sampled requests
+        settings.METRICS_SAMPLE_RATE = 1.0
+        settings.QUERY_BUDGETS_STRICT = True
@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .metrics import worker_files, write_worker_file
+
+logger = logging.getLogger(__name__)
+
+# Statements worth a plan, the rest (SAVEPOINT, SET...) are only recorded
+EXPLAINABLE = ("select", "with", "insert", "update", "delete")
+
+EXPLAIN = {
+    "postgresql": "EXPLAIN (ANALYZE off) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "mysql": "EXPLAIN ",
+}
+
+# EXPLAINs queued at most; when the database is slow every query is,
+# and more EXPLAINs would only add to its load
+MAX_PENDING_EXPLAINS = 10
+
+_buffer = None
+_buffer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_explainer = ThreadPoolExecutor(max_workers=1,
+                                thread_name_prefix="explain-slow-queries")
+# Statements queued for an EXPLAIN
+_pending = set()
+
+
+def get_buffer():
+    """This process's ring buffer of the last SLOW_QUERY_BUFFER captures"""
+    global _buffer
+
+    with _buffer_lock:
+        if _buffer is None or _buffer.maxlen != settings.SLOW_QUERY_BUFFER:
+            _buffer = deque(_buffer or (), maxlen=settings.SLOW_QUERY_BUFFER)
+        return _buffer
+
+
+def explain(entry, params, alias):
+    """Fill in the plan of a captured query, on a connection of its own"""
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(EXPLAIN[connection.vendor] + entry["sql"], params)
+            entry["plan"] = "\n".join(
+                " ".join(str(column) for column in row)
+                for row in cursor.fetchall()
+            )
+    except Exception as exc:
+        entry["plan"] = "EXPLAIN failed: {error}".format(error=exc)
+    finally:
+        with _buffer_lock:
+            _pending.discard(entry["sql"])
+        # Do not hold a connection between the rare slow queries
+        connection.close()
+
+    flush()
+
+
+def capture(sql, params, seconds, view, alias, vendor):
+    entry = {
+        "at": datetime.now(timezone.utc).isoformat(),
+        "view": view,
+        "ms": round(seconds * 1000, 1),
+        "sql": sql,
+        "params": repr(params)[:500],
+        "plan": None,
+    }
+    get_buffer().append(entry)
+    logger.warning("Slow query in %s, %.0fms: %s", view, entry["ms"], sql)
+
+    if (vendor in EXPLAIN and
+            sql.lstrip().lower().startswith(EXPLAINABLE)):
+        with _buffer_lock:
+            queue = (sql not in _pending and
+                     len(_pending) < MAX_PENDING_EXPLAINS)
+            if queue:
+                _pending.add(sql)
+        if queue:
+            _explainer.submit(explain, entry, params, alias)
+            return
+        entry["plan"] = ("Not explained, an EXPLAIN of it or of too many "
+                         "others is queued")
+
+    flush()
+
+
+class SlowQueryCapture:
+    """``connection.execute_wrapper`` hook that captures the queries of
+    one request taking SLOW_QUERY_MS or more"""
+
+    def __init__(self, request, connection):
+        self.request = request
+        self.alias = connection.alias
+        self.vendor = connection.vendor
+        self.threshold = settings.SLOW_QUERY_MS / 1000
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - start
+            if seconds >= self.threshold and not many:
+                match = getattr(self.request, "resolver_match", None)
+                view = match.url_name if match and match.url_name else "-"
+                # Never fail the query over its capture
+                try:
+                    capture(sql, params, seconds, view, self.alias,
+                            self.vendor)
+                except Exception:
+                    logger.exception("Could not capture a slow query")
+
+
+def set_statement_timeout(connection, milliseconds):
+    """Set, or reset with None, the statement timeout of the session.
+
+    Runs on the raw cursor, past the execute wrappers, so the guard does
+    not count against the query budget of the view.
+    """
+    if milliseconds is None:
+        sql, params = "RESET statement_timeout", None
+    else:
+        sql, params = "SET statement_timeout = %s", [int(milliseconds)]
+
+    connection.ensure_connection()
+    with connection.wrap_database_errors:
+        with connection.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+def flush():
+    """Write this process's captures to METRICS_DIR, if it is set"""
+    if not settings.METRICS_DIR:
+        return
+
+    # Request threads and the explainer both flush
+    with _flush_lock:
+        write_worker_file("slow-", {
+            "queries": [dict(entry) for entry in list(get_buffer())]
+        })
+
+
+def slow_queries():
+    """Captured slow queries, newest first, of every process writing to
+    METRICS_DIR or of this one"""
+    if not settings.METRICS_DIR:
+        entries = [dict(entry) for entry in list(get_buffer())]
+    else:
+        entries = []
+        for data in worker_files("slow-"):
+            entries += data.get("queries", [])
+
+    entries.sort(key=lambda entry: entry["at"], reverse=True)
+    return entries[:settings.SLOW_QUERY_BUFFER]
+
+
+class SlowQueryMiddleware:
+    """Opt in guard rails for slow queries.
+
+    With SLOW_QUERY_MS set, queries at least that slow are kept with
+    their view and parameters in a ring buffer and explained in a
+    background thread, see slow_queries(). With STATEMENT_TIMEOUT_MS or
+    a STATEMENT_TIMEOUTS entry for the view, PostgreSQL cancels the
+    queries of the request that run longer.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            if not settings.SLOW_QUERY_MS:
+                return self.get_response(request)
+
+            connection = connections["default"]
+            with connection.execute_wrapper(
+                    SlowQueryCapture(request, connection)):
+                return self.get_response(request)
+
+        finally:
+            if getattr(request, "_statement_timeout", None):
+                try:
+                    set_statement_timeout(connections["default"], None)
+                except DatabaseError:
+                    logger.exception("Could not reset the statement "
+                                     "timeout")
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        connection = connections["default"]
+        if connection.vendor != "postgresql":
+            return None
+
+        timeout = settings.STATEMENT_TIMEOUTS.get(
+            request.resolver_match.url_name, settings.STATEMENT_TIMEOUT_MS)
+        if timeout:
+            set_statement_timeout(connection, timeout)
+            request._statement_timeout = timeout
+
+        return None
@@ -0,0 +1,434 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve
+from rest_framework.test import APIClient
+
+from product.models import Product, Review
+from product.serializers import ProductSerializer
+from .metrics import process_started, registry
+from .profiling import (PROFILE_FILE_HEADER, PROFILE_HEADER, list_profiles,
+                        load_profile, sign_profile_token)
+from . import timing
+from .slow_queries import (SlowQueryMiddleware, _explainer, capture,
+                           get_buffer, slow_queries)
+from .queries import QueryAudit, QueryBudgetExceeded, fingerprint
+from .timing import timed
+
+# Create your tests here.
+
+
+@override_settings(METRICS_TOKEN="scrape-secret")
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        registry.reset()
+        self.client = APIClient()
+        Product.objects.create(name="Lamp", description="A lamp",
+                               price=10, brand="Acme", category="Electronics",
+                               stock=5, ratings=0)
+
+    def scrape(self):
+        return self.client.get("/metrics",
+                               HTTP_AUTHORIZATION="Bearer scrape-secret")
+
+    def test_staff_get_server_timing(self):
+        res = self.client.get("/api/products/")
+
+        self.assertNotIn("Server-Timing", res)
+
+        self.client.force_authenticate(User.objects.create(username="staff",
+                                                           is_staff=True))
+        res = self.client.get("/api/products/")
+
+        self.assertEqual(res.status_code, 200)
+        entries = dict(entry.split(";", 1)[0:2] for entry in
+                       res["Server-Timing"].split(", "))
+        self.assertIn("db", entries)
+        self.assertIn("render", entries)
+        self.assertIn("app", entries)
+        self.assertIn("total", entries)
+        self.assertRegex(entries["db"], r'desc="[1-9]\d* queries"')
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_profiled_request_is_sampled_and_gets_server_timing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(PROFILE_DIR=directory):
+                res = self.client.get("/api/products/", **{
+                    "HTTP_" + PROFILE_HEADER.upper().replace("-", "_"):
+                        sign_profile_token()
+                })
+
+        self.assertIn(PROFILE_FILE_HEADER, res)
+        self.assertIn("db;dur=", res["Server-Timing"])
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled_request_is_only_counted(self):
+        res = self.client.get("/api/products/")
+
+        self.assertNotIn("Server-Timing", res)
+        text = self.scrape().content.decode()
+        self.assertIn('http_requests_total{route="/api/products/",'
+                      'method="GET",status="200"} 1', text)
+        self.assertNotIn('http_request_db_queries_total{route="/api/'
+                         'products/"}', text)
+
+    def test_metrics_in_prometheus_format(self):
+        self.client.get("/api/products/")
+        self.client.get("/api/products/")
+        self.client.get("/no/such/page/")
+
+        res = self.scrape()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res["Content-Type"].startswith("text/plain"))
+        text = res.content.decode()
+        self.assertIn('http_request_duration_seconds_count{route='
+                      '"/api/products/",method="GET"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{route='
+                      '"/api/products/",method="GET",le="+Inf"} 2', text)
+        self.assertIn('http_requests_total{route="<unmatched>",'
+                      'method="GET",status="404"} 1', text)
+        self.assertRegex(text, r'http_request_db_queries_total\{route='
+                               r'"/api/products/"\} [1-9]')
+        self.assertIn('http_request_phase_seconds_total{route='
+                      '"/api/products/",phase="db"}', text)
+
+    def test_timed_adds_to_the_sampled_request_only(self):
+        with timed("s3"):
+            pass
+        self.assertIsNone(timing.current())
+
+        token = timing.begin()
+        try:
+            with timed("s3"):
+                pass
+            with timed("s3"):
+                pass
+            self.assertEqual(list(timing.current().phases), ["s3"])
+        finally:
+            timing.end(token)
+
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.scrape().status_code, 200)
+
+        with override_settings(METRICS_TOKEN=""):
+            self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    def test_concurrent_flushes_do_not_fail(self):
+        errors = []
+
+        def flush():
+            try:
+                for _ in range(50):
+                    registry.flush(force=True)
+            except Exception as e:
+                errors.append(e)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_DIR=directory):
+                threads = [threading.Thread(target=flush) for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            self.assertEqual(os.listdir(directory),
+                             ["{0}.json".format(os.getpid())])
+        self.assertEqual(errors, [])
+
+    def test_unwritable_metrics_dir_does_not_fail_requests(self):
+        with tempfile.NamedTemporaryFile() as not_a_directory:
+            with override_settings(METRICS_DIR=not_a_directory.name,
+                                   METRICS_FLUSH_SECONDS=0), \
+                    self.assertLogs("monitoring.metrics", "WARNING"):
+                res = self.client.get("/api/products/")
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_metrics_dir_adds_up_live_workers(self):
+        def worker_file(pid, started, requests):
+            with open(os.path.join(directory, "{0}.json".format(pid)),
+                      "w") as other:
+                json.dump({"latency": {},
+                           "requests": {"/api/products/|GET|200": requests},
+                           "phases": {}, "started": started}, other)
+
+        with tempfile.TemporaryDirectory() as directory:
+            parent = os.getppid()
+            worker_file(parent, process_started(parent), 3)
+            # Written before a restart: the pid is gone or reused
+            worker_file(4194305, 1, 100)
+            worker_file(os.getpid(), 1, 100)
+
+            with override_settings(METRICS_DIR=directory):
+                self.client.get("/api/products/")
+                text = self.scrape().content.decode()
+
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ["{0}.json".format(pid) for pid in
+                              sorted([str(parent), str(os.getpid())])])
+
+        self.assertIn('http_requests_total{route="/api/products/",'
+                      'method="GET",status="200"} 4', text)
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        settings = override_settings(PROFILE_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.client = APIClient()
+
+    def test_unprofiled_request(self):
+        res = self.client.get("/api/products/")
+
+        self.assertNotIn(PROFILE_FILE_HEADER, res)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_signed_header_profiles_request(self):
+        res = self.client.get("/api/products/", **{
+            "HTTP_" + PROFILE_HEADER.upper().replace("-", "_"):
+                sign_profile_token()
+        })
+
+        [profile] = list_profiles()
+        self.assertEqual(res[PROFILE_FILE_HEADER], profile["name"])
+        self.assertEqual(profile["view"], "products")
+        self.assertEqual(profile["status"], 200)
+        functions = {function for _, _, function in load_profile(
+            profile["name"]).stats}
+        self.assertIn("get_products", functions)
+
+    def test_forged_header_is_ignored(self):
+        self.client.get("/api/products/", **{
+            "HTTP_" + PROFILE_HEADER.upper().replace("-", "_"):
+                "profile:forged:signature"
+        })
+
+        self.assertEqual(list_profiles(), [])
+
+    @override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_KEEP=2)
+    def test_sampled_requests_keep_newest(self):
+        for _ in range(3):
+            self.client.get("/api/products/")
+
+        self.assertEqual(len(list_profiles()), 2)
+
+        out = io.StringIO()
+        call_command("request_profiles", "summary", "--view", "products",
+                     stdout=out)
+        self.assertIn("products", out.getvalue())
+        self.assertIn("get_products", out.getvalue())
+
+        out = io.StringIO()
+        call_command("request_profiles", "list", stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class QueryAuditTests(TestCase):
+
+    def setUp(self):
+        registry.reset()
+        self.client = APIClient()
+        user = User.objects.create(username="critic@example.com")
+        for n in range(6):
+            product = Product.objects.create(
+                name="Lamp {n}".format(n=n), description="A lamp", price=10,
+                brand="Acme", category="Electronics", stock=5, ratings=0)
+            Review.objects.create(product=product, user=user, rating=4,
+                                  comment="Bright")
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint('SELECT "a" FROM "t" WHERE "id" = 12 AND "b" IN '
+                        "(%s, %s, %s) AND  \"c\" = 'it''s'"),
+            'SELECT "a" FROM "t" WHERE "id" = ? AND "b" IN (...) AND '
+            '"c" = ?'
+        )
+
+    def test_repeated_statement_logs_serializer_field(self):
+        audit = QueryAudit(threshold=4)
+        with connection.execute_wrapper(audit):
+            ProductSerializer(Product.objects.all(), many=True).data
+
+        with self.assertLogs("monitoring.queries", "WARNING") as logs:
+            sources = audit.report("products")
+
+        self.assertCountEqual(sources, ["ProductSerializer.reviews",
+                                        "ProductSerializer.images",
+                                        "ProductSerializer.stock"])
+        self.assertIn("ran 6 times", logs.output[0])
+        self.assertIn("product/serializers.py", "".join(logs.output))
+
+    def test_prefetched_products_have_no_repeats(self):
+        with self.assertNoLogs("monitoring.queries", "WARNING"):
+            res = self.client.get("/api/products/?page=1")
+
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(QUERY_BUDGETS={"products": 1},
+                       QUERY_BUDGETS_STRICT=True)
+    def test_budget_fails_in_strict_mode(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded,
+                                      "its budget is 1"):
+            self.client.get("/api/products/")
+
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(QUERY_BUDGETS={"products": 1},
+                                   QUERY_BUDGETS_STRICT=False,
+                                   METRICS_DIR=directory):
+                with self.assertLogs("monitoring.queries", "ERROR"):
+                    self.client.get("/api/products/")
+                self.client.get("/api/me/orders/summary/")
+
+                out = io.StringIO()
+                call_command("query_report", stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[1].startswith("/api/products/"))
+        self.assertEqual(lines[1].split()[3], "1")
+
+
+@override_settings(SLOW_QUERY_MS=0.0001)
+class SlowQueryTests(TestCase):
+
+    def setUp(self):
+        get_buffer().clear()
+        self.addCleanup(get_buffer().clear)
+        self.client = APIClient()
+        Product.objects.create(name="Lamp", description="A lamp", price=10,
+                               brand="Acme", category="Electronics",
+                               stock=5, ratings=0)
+
+    def wait_for_plans(self):
+        _explainer.submit(lambda: None).result()
+
+    def test_captures_view_params_and_plan(self):
+        with self.assertLogs("monitoring.slow_queries", "WARNING"):
+            self.client.get("/api/products/?keyword=Lamp")
+        self.wait_for_plans()
+
+        entries = [entry for entry in get_buffer() if entry["view"] ==
+                   "products" and "product_product" in entry["sql"]]
+        self.assertTrue(entries)
+        self.assertIn("Lamp", "".join(entry["params"] for entry in entries))
+        self.assertTrue(all(entry["plan"] for entry in entries))
+
+    def test_one_explain_per_statement_is_queued(self):
+        busy = threading.Event()
+        _explainer.submit(busy.wait, 5)
+        sql = "SELECT 1 FROM product_product WHERE id = %s"
+
+        try:
+            with self.assertLogs("monitoring.slow_queries", "WARNING"):
+                for pk in range(3):
+                    capture(sql, [pk], 1, "products", "default",
+                            connection.vendor)
+            entries = list(get_buffer())
+            self.assertIsNone(entries[0]["plan"])
+            self.assertTrue(all(entry["plan"].startswith("Not explained")
+                                for entry in entries[1:]))
+        finally:
+            busy.set()
+        self.wait_for_plans()
+
+        self.assertFalse(entries[0]["plan"].startswith("Not explained"))
+
+    @override_settings(SLOW_QUERY_BUFFER=3)
+    def test_ring_buffer_is_bounded(self):
+        with self.assertLogs("monitoring.slow_queries", "WARNING"):
+            self.client.get("/api/products/")
+        self.wait_for_plans()
+
+        self.assertEqual(len(get_buffer()), 3)
+
+    def test_metrics_dir_shares_live_workers_captures(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Left by a worker that has exited
+            with open(os.path.join(directory, "slow-4194305.json"),
+                      "w") as other:
+                json.dump({"queries": [{"at": "2024-01-01T00:00:00",
+                                        "view": "gone"}],
+                           "started": 1}, other)
+
+            with override_settings(METRICS_DIR=directory):
+                with self.assertLogs("monitoring.slow_queries", "WARNING"):
+                    self.client.get("/api/products/")
+                self.wait_for_plans()
+                queries = slow_queries()
+
+            self.assertEqual(os.listdir(directory),
+                             ["slow-{0}.json".format(os.getpid())])
+
+        self.assertTrue(queries)
+        self.assertEqual({entry["view"] for entry in queries}, {"products"})
+
+    @override_settings(METRICS_DIR="/dev/null/metrics")
+    def test_failing_capture_does_not_fail_the_query(self):
+        with self.assertLogs("monitoring", "WARNING"):
+            res = self.client.get("/api/products/")
+        self.wait_for_plans()
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_admins_only(self):
+        user = User.objects.create(username="shopper@example.com")
+        admin = User.objects.create(username="admin@example.com",
+                                    is_staff=True)
+
+        self.client.force_authenticate(user)
+        res = self.client.get("/api/reports/slow-queries/")
+        self.assertEqual(res.status_code, 403)
+
+        self.client.force_authenticate(admin)
+        with self.assertLogs("monitoring.slow_queries", "WARNING"):
+            self.client.get("/api/products/")
+        self.wait_for_plans()
+        res = self.client.get("/api/reports/slow-queries/")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["queries"][0]["view"], "products")
+
+    @unittest.skipUnless(connection.vendor == "postgresql",
+                         "statement_timeout is PostgreSQL's")
+    @override_settings(SLOW_QUERY_MS=0, STATEMENT_TIMEOUT_MS=5000,
+                       STATEMENT_TIMEOUTS={"products": 50})
+    def test_statement_timeout_per_view(self):
+        def view(request):
+            middleware.process_view(request, None, (), {})
+            with connection.cursor() as cursor:
+                cursor.execute("SHOW statement_timeout")
+                seen.append(cursor.fetchone()[0])
+                cursor.execute("SELECT pg_sleep(0.5)")
+
+        middleware = SlowQueryMiddleware(view)
+        seen = []
+        request = RequestFactory().get("/api/products/")
+        request.resolver_match = resolve("/api/products/")
+
+        with self.assertRaises(OperationalError):
+            with self.assertLogs("monitoring.slow_queries", "ERROR"):
+                with transaction.atomic():
+                    middleware(request)
+
+        self.assertEqual(seen, ["50ms"])
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW statement_timeout")
+            self.assertEqual(cursor.fetchone()[0], "0")
@@ -0,0 +1,61 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Where the time of one sampled request went, by phase"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.queries = 0
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def record_query(self, execute, sql, params, many, context):
+        """``connection.execute_wrapper`` hook timing every query"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.add("db", time.perf_counter() - start)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+def current():
+    """Timings of the request being handled, None when not sampled"""
+    return _current.get()
+
+
+def begin():
+    """Start timing the current request; returns the token for end()"""
+    return _current.set(RequestTimings())
+
+
+def end(token):
+    _current.reset(token)
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to ``phase`` of the request.
+
+    Costs one context variable lookup when the request is not sampled.
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - start)
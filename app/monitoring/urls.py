@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path("metrics", views.metrics, name="metrics"),
+    path("api/reports/slow-queries/", views.get_slow_queries,
+         name="slow_queries"),
+]
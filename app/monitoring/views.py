@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.response import Response
+from drf_yasg.utils import swagger_auto_schema
+
+from .metrics import collect, render_prometheus
+from .slow_queries import slow_queries
+
+
+def metrics(request):
+    """Request metrics in the Prometheus text format.
+
+    Scrapers send METRICS_TOKEN as ``Authorization: Bearer <token>``;
+    without a METRICS_TOKEN there are no metrics to scrape.
+    """
+    if not settings.METRICS_TOKEN:
+        raise Http404()
+
+    expected = "Bearer " + settings.METRICS_TOKEN
+    if not constant_time_compare(request.headers.get("Authorization", ""),
+                                 expected):
+        return HttpResponse(status=401)
+
+    return HttpResponse(render_prometheus(collect()),
+                        content_type="text/plain; version=0.0.4")
+
+
+@swagger_auto_schema(method='GET')
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def get_slow_queries(request):
+    """The latest queries slower than SLOW_QUERY_MS with their plans"""
+    return Response({"queries": slow_queries(),
+                     "threshold_ms": settings.SLOW_QUERY_MS})
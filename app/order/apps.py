@@ -1,6 +1,16 @@
+import os
+
 from django.apps import AppConfig
 
 
 class OrderConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "order"
+
+    def ready(self):
+        import stripe
+
+        from .stripe_client import configure_stripe
+
+        stripe.api_key = os.environ.get("STRIPE_PRIVATE_KEY")
+        configure_stripe()
@@ -0,0 +1,70 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from utils.pubsub import get_broker
+from .models import StreamTicket
+
+ORDER_CHANNEL = "orders:user:{user_id}"
+
+
+def publish_order_changes(orders):
+    """Tell the owners' event streams about changed orders.
+
+    ``orders`` are Order instances or dicts with their fields; delivery
+    waits for the current transaction to commit.
+    """
+    broker = get_broker()
+
+    for order in orders:
+        if not isinstance(order, dict):
+            order = {"id": order.id,
+                     "user_id": order.user_id,
+                     "status": order.status,
+                     "payment_status": order.payment_status}
+
+        if order["user_id"] is None:
+            continue
+
+        broker.publish(ORDER_CHANNEL.format(user_id=order["user_id"]), {
+            "id": order["id"],
+            "status": order["status"],
+            "payment_status": order["payment_status"],
+        })
+
+
+def issue_stream_ticket(user):
+    """A new single use ticket for ``user``'s order event stream"""
+    ticket = get_random_string(length=40)
+    now = timezone.now()
+
+    StreamTicket.objects.filter(user_id=user.id, expires_at__lte=now).delete()
+    StreamTicket.objects.create(
+        digest=hashlib.sha256(ticket.encode()).hexdigest(),
+        user_id=user.id,
+        expires_at=now + timedelta(
+            seconds=settings.ORDER_EVENTS_TICKET_SECONDS)
+    )
+
+    return ticket
+
+
+def redeem_stream_ticket(ticket):
+    """The active user a ticket was issued to, or None; a ticket is used
+    up by the first attempt, whether it had expired or not.
+    """
+    tickets = StreamTicket.objects.filter(
+        digest=hashlib.sha256(ticket.encode()).hexdigest()
+    )
+    found = tickets.select_related("user").first()
+
+    # Of concurrent attempts only the one that deletes the row gets in
+    if found is None or not tickets.delete()[0]:
+        return None
+    if found.expires_at <= timezone.now() or not found.user.is_active:
+        return None
+
+    return found.user
@@ -0,0 +1,236 @@
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    """In memory stand-in for the Stripe endpoints this project calls.
+
+    Point ``STRIPE_API_BASE`` at it for load runs, or start it on port 0
+    in tests. ``latency`` seconds are added to every answer and a share
+    ``error_rate`` of the calls fail with a 500, to exercise timeouts and
+    the circuit breaker.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0, error_rate=0):
+        super().__init__(address, FakeStripeHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.objects = {}
+        self.line_items = {}
+        self.requests = 0
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://{host}:{port}".format(host=self.server_address[0],
+                                             port=self.server_address[1])
+
+    def start(self):
+        """Serve from a daemon thread; returns the server"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # Clients that timed out hang up before the delayed answer
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def create(self, prefix, obj):
+        with self.lock:
+            obj["id"] = "{prefix}_fake{n}".format(prefix=prefix,
+                                                  n=next(self.ids))
+            self.objects[obj["id"]] = obj
+        return obj
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with Nagle on, the body
+    # waits for the client's delayed ACK on keep-alive connections
+    disable_nagle_algorithm = True
+
+    routes = [
+        ("POST", r"/v1/checkout/sessions", "create_session"),
+        ("GET", r"/v1/checkout/sessions/(?P<id>[^/]+)/line_items",
+         "list_line_items"),
+        ("POST", r"/v1/products", "create_product"),
+        ("POST", r"/v1/prices", "create_price"),
+        ("GET", r"/v1/(products|prices|checkout/sessions)/(?P<id>[^/]+)",
+         "retrieve"),
+        ("POST", r"/v1/(products|prices)/(?P<id>[^/]+)", "modify"),
+    ]
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+
+        url = urlparse(self.path)
+        params = parse_form(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            params.update(parse_form(self.rfile.read(length).decode()))
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if random.random() < server.error_rate:
+            return self.respond(500, error("api_error", "Injected failure"))
+
+        for route_method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, url.path)
+            if route_method == method and match:
+                return getattr(self, name)(params, **match.groupdict())
+
+        self.respond(404, error("invalid_request_error", "Unknown route"))
+
+    def create_session(self, params):
+        line_items = []
+        for item in params.get("line_items", []):
+            price = item.get("price")
+            if price in self.server.objects:
+                price = self.server.objects[price]
+            else:
+                data = item["price_data"]
+                product = self.server.create("prod", {
+                    "object": "product",
+                    "name": data["product_data"]["name"],
+                    "images": data["product_data"].get("images", []),
+                    "metadata": data["product_data"].get("metadata", {}),
+                })
+                price = {"object": "price",
+                         "product": product["id"],
+                         "unit_amount": int(data["unit_amount"])}
+
+            line_items.append({"object": "item",
+                               "description": self.server.objects.get(
+                                   price["product"], {}).get("name", ""),
+                               "quantity": int(item["quantity"]),
+                               "price": price})
+
+        session = self.server.create("cs", {
+            "object": "checkout.session",
+            "metadata": params.get("metadata", {}),
+            "amount_total": sum(i["price"]["unit_amount"] * i["quantity"]
+                                for i in line_items),
+            "expires_at": int(params.get("expires_at", 0)),
+        })
+        session["url"] = "{url}/pay/{id}".format(url=self.server.url,
+                                                 id=session["id"])
+        self.server.line_items[session["id"]] = line_items
+
+        self.respond(200, session)
+
+    def list_line_items(self, params, id):
+        if id not in self.server.line_items:
+            return self.missing(id)
+
+        items = json.loads(json.dumps(self.server.line_items[id]))
+        if "data.price.product" in params.get("expand", []):
+            for item in items:
+                item["price"]["product"] = self.server.objects[
+                    item["price"]["product"]]
+
+        self.respond(200, {"object": "list", "data": items,
+                           "has_more": False,
+                           "url": "/v1/checkout/sessions/{id}/line_items"
+                                  .format(id=id)})
+
+    def create_product(self, params):
+        self.respond(200, self.server.create("prod", {
+            "object": "product",
+            "name": params.get("name", ""),
+            "images": params.get("images", []),
+            "metadata": params.get("metadata", {}),
+        }))
+
+    def create_price(self, params):
+        self.respond(200, self.server.create("price", {
+            "object": "price",
+            "product": params.get("product"),
+            "unit_amount": int(params.get("unit_amount", 0)),
+            "currency": params.get("currency", "usd"),
+            "active": True,
+        }))
+
+    def retrieve(self, params, id):
+        if id not in self.server.objects:
+            return self.missing(id)
+        self.respond(200, self.server.objects[id])
+
+    def modify(self, params, id):
+        if id not in self.server.objects:
+            return self.missing(id)
+        self.server.objects[id].update(params)
+        self.respond(200, self.server.objects[id])
+
+    def missing(self, id):
+        self.respond(404, error("invalid_request_error",
+                                "No such object: {id}".format(id=id)))
+
+    def respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Request-Id", "req_fake")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def error(type, message):
+    return {"error": {"type": type, "message": message}}
+
+
+def parse_form(query):
+    """Decode Stripe's ``a[b][0][c]=v`` form encoding into dicts and lists"""
+    result = {}
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        parts = re.findall(r"[^\[\]]+|\[\]", key)
+        target = result
+        for part, following in zip(parts, parts[1:]):
+            make = list if following.isdigit() or following == "[]" else dict
+            if isinstance(target, list):
+                index = int(part)
+                while len(target) <= index:
+                    target.append(make())
+                target = target[index]
+            else:
+                target = target.setdefault(part, make())
+
+        last = parts[-1]
+        if isinstance(target, list):
+            if last == "[]":
+                target.append(value)
+            else:
+                index = int(last)
+                while len(target) <= index:
+                    target.append(None)
+                target[index] = value
+        else:
+            target[last] = value
+
+    return result
@@ -0,0 +1,116 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+
+def idempotent(view):
+    """Replay the stored response when a request repeats its Idempotency-Key.
+
+    Goes below ``@permission_classes`` on function views. The key row is
+    claimed under a row lock, so of concurrent duplicates only one runs
+    the view; the others get a 409 until its response is stored. Server
+    errors are not stored, so the client can retry with the same key.
+    """
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+
+        if len(key) > 255:
+            return Response({"error": "Idempotency-Key is too long"},
+                            status=status.HTTP_400_BAD_REQUEST
+                            )
+
+        record, replay = claim_key(request.user, view.__name__, key,
+                                   request_fingerprint(request)
+                                   )
+        if replay is not None:
+            return replay
+
+        try:
+            response = view(request, *args, **kwargs)
+
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 500:
+            record.delete()
+        else:
+            record.status_code = response.status_code
+            record.response = response.data
+            record.save(update_fields=["status_code", "response"])
+
+        return response
+
+    return wrapper
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def claim_key(user, endpoint, key, fingerprint):
+    """Claim ``key`` for this request, or the response to answer it with"""
+    now = timezone.now()
+    expires_at = now + timedelta(hours=settings.IDEMPOTENCY_KEY_HOURS)
+
+    with transaction.atomic():
+        record, created = (IdempotencyKey.objects
+                           .select_for_update()
+                           .get_or_create(user=user,
+                                          endpoint=endpoint,
+                                          key=key,
+                                          defaults={
+                                              "fingerprint": fingerprint,
+                                              "expires_at": expires_at
+                                          }))
+
+        if created:
+            return record, None
+
+        abandoned = (record.status_code is None and
+                     record.created_at <= now - timedelta(
+                         seconds=settings.IDEMPOTENCY_LOCK_SECONDS))
+
+        if record.expires_at <= now or abandoned:
+            record.fingerprint = fingerprint
+            record.status_code = None
+            record.response = None
+            record.created_at = now
+            record.expires_at = expires_at
+            record.save()
+            return record, None
+
+    if record.fingerprint != fingerprint:
+        return record, Response(
+            {"error": "Idempotency-Key was already used for another request"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+
+    if record.status_code is None:
+        return record, Response(
+            {"error": "A request with this Idempotency-Key is in progress"},
+            status=status.HTTP_409_CONFLICT,
+            headers={"Retry-After": "1"}
+        )
+
+    return record, Response(record.response,
+                            status=record.status_code,
+                            headers={"Idempotent-Replayed": "true"}
+                            )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from order.partitions import PartitionError, add_months, archive_partitions
+
+
+class Command(BaseCommand):
+    help = ("Detach the Order and OrderItem partitions of old months and "
+            "write them to gzipped JSON lines. Sales rollups keep their "
+            "totals. Partitions left detached by an earlier run that failed "
+            "are archived too.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory",
+                            help="Where the .jsonl.gz archives are written")
+        parser.add_argument("--keep-months", type=int, default=24,
+                            help="Months of orders, including the current "
+                                 "one, left in place")
+        parser.add_argument("--drop", action="store_true",
+                            help="Drop the detached tables once archived")
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        before = add_months(today.replace(day=1),
+                            1 - options["keep_months"])
+
+        try:
+            paths = archive_partitions(before, options["directory"],
+                                       drop=options["drop"])
+        except PartitionError as e:
+            raise CommandError(e)
+
+        for path in paths:
+            self.stdout.write(path)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Archived {count} partitions from before {month}".format(
+                count=len(paths), month=before.strftime("%Y-%m"))
+        ))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from order.partitions import (PARTITIONED_MODELS, PartitionError, add_months,
+                              check_postgresql, create_partitions,
+                              is_partitioned)
+
+
+class Command(BaseCommand):
+    help = ("Create the monthly Order and OrderItem partitions of the coming "
+            "months; run it daily or at least monthly")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            check_postgresql()
+        except PartitionError as e:
+            raise CommandError(e)
+
+        today = timezone.now().date()
+        created = []
+
+        for model in PARTITIONED_MODELS:
+            if not is_partitioned(model):
+                raise CommandError("{table} is not partitioned, run "
+                                   "partition_order_tables first".format(
+                                       table=model._meta.db_table))
+
+            created += create_partitions(
+                model, today, add_months(today, options["months_ahead"])
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            "Created {count} partitions{names}".format(
+                count=len(created),
+                names=": " + ", ".join(created) if created else ""
+            )
+        ))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from order.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = ("Serve a local fake of the Stripe API for load runs; point "
+            "STRIPE_API_BASE at it")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=12111)
+        parser.add_argument("--latency", type=float, default=0,
+                            help="Seconds added to every answer")
+        parser.add_argument("--error-rate", type=float, default=0,
+                            help="Share of calls answered with a 500")
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer((options["host"], options["port"]),
+                                  latency=options["latency"],
+                                  error_rate=options["error_rate"]
+                                  )
+
+        self.stdout.write(self.style.SUCCESS(
+            "Fake Stripe listening on {url}".format(url=server.url)
+        ))
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
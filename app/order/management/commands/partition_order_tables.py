@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from order.partitions import PartitionError, partition_tables
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the Order and OrderItem tables range partitioned by "
+            "created_at month (PostgreSQL). Copies every row, run it in a "
+            "maintenance window.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int, default=3,
+                            help="Future months to create partitions for")
+
+    def handle(self, *args, **options):
+        try:
+            partition_tables(options["months_ahead"])
+        except PartitionError as e:
+            raise CommandError(e)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Order tables are partitioned by month"
+        ))
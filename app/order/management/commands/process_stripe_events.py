@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from order.webhooks import process_next_event
+
+
+class Command(BaseCommand):
+    help = ("Fulfil the Stripe webhook events queued by stripe_webhook. "
+            "Several workers can run side by side.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true",
+                            help="Keep polling instead of exiting once "
+                                 "the inbox is empty")
+        parser.add_argument("--interval", type=float, default=1.0,
+                            help="Seconds to wait when the inbox is empty")
+
+    def handle(self, *args, **options):
+        processed = 0
+
+        while True:
+            while process_next_event():
+                processed += 1
+
+            if not options["loop"]:
+                break
+
+            close_old_connections()
+            time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS(
+            "Handled {count} Stripe events".format(count=processed)
+        ))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from order.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = ("Delete Idempotency-Key responses past their expiry, a batch "
+            "at a time")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--pause", type=float, default=0,
+                            help="Seconds to sleep between batches")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        purged = 0
+
+        while True:
+            # Expired keys are never replayed again, so short batches
+            # only trade cleanup speed for lock time.
+            batch = list(IdempotencyKey.objects
+                         .filter(expires_at__lte=now)
+                         .values_list("pk", flat=True)[:options["batch_size"]])
+
+            if not batch:
+                break
+
+            purged += IdempotencyKey.objects.filter(
+                pk__in=batch
+                ).delete()[0]
+
+            if options["pause"]:
+                time.sleep(options["pause"])
+
+        self.stdout.write(self.style.SUCCESS(
+            "Purged {count} expired idempotency keys".format(count=purged)
+        ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from order.models import UserOrderSummary
+from order.summaries import summary_rows
+
+
+class Command(BaseCommand):
+    help = ("Recompute every user's order summary from the orders, e.g. "
+            "after orders were changed outside the API")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Summaries written per INSERT")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        count = 0
+
+        with transaction.atomic():
+            UserOrderSummary.objects.all().delete()
+
+            batch = []
+            for row in summary_rows():
+                batch.append(UserOrderSummary(**row))
+                if len(batch) == batch_size:
+                    UserOrderSummary.objects.bulk_create(batch)
+                    count += len(batch)
+                    batch = []
+
+            UserOrderSummary.objects.bulk_create(batch)
+            count += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt the order summaries of {count} users".format(
+                count=count)
+            ))
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from order.models import (DailyCategorySales, DailyProductSales,
+                          SalesRollupCursor)
+from order.rollups import fold_orders, settled_order_id
+
+
+class Command(BaseCommand):
+    help = ("Fold the orders placed since the last run into the daily sales "
+            "rollups, or recompute them with --rebuild")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="Order ids folded in per transaction")
+        parser.add_argument("--rebuild", action="store_true",
+                            help="Drop the rollups and recount every order")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        cursor, _ = SalesRollupCursor.objects.get_or_create(pk=1)
+
+        if settings.SALES_ROLLUP_INLINE and not options["rebuild"]:
+            self.stdout.write("SALES_ROLLUP_INLINE is on, orders are "
+                              "counted as they are placed; use --rebuild "
+                              "to recount")
+            return
+
+        if options["rebuild"]:
+            with transaction.atomic():
+                DailyCategorySales.objects.all().delete()
+                DailyProductSales.objects.all().delete()
+                cursor.last_order_id = 0
+                cursor.save()
+
+        last_order_id = settled_order_id()
+
+        while cursor.last_order_id < last_order_id:
+            start = cursor.last_order_id
+            end = min(start + batch_size, last_order_id)
+
+            with transaction.atomic():
+                fold_orders(start, end)
+                cursor.last_order_id = end
+                cursor.save()
+
+            self.stdout.write("Orders {start}-{end} folded in".format(
+                start=start + 1, end=end
+            ))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Sales rollups are up to date with order {id}".format(
+                id=cursor.last_order_id)
+            ))
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.6 on 2026-10-19 01:56
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def copy_order_created_at(apps, schema_editor):
+    Order = apps.get_model("order", "Order")
+    OrderItem = apps.get_model("order", "OrderItem")
+
+    OrderItem.objects.update(
+        created_at=Coalesce(
+            Subquery(
+                Order.objects.filter(pk=OuterRef("order_id")).values("created_at")[:1]
+            ),
+            F("created_at"),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("order", "0006_sales_rollups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orderitem",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_order_created_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.0.6 on 2026-10-19 02:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def summarize_orders(apps, schema_editor):
+    Order = apps.get_model("order", "Order")
+    UserOrderSummary = apps.get_model("order", "UserOrderSummary")
+
+    UserOrderSummary.objects.bulk_create(
+        [
+            UserOrderSummary(**row)
+            for row in Order.objects.filter(user__isnull=False)
+            .values("user_id")
+            .annotate(
+                orders=Count("id"),
+                total_spent=Sum("total_amount"),
+                last_order_at=Max("created_at"),
+            )
+            .iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("order", "0007_orderitem_created_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserOrderSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("orders", models.IntegerField(default=0)),
+                ("total_spent", models.BigIntegerField(default=0)),
+                ("last_order_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="order_summary",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(summarize_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-19 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("order", "0008_userordersummary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="needs_review",
+            field=models.BooleanField(default=False),
+        ),
+    ]
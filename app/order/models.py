@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from product.models import Product
 
 # Create your models here.
@@ -16,6 +18,12 @@ class OrderStatus(models.TextChoices):
     DELIVERED = "DELIVERED"
 
 
+class StripeEventStatus(models.TextChoices):
+    PENDING = "PENDING"
+    PROCESSED = "PROCESSED"
+    FAILED = "FAILED"
+
+
 class Order(models.Model):
 
     street = models.CharField(max_length=500, default="", blank=False)
@@ -36,8 +44,18 @@ class Order(models.Model):
         default=OrderStatus.PROCESSING
     )
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    # Paid for while not enough was in stock, someone has to sort it out
+    needs_review = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "created_at"],
+                         name="order_user_created"
+                         ),
+            models.Index(fields=["created_at"], name="order_created"),
+        ]
+
     def __str__(self):
         return str(self.id)
 
@@ -52,6 +70,137 @@ class OrderItem(models.Model):
     quantity = models.IntegerField(default=1)
     price = models. DecimalField(max_digits=7, decimal_places=2, blank=False)
     image = models.CharField(max_length=500, default="", blank=False)
+    # Copy of the order's, so both tables can be partitioned by month
+    created_at = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return str(self.name)
+
+
+class StripeEvent(models.Model):
+    """Inbox of verified Stripe webhook events, drained by a worker"""
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=20,
+        choices=StripeEventStatus.choices,
+        default=StripeEventStatus.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(default="", blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["available_at"],
+                         condition=models.Q(status="PENDING"),
+                         name="stripe_event_pending"
+                         ),
+        ]
+
+    def __str__(self):
+        return str(self.event_id)
+
+
+class IdempotencyKey(models.Model):
+    """Response of a request sent with an Idempotency-Key header"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    endpoint = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True,
+                                encoder=DjangoJSONEncoder
+                                )
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "endpoint", "key"],
+                                    name="unique_idempotency_key"
+                                    ),
+        ]
+
+    def __str__(self):
+        return str(self.key)
+
+
+class DailyCategorySales(models.Model):
+    """Sales of one category on one day, kept up to date by order.rollups"""
+    day = models.DateField()
+    category = models.CharField(max_length=30)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2,
+                                  default=0
+                                  )
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "category"],
+                                    name="unique_daily_category_sales"
+                                    ),
+        ]
+
+    def __str__(self):
+        return "{day} {category}".format(day=self.day, category=self.category)
+
+
+class DailyProductSales(models.Model):
+    """Sales of one product on one day, kept up to date by order.rollups"""
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE,
+                                related_name="+"
+                                )
+    revenue = models.DecimalField(max_digits=14, decimal_places=2,
+                                  default=0
+                                  )
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "product"],
+                                    name="unique_daily_product_sales"
+                                    ),
+        ]
+
+    def __str__(self):
+        return "{day} {product}".format(day=self.day, product=self.product_id)
+
+
+class SalesRollupCursor(models.Model):
+    """Last order folded into the sales rollups by the batch job"""
+    last_order_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class UserOrderSummary(models.Model):
+    """Order count, spend on paid orders and latest order of one user,
+    kept up to date by order.summaries as orders are placed and deleted.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                related_name="order_summary"
+                                )
+    orders = models.IntegerField(default=0)
+    total_spent = models.BigIntegerField(default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class StreamTicket(models.Model):
+    """Single use pass to open the order event stream, for EventSource
+    which can not send an Authorization header. Only the sha256 of the
+    ticket is stored.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return str(self.user_id)
@@ -0,0 +1,49 @@
+from django.core.paginator import EmptyPage, Paginator
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CountedPaginator(Paginator):
+    """Paginator that trusts a count worked out beforehand.
+
+    An estimated count can be short of the real one, so a page past its
+    end is looked up again against an exact count before it is refused.
+    """
+
+    def __init__(self, object_list, per_page, count, estimated=False,
+                 **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count = count
+        self.estimated = estimated
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if not self.estimated:
+                raise
+
+        # count and num_pages are cached properties
+        del self.count
+        self.__dict__.pop("num_pages", None)
+        self.estimated = False
+
+        return super().validate_number(number)
+
+
+class OrderPagePagination(PageNumberPagination):
+    page_size = 10
+
+    def __init__(self, count, estimated=False):
+        self.known_count = count
+        self.estimated = estimated
+
+    def django_paginator_class(self, queryset, page_size):
+        return CountedPaginator(queryset, page_size, self.known_count,
+                                self.estimated)
+
+
+class OrderCursorPagination(CursorPagination):
+    """Keyset pages, as cheap on the last page as on the first"""
+    page_size = 10
+    # id breaks ties between orders created in the same microsecond
+    ordering = ("-created_at", "-id")
@@ -0,0 +1,257 @@
+import gzip
+import os
+import re
+from datetime import date
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem
+
+PARTITIONED_MODELS = [Order, OrderItem]
+
+PARTITION_NAME = re.compile(
+    r"^(?P<table>.+)_p(?P<year>\d{4})_(?P<month>\d{2})$"
+)
+
+
+class PartitionError(Exception):
+    """The tables can not be (re)partitioned as asked"""
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return "{table}_p{year:04d}_{month:02d}".format(table=table,
+                                                    year=month.year,
+                                                    month=month.month)
+
+
+def check_postgresql():
+    if connection.vendor != "postgresql":
+        raise PartitionError("Order partitioning needs PostgreSQL, not "
+                             "{vendor}".format(vendor=connection.vendor))
+
+
+def is_partitioned(model):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                       "WHERE partrelid = to_regclass(%s))",
+                       [model._meta.db_table])
+        return cursor.fetchone()[0]
+
+
+def month_partitions(model):
+    """``{month: partition name}`` of the attached monthly partitions"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT c.relname FROM pg_inherits i "
+                       "JOIN pg_class c ON c.oid = i.inhrelid "
+                       "WHERE i.inhparent = to_regclass(%s)",
+                       [model._meta.db_table])
+        names = [row[0] for row in cursor.fetchall()]
+
+    return partition_months(model, names)
+
+
+def detached_partitions(model):
+    """``{month: table name}`` of the monthly partitions detached from
+    the table but not dropped yet
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relname FROM pg_class WHERE relkind = 'r' "
+                       "AND NOT relispartition AND pg_table_is_visible(oid) "
+                       "AND relname LIKE %s",
+                       [model._meta.db_table + "%"])
+        names = [row[0] for row in cursor.fetchall()]
+
+    return partition_months(model, names)
+
+
+def partition_months(model, names):
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match and match["table"] == model._meta.db_table:
+            month = date(int(match["year"]), int(match["month"]), 1)
+            partitions[month] = name
+
+    return partitions
+
+
+def create_partitions(model, first, last):
+    """Create the missing monthly partitions from ``first`` to ``last``"""
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    existing = month_partitions(model)
+    created = []
+
+    month = date(first.year, first.month, 1)
+    with connection.cursor() as cursor:
+        while month <= last:
+            if month not in existing:
+                name = partition_name(table, month)
+                cursor.execute(
+                    "CREATE TABLE {name} PARTITION OF {table} FOR VALUES "
+                    "FROM ('{start} 00:00+00') TO ('{end} 00:00+00')".format(
+                        name=quote(name), table=quote(table),
+                        start=month.isoformat(),
+                        end=add_months(month, 1).isoformat()
+                    ))
+                created.append(name)
+            month = add_months(month, 1)
+
+    return created
+
+
+def partition_tables(months_ahead):
+    """Rebuild Order and OrderItem as tables range partitioned by month.
+
+    Copies every row, so run it in a maintenance window. Indexes and the
+    foreign keys to other tables are recreated on the new tables. Keys of
+    a partitioned table have to include its partition key, so the primary
+    keys become (id, created_at) and the foreign key from OrderItem to
+    Order is dropped; Django still treats ``id`` as the primary key and
+    cascades deletes itself.
+    """
+    check_postgresql()
+    quote = connection.ops.quote_name
+    tables = [model._meta.db_table for model in PARTITIONED_MODELS]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Deferred foreign key checks would block dropping the old tables
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        for model in PARTITIONED_MODELS:
+            if is_partitioned(model):
+                raise PartitionError("{table} is already partitioned".format(
+                    table=model._meta.db_table))
+
+        # Foreign keys into these tables from elsewhere can not survive
+        cursor.execute("SELECT conrelid::regclass::text, conname "
+                       "FROM pg_constraint WHERE contype = 'f' "
+                       "AND confrelid = ANY(%s::regclass[]) "
+                       "AND NOT conrelid = ANY(%s::regclass[])",
+                       [tables, tables])
+        inbound = cursor.fetchall()
+        if inbound:
+            raise PartitionError("Foreign keys point at the order tables: "
+                                 "{keys}".format(keys=", ".join(
+                                     "{0}.{1}".format(*key)
+                                     for key in inbound)))
+
+        definitions = {}
+        for table in tables:
+            cursor.execute("SELECT pg_get_indexdef(indexrelid) "
+                           "FROM pg_index WHERE indrelid = %s::regclass "
+                           "AND NOT indisprimary", [table])
+            indexes = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute("SELECT conname, pg_get_constraintdef(oid) "
+                           "FROM pg_constraint WHERE contype = 'f' "
+                           "AND conrelid = %s::regclass "
+                           "AND NOT confrelid = ANY(%s::regclass[])",
+                           [table, tables])
+            foreign_keys = cursor.fetchall()
+
+            cursor.execute("SELECT min(created_at) FROM {table}".format(
+                table=quote(table)))
+            oldest = cursor.fetchone()[0]
+
+            definitions[table] = (indexes, foreign_keys, oldest)
+
+        today = timezone.now().date()
+        for model in PARTITIONED_MODELS:
+            table = model._meta.db_table
+            indexes, foreign_keys, oldest = definitions[table]
+            old = table + "_unpartitioned"
+
+            cursor.execute("ALTER TABLE {table} RENAME TO {old}".format(
+                table=quote(table), old=quote(old)))
+            cursor.execute(
+                "CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS "
+                "INCLUDING IDENTITY) PARTITION BY RANGE (created_at)".format(
+                    table=quote(table), old=quote(old)))
+            cursor.execute("ALTER TABLE {table} ADD PRIMARY KEY "
+                           "(id, created_at)".format(table=quote(table)))
+
+            create_partitions(model, (oldest.date() if oldest else today),
+                              add_months(today, months_ahead))
+            cursor.execute(
+                "CREATE TABLE {name} PARTITION OF {table} DEFAULT".format(
+                    name=quote(table + "_default"), table=quote(table)))
+
+            cursor.execute("INSERT INTO {table} SELECT * FROM {old}".format(
+                table=quote(table), old=quote(old)))
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                "coalesce(max(id), 0) + 1, false) FROM {table}".format(
+                    table=quote(table)), [table])
+            cursor.execute("DROP TABLE {old} CASCADE".format(old=quote(old)))
+
+            for index in indexes:
+                cursor.execute(index)
+            for name, definition in foreign_keys:
+                cursor.execute(
+                    "ALTER TABLE {table} ADD CONSTRAINT {name} "
+                    "{definition}".format(table=quote(table),
+                                          name=quote(name),
+                                          definition=definition))
+
+
+def archive_partitions(before, directory, drop=False):
+    """Detach the monthly partitions older than ``before`` and write each
+    to ``directory/<partition>.jsonl.gz``, one JSON row per line.
+
+    Tables detached earlier whose archive was never written, e.g. because
+    the export failed, are written too. Detached tables are kept unless
+    ``drop``. Returns the paths of the archives written.
+    """
+    check_postgresql()
+    quote = connection.ops.quote_name
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+
+    for model in PARTITIONED_MODELS:
+        table = model._meta.db_table
+
+        for month, name in sorted(month_partitions(model).items()):
+            if add_months(month, 1) > before:
+                continue
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    "ALTER TABLE {table} DETACH PARTITION {name}".format(
+                        table=quote(table), name=quote(name)))
+
+        # Detached tables no longer take new rows, so the export is final
+        for month, name in sorted(detached_partitions(model).items()):
+            if add_months(month, 1) > before:
+                continue
+
+            path = os.path.join(directory, name + ".jsonl.gz")
+            if not os.path.exists(path):
+                export_table(name, path)
+                paths.append(path)
+
+            if drop:
+                with connection.cursor() as cursor:
+                    cursor.execute("DROP TABLE {name}".format(
+                        name=quote(name)))
+
+    return paths
+
+
+def export_table(name, path):
+    """Write the rows of table ``name`` to ``path`` as gzipped JSON lines"""
+    quote = connection.ops.quote_name
+
+    with transaction.atomic(), gzip.open(path + ".tmp", "wt") as archive:
+        with connection.chunked_cursor() as cursor:
+            cursor.execute("SELECT row_to_json(t)::text FROM {name} t "
+                           "ORDER BY id".format(name=quote(name)))
+            for row in cursor:
+                archive.write(row[0] + "\n")
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,112 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from utils.upserts import increment_rows
+from .models import (DailyCategorySales, DailyProductSales, Order,
+                     OrderItem, PaymentStatus, SalesRollupCursor)
+
+# Orders younger than this are left to the next batch run, so rows of
+# transactions still in flight are not skipped by the watermark.
+BATCH_SETTLE_TIME = timedelta(minutes=1)
+
+
+def record_order_sales(order, items):
+    """Add a new order to the rollups when they are kept inline.
+
+    Only paid orders are sales; orders marked paid after they were placed
+    are counted by update_sales_rollups --rebuild. Runs in the order's
+    transaction. Every order of a day touches the same few category rows,
+    so very busy shops should switch SALES_ROLLUP_INLINE off and run
+    update_sales_rollups instead.
+    """
+    if (not settings.SALES_ROLLUP_INLINE or
+            order.payment_status != PaymentStatus.PAID):
+        return
+
+    # Items still hold the values as posted, e.g. strings or floats
+    fold_sales([(order.id, order.created_at, item.product_id,
+                 item.product.category, int(item.quantity),
+                 Decimal(str(item.price)))
+                for item in items if item.product_id])
+
+
+def remove_order_sales(order):
+    """Take a deleted order back out of the rollups it was counted in"""
+    if not settings.SALES_ROLLUP_INLINE:
+        cursor = SalesRollupCursor.objects.filter(pk=1).first()
+        if cursor is None or order.id > cursor.last_order_id:
+            return
+
+    fold_sales(sales_rows(OrderItem.objects.filter(order=order)), sign=-1)
+
+
+def fold_orders(start, end):
+    """Add the orders with ids in (start, end] to the rollups"""
+    fold_sales(sales_rows(OrderItem.objects.filter(order_id__gt=start,
+                                                   order_id__lte=end)))
+
+
+def settled_order_id():
+    """Highest order id the batch job can fold without missing rows.
+
+    With inline rollups only --rebuild folds orders, and it has to
+    include the newest ones.
+    """
+    orders = Order.objects.all()
+    if not settings.SALES_ROLLUP_INLINE:
+        orders = orders.filter(created_at__lte=timezone.now() -
+                               BATCH_SETTLE_TIME)
+
+    return orders.aggregate(last=Max("id"))["last"] or 0
+
+
+def sales_rows(items):
+    return (items
+            .filter(product__isnull=False,
+                    order__payment_status=PaymentStatus.PAID)
+            .values_list("order_id", "order__created_at", "product_id",
+                         "product__category", "quantity", "price")
+            .iterator(chunk_size=2000))
+
+
+def fold_sales(rows, sign=1):
+    """Sum ``(order_id, created_at, product_id, category, quantity, price)``
+    rows per day and write them onto the rollups, ``sign=-1`` to subtract.
+    """
+    categories = defaultdict(lambda: [0, set(), 0])
+    products = defaultdict(lambda: [0, 0])
+
+    for order_id, created_at, product_id, category, quantity, price in rows:
+        day = timezone.localdate(created_at)
+
+        category_sales = categories[day, category]
+        category_sales[0] += price * quantity
+        category_sales[1].add(order_id)
+        category_sales[2] += quantity
+
+        product_sales = products[day, product_id]
+        product_sales[0] += price * quantity
+        product_sales[1] += quantity
+
+    with transaction.atomic():
+        increment_rows(DailyCategorySales, ["day", "category"], [
+            {"day": day, "category": category,
+             "revenue": sign * revenue,
+             "orders": sign * len(order_ids),
+             "units": sign * units}
+            for (day, category), (revenue, order_ids, units)
+            in categories.items()
+        ])
+
+        increment_rows(DailyProductSales, ["day", "product"], [
+            {"day": day, "product": product_id,
+             "revenue": sign * revenue,
+             "units": sign * units}
+            for (day, product_id), (revenue, units) in products.items()
+        ])
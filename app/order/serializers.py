@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Order, OrderItem
+from .models import Order, OrderItem, UserOrderSummary
 
 
 class OrderItemsSerializer(serializers.ModelSerializer):
@@ -24,3 +24,10 @@ class OrderSerializer(serializers.ModelSerializer):
         serializer = OrderItemsSerializer(order_items, many=True)
 
         return serializer.data
+
+
+class UserOrderSummarySerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = UserOrderSummary
+        fields = ("orders", "total_spent", "last_order_at")
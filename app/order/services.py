@@ -0,0 +1,281 @@
+import logging
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import (Case, CharField, F, IntegerField, Q, Value,
+                              When)
+
+from product.inventory import (release_reservations, take_sharded_stock,
+                               with_available_stock)
+from product.models import (InventoryMode, Product, StockReservation,
+                            StockShard)
+from .events import publish_order_changes
+from .models import Order, OrderItem, OrderStatus
+from .rollups import record_order_sales, remove_order_sales
+from .summaries import record_order_summary, remove_order_summary
+
+logger = logging.getLogger(__name__)
+
+# Statuses an order may be moved to, and the ones it may come from
+STATUS_TRANSITIONS = {
+    OrderStatus.SHIPPED: [OrderStatus.PROCESSING],
+    OrderStatus.DELIVERED: [OrderStatus.PROCESSING, OrderStatus.SHIPPED],
+}
+
+
+class OrderError(Exception):
+    """The order lines can not be fulfilled"""
+
+
+def create_order(lines, reservation=None, paid=False, **fields):
+    """Create an Order with its items and take the stock, atomically.
+
+    ``lines`` are dicts with ``product``, ``quantity``, ``price`` and an
+    optional ``image``; ``fields`` go straight to the Order. Units held by
+    the ``reservation`` of a paid checkout are converted into the order.
+    For SINGLE inventory products the number of queries does not depend on
+    the number of lines.
+
+    A ``paid`` order has been charged already and is never refused: when
+    its reservation expired or was used up by other orders the stock goes
+    below zero, and the order is created with ``needs_review`` set.
+    Products deleted since checkout keep the item's ``name``.
+    """
+    quantities = count_quantities(lines)
+
+    with transaction.atomic():
+        if reservation:
+            release_reservations(reservation)
+
+        products, single, sharded = lock_products(quantities, check=not paid)
+
+        short = [product_id for product_id, quantity in quantities.items()
+                 if product_id not in products or
+                 products[product_id].available_stock < quantity]
+
+        if single:
+            decrement_stock(single, force=paid)
+
+        for product_id, quantity in sharded.items():
+            if take_sharded_stock(products[product_id], quantity,
+                                  force=paid):
+                continue
+            if not paid:
+                raise OrderError("Not enough stock for: {name}".format(
+                    name=products[product_id].name
+                ))
+            if product_id not in short:
+                short.append(product_id)
+
+        if short:
+            logger.warning("Paid order of user %s is short of products %s",
+                           fields.get("user_id", fields.get("user")),
+                           ", ".join(str(i) for i in sorted(short)))
+            fields["needs_review"] = True
+
+        order = Order.objects.create(**fields)
+
+        items = []
+        for line in lines:
+            product = products.get(int(line["product"]))
+            items.append(OrderItem(
+                product=product,
+                order=order,
+                name=product.name if product else line.get("name", ""),
+                quantity=line["quantity"],
+                price=line["price"],
+                image=line.get("image", ""),
+                created_at=order.created_at
+            ))
+        items = OrderItem.objects.bulk_create(items)
+
+        record_order_sales(order, items)
+        record_order_summary(order)
+
+    return order
+
+
+def cancel_order(order):
+    """Delete an order and take it back out of the sales rollups and
+    its user's order summary
+    """
+    with transaction.atomic():
+        remove_order_sales(order)
+        order.delete()
+        remove_order_summary(order)
+
+
+def reserve_stock(lines, reference, expires_at):
+    """Hold the units of ``lines`` for a checkout until ``expires_at``.
+
+    Returns the ordered products by id.
+    """
+    quantities = count_quantities(lines)
+
+    with transaction.atomic():
+        products, _, _ = lock_products(quantities, lock_sharded=True)
+
+        StockReservation.objects.bulk_create([
+            StockReservation(product_id=product_id,
+                             reference=reference,
+                             quantity=quantity,
+                             expires_at=expires_at
+                             )
+            for product_id, quantity in quantities.items()
+        ])
+
+    return products
+
+
+def count_quantities(lines):
+    """Total quantity ordered per product id"""
+    quantities = Counter()
+    for line in lines:
+        if int(line["quantity"]) < 1:
+            raise OrderError("Quantity has to be at least 1")
+        quantities[int(line["product"])] += int(line["quantity"])
+
+    if not quantities:
+        raise OrderError("No order Items. Please add at least one product")
+
+    return quantities
+
+
+def lock_products(quantities, lock_sharded=False, check=True):
+    """Load the ordered products and check enough of each is available.
+
+    SINGLE products are locked in primary key order, so concurrent orders
+    sharing products queue up behind each other instead of deadlocking.
+    SHARDED products are only locked with ``lock_sharded``, together
+    with all their shards, as reserve_stock does; otherwise their shards
+    are locked when the stock is taken. Without ``check``
+    missing and sold out products are left to the caller.
+    """
+    products = (with_available_stock(Product.objects)
+                .in_bulk(sorted(quantities)))
+
+    missing = sorted(set(quantities) - set(products))
+    if missing and check:
+        raise OrderError("Product not found: {ids}".format(
+            ids=", ".join(str(i) for i in missing)
+        ))
+
+    single = {product_id: quantity
+              for product_id, quantity in quantities.items()
+              if product_id in products and
+              products[product_id].inventory_mode == InventoryMode.SINGLE}
+    sharded = {product_id: quantity
+               for product_id, quantity in quantities.items()
+               if product_id in products and product_id not in single}
+
+    locked = quantities if lock_sharded else single
+    if locked:
+        products.update(with_available_stock(Product.objects)
+                        .select_for_update()
+                        .order_by("id")
+                        .in_bulk(sorted(locked)))
+
+    if lock_sharded and sharded:
+        # Wait for the takes in flight and keep new ones out, so the
+        # stock counted next stays free for the caller
+        list(StockShard.objects
+             .select_for_update()
+             .filter(product_id__in=sorted(sharded))
+             .order_by("product_id", "shard")
+             .values_list("id", flat=True))
+        products.update(with_available_stock(Product.objects)
+                        .in_bulk(sorted(sharded)))
+
+    sold_out = [products[product_id].name
+                for product_id, quantity in quantities.items()
+                if product_id in products and
+                products[product_id].available_stock < quantity]
+    if sold_out and check:
+        raise OrderError("Not enough stock for: {names}".format(
+            names=", ".join(sold_out)
+        ))
+
+    return products, single, sharded
+
+
+def decrement_stock(quantities, force=False):
+    """Take ``{product_id: quantity}`` from stock in a single UPDATE.
+
+    Every row is only touched while it still holds enough stock, so a
+    short count means another order got there first and nothing is sold
+    twice. With ``force`` stock may go below zero.
+    """
+    in_stock = Q()
+    for product_id, quantity in quantities.items():
+        in_stock |= (Q(pk=product_id) if force else
+                     Q(pk=product_id, stock__gte=quantity))
+
+    updated = Product.objects.filter(in_stock).update(
+        stock=Case(
+            *[When(pk=product_id, then=F("stock") - quantity)
+              for product_id, quantity in quantities.items()],
+            output_field=IntegerField()
+        )
+    )
+
+    if updated != len(quantities):
+        raise OrderError("Not enough stock to complete the order")
+
+
+def update_order_statuses(changes):
+    """Apply ``{order_id: status}`` with a single UPDATE.
+
+    Orders only move forward along STATUS_TRANSITIONS. The orders are
+    locked in id order while they are checked, and the UPDATE checks the
+    status again, so a concurrent change is never overwritten. Returns a
+    summary of what was updated and what was rejected.
+    """
+    updated = {}
+    unchanged = 0
+    rejected = defaultdict(list)
+
+    with transaction.atomic():
+        current = {order["id"]: order
+                   for order in (Order.objects
+                                 .select_for_update()
+                                 .filter(id__in=list(changes))
+                                 .order_by("id")
+                                 .values("id", "user_id", "status",
+                                         "payment_status"))}
+
+        targets = defaultdict(list)
+        for order_id, target in changes.items():
+            if target not in STATUS_TRANSITIONS:
+                rejected["unknown_status"].append(order_id)
+            elif order_id not in current:
+                rejected["not_found"].append(order_id)
+            elif current[order_id]["status"] == target:
+                unchanged += 1
+            elif (current[order_id]["status"] not in
+                    STATUS_TRANSITIONS[target]):
+                rejected["invalid_transition"].append(order_id)
+            else:
+                targets[target].append(order_id)
+
+        if targets:
+            movable = Q()
+            for target, order_ids in targets.items():
+                movable |= Q(id__in=order_ids,
+                             status__in=STATUS_TRANSITIONS[target])
+
+            Order.objects.filter(movable).update(status=Case(
+                *[When(id__in=order_ids, then=Value(target))
+                  for target, order_ids in targets.items()],
+                output_field=CharField()
+            ))
+
+        # The orders are locked, so every one checked above was moved
+        for target, order_ids in targets.items():
+            updated[target] = len(order_ids)
+
+            publish_order_changes({**current[order_id], "status": target}
+                                  for order_id in order_ids)
+
+    return {"updated": updated,
+            "unchanged": unchanged,
+            "rejected": dict(rejected)}
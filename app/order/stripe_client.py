@@ -0,0 +1,137 @@
+import threading
+import time
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from stripe import APIConnectionError
+from stripe.http_client import RequestsClient
+
+from monitoring.metrics import registry
+from monitoring.timing import timed
+
+
+class CircuitBreaker:
+    """Stop calling Stripe for a while after ``threshold`` failures in a row.
+
+    Once ``reset_seconds`` have passed a single trial call is let through;
+    it closes the circuit again or keeps it open for another period.
+    """
+
+    def __init__(self, threshold, reset_seconds):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+
+            # Half open: block everybody else while the trial call runs
+            self.opened_at = time.monotonic()
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.threshold and self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+class StripeHTTPClient(RequestsClient):
+    """HTTP client for the stripe library with bounded waits.
+
+    Every thread keeps a pooled keep-alive session, calls time out after
+    ``timeout`` (connect, read) seconds and a circuit breaker fails fast
+    while Stripe is down, so a slow Stripe can not pin every worker.
+    Retries with jittered backoff are left to ``stripe.max_network_retries``.
+    Call latencies, failures and the breaker's state go to the metrics
+    registry as the "stripe" service.
+    """
+
+    name = "requests-pooled"
+
+    def __init__(self, timeout=(3, 10), pool_size=10, breaker=None, **kwargs):
+        super().__init__(timeout=timeout, **kwargs)
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker(0, 0)
+
+    def new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.pool_size
+                              )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def request(self, method, url, headers, post_data=None):
+        if not self.breaker.allow():
+            registry.reject_call("stripe")
+            raise APIConnectionError(
+                "Stripe is unavailable, calls are paused for {seconds}s "
+                "after {count} failures".format(
+                    seconds=self.breaker.reset_seconds,
+                    count=self.breaker.failures
+                ),
+                should_retry=False
+            )
+
+        if getattr(self._thread_local, "session", None) is None:
+            self._thread_local.session = self.new_session()
+
+        start = time.monotonic()
+        try:
+            with timed("stripe"):
+                response = super().request(method, url, headers, post_data)
+
+        except APIConnectionError:
+            self.breaker.failure()
+            registry.observe_call("stripe", time.monotonic() - start,
+                                  error=True,
+                                  breaker_open=self.breaker.is_open)
+            raise
+
+        failed = response[1] >= 500
+        if failed:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        registry.observe_call("stripe", time.monotonic() - start,
+                              error=failed, breaker_open=self.breaker.is_open)
+
+        return response
+
+
+def configure_stripe():
+    """Point the stripe library at a StripeHTTPClient built from settings"""
+    stripe.default_http_client = StripeHTTPClient(
+        timeout=(settings.STRIPE_CONNECT_TIMEOUT,
+                 settings.STRIPE_READ_TIMEOUT),
+        pool_size=settings.STRIPE_POOL_SIZE,
+        breaker=CircuitBreaker(settings.STRIPE_BREAKER_THRESHOLD,
+                               settings.STRIPE_BREAKER_RESET_SECONDS
+                               )
+    )
+    stripe.max_network_retries = settings.STRIPE_MAX_RETRIES
+
+    if settings.STRIPE_API_BASE:
+        stripe.api_base = settings.STRIPE_API_BASE
+
+    return stripe.default_http_client
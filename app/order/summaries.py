@@ -0,0 +1,70 @@
+from django.db.models import Count, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from utils.upserts import increment_rows
+from .models import Order, PaymentStatus, UserOrderSummary
+
+
+def record_order_summary(order):
+    """Count a new order into its user's summary.
+
+    Only paid orders add to ``total_spent``, as in the sales rollups;
+    orders marked paid after they were placed are counted by
+    rebuild_order_summaries. Runs in the order's transaction; the
+    counters are incremented in the database, so concurrent orders of one
+    user never lose an update.
+    """
+    if order.user_id is None:
+        return
+
+    increment_rows(UserOrderSummary, ["user"], [
+        {"user": order.user_id, "orders": 1,
+         "total_spent": spent(order)}
+    ])
+
+    (UserOrderSummary.objects
+     .filter(Q(last_order_at__isnull=True) |
+             Q(last_order_at__lt=order.created_at),
+             user_id=order.user_id)
+     .update(last_order_at=order.created_at))
+
+
+def remove_order_summary(order):
+    """Take a deleted order back out of its user's summary"""
+    if order.user_id is None:
+        return
+
+    increment_rows(UserOrderSummary, ["user"], [
+        {"user": order.user_id, "orders": -1,
+         "total_spent": -spent(order)}
+    ])
+
+    UserOrderSummary.objects.filter(user_id=order.user_id).update(
+        last_order_at=Subquery(Order.objects
+                               .filter(user_id=OuterRef("user_id"))
+                               .order_by("-created_at")
+                               .values("created_at")[:1])
+    )
+
+
+def spent(order):
+    """What ``order`` adds to its user's total_spent"""
+    if order.payment_status != PaymentStatus.PAID:
+        return 0
+
+    # total_amount may still hold the value as passed, e.g. a float
+    return int(order.total_amount)
+
+
+def summary_rows():
+    """Freshly aggregated summaries of every user with orders"""
+    return (Order.objects
+            .filter(user__isnull=False)
+            .values("user_id")
+            .annotate(orders=Count("id"),
+                      total_spent=Coalesce(Sum(
+                          "total_amount",
+                          filter=Q(payment_status=PaymentStatus.PAID)), 0),
+                      last_order_at=Max("created_at"))
+            .order_by("user_id")
+            .iterator(chunk_size=2000))
@@ -1,3 +1,1343 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.paginator import EmptyPage
+from django.db import connection, transaction
+from django.test import (TestCase, TransactionTestCase, override_settings,
+                         skipUnlessDBFeature)
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+import stripe
+
+from product.inventory import (available_stock, set_inventory_mode,
+                               take_sharded_stock)
+from product.models import Product, StockReservation
+from asgiref.sync import sync_to_async
+from monitoring.metrics import registry, render_prometheus
+from utils.pubsub import get_broker, PostgresBroker
+from utils.throttling import reset_rate_limits
+from .events import ORDER_CHANNEL
+from .fake_stripe import FakeStripeServer
+from .pagination import CountedPaginator
+from .partitions import partition_name
+from .models import (DailyCategorySales, DailyProductSales, IdempotencyKey,
+                     Order, OrderItem, PaymentStatus, StreamTicket,
+                     StripeEvent, StripeEventStatus, UserOrderSummary)
+from .services import cancel_order, create_order, OrderError
+from .stripe_client import CircuitBreaker, StripeHTTPClient
 
 # Create your tests here.
+
+
+def setUpModule():
+    reset_rate_limits()
+
+
+SHIPPING = {
+    "street": "1 Main St",
+    "city": "Springfield",
+    "state": "IL",
+    "zip_code": "62701",
+    "phone_no": "555-0100",
+    "country": "US",
+}
+
+
+class NewOrderTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="buyer@example.com",
+                                        email="buyer@example.com"
+                                        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = [
+            Product.objects.create(name="Product {i}".format(i=i),
+                                   category="Food",
+                                   price=10,
+                                   stock=10
+                                   )
+            for i in range(5)
+        ]
+
+    def post_order(self, lines):
+        return self.client.post("/api/orders/new/",
+                                {**SHIPPING, "orderItems": lines},
+                                format="json"
+                                )
+
+    def test_every_line_takes_stock(self):
+        res = self.post_order([
+            {"product": self.products[0].id, "quantity": 2, "price": 10},
+            {"product": self.products[1].id, "quantity": 3, "price": 10},
+        ])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.data["orderItems"]), 2)
+        self.assertEqual(res.data["total_amount"], 50)
+
+        stock = dict(Product.objects.values_list("id", "stock"))
+        self.assertEqual(stock[self.products[0].id], 8)
+        self.assertEqual(stock[self.products[1].id], 7)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        def count_queries(products):
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.post_order([
+                    {"product": p.id, "quantity": 1, "price": 10}
+                    for p in products
+                ])
+            self.assertEqual(res.status_code, 200)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(self.products[:1]),
+                         count_queries(self.products)
+                         )
+
+    def test_oversell_is_rejected_without_writes(self):
+        res = self.post_order([
+            {"product": self.products[0].id, "quantity": 1, "price": 10},
+            {"product": self.products[1].id, "quantity": 11, "price": 10},
+        ])
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(Product.objects.get(id=self.products[0].id).stock, 10)
+
+    def test_unknown_product_is_rejected(self):
+        res = self.post_order([{"product": 0, "quantity": 1, "price": 10}])
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderListingTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="buyer@example.com")
+        self.other = User.objects.create(username="other@example.com")
+        self.admin = User.objects.create(username="admin@example.com",
+                                         is_staff=True
+                                         )
+        self.product = Product.objects.create(name="Lamp", category="Home",
+                                              price=10, stock=100
+                                              )
+        self.client = APIClient()
+        cache.clear()
+
+    def add_orders(self, user, count, items=1):
+        for _ in range(count):
+            order = Order.objects.create(user=user, total_amount=10)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=self.product, name="Lamp",
+                          price=10)
+                for _ in range(items)
+            ])
+
+    def list_orders(self, user, query=""):
+        self.client.force_authenticate(user)
+        return self.client.get("/api/orders/" + query)
+
+    def test_customers_only_see_their_orders(self):
+        self.add_orders(self.user, 2)
+        self.add_orders(self.other, 3)
+
+        res = self.list_orders(self.user)
+
+        self.assertEqual(res.data["count"], 2)
+        self.assertEqual({o["user"] for o in res.data["orders"]},
+                         {self.user.id})
+        self.assertEqual(self.list_orders(self.admin).data["count"], 5)
+
+    def test_count_follows_the_filters(self):
+        self.add_orders(self.user, 3)
+        Order.objects.filter(pk=Order.objects.first().pk).update(
+            status="SHIPPED"
+        )
+
+        res = self.list_orders(self.admin, "?status=SHIPPED")
+
+        self.assertEqual(res.data["count"], 1)
+        self.assertFalse(res.data["countIsEstimate"])
+
+    def test_small_counts_are_not_cached(self):
+        self.add_orders(self.user, 10)
+        self.assertEqual(self.list_orders(self.user).data["count"], 10)
+
+        self.add_orders(self.user, 1)
+        res = self.list_orders(self.user, "?page=2")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["count"], 11)
+        self.assertEqual(len(res.data["orders"]), 1)
+
+    def test_page_past_an_estimated_count_is_counted_exactly(self):
+        self.add_orders(self.user, 11)
+
+        paginator = CountedPaginator(Order.objects.order_by("id"), 10,
+                                     count=10, estimated=True)
+        page = paginator.page(2)
+
+        self.assertEqual(len(page), 1)
+        self.assertEqual(paginator.count, 11)
+        self.assertFalse(paginator.estimated)
+        with self.assertRaises(EmptyPage):
+            paginator.page(3)
+
+    def test_page_queries_do_not_grow_with_orders_or_items(self):
+        self.add_orders(self.user, 2)
+        self.list_orders(self.user)
+
+        with CaptureQueriesContext(connection) as small:
+            self.list_orders(self.user, "?page=1")
+
+        self.add_orders(self.user, 20, items=5)
+        cache.clear()
+        self.list_orders(self.user)
+
+        with CaptureQueriesContext(connection) as large:
+            res = self.list_orders(self.user, "?page=2")
+
+        self.assertEqual(len(res.data["orders"]), 10)
+        self.assertEqual(len(large), len(small))
+
+    def test_cursor_pages_walk_every_order(self):
+        self.add_orders(self.user, 25)
+
+        seen = []
+        res = self.list_orders(self.user, "?paginate=cursor")
+        while True:
+            seen += [o["id"] for o in res.data["orders"]]
+            if not res.data["next"]:
+                break
+            res = self.client.get(res.data["next"])
+
+        self.assertEqual(sorted(seen), sorted(
+            Order.objects.values_list("id", flat=True)
+        ))
+        self.assertEqual(res.data["count"], 25)
+
+
+class SalesRollupTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create(username="admin@example.com",
+                                         is_staff=True
+                                         )
+        self.lamp = Product.objects.create(name="Lamp", category="Home",
+                                           price=10, stock=100
+                                           )
+        self.desk = Product.objects.create(name="Desk", category="Home",
+                                           price=50, stock=100
+                                           )
+        self.book = Product.objects.create(name="Book", category="Books",
+                                           price=5, stock=100
+                                           )
+
+    def place_orders(self):
+        create_order([{"product": self.lamp.id, "quantity": 2, "price": 10},
+                      {"product": self.desk.id, "quantity": 1, "price": 50}],
+                     total_amount=70, payment_status="PAID")
+        create_order([{"product": self.lamp.id, "quantity": 1, "price": 10},
+                      {"product": self.book.id, "quantity": 3, "price": 5}],
+                     total_amount=25, payment_status="PAID")
+
+    def category_sales(self):
+        return {row.category: (row.revenue, row.orders, row.units)
+                for row in DailyCategorySales.objects.all()}
+
+    def test_orders_are_rolled_up_as_they_are_placed(self):
+        self.place_orders()
+
+        self.assertEqual(self.category_sales(), {
+            "Home": (Decimal("80.00"), 2, 4),
+            "Books": (Decimal("15.00"), 1, 3),
+        })
+        self.assertEqual(
+            DailyProductSales.objects.get(product=self.lamp).units, 3
+        )
+
+        cancel_order(Order.objects.order_by("id").last())
+
+        self.assertEqual(self.category_sales(), {
+            "Home": (Decimal("70.00"), 1, 3),
+            "Books": (Decimal("0.00"), 0, 0),
+        })
+
+    def test_unpaid_orders_are_not_sales(self):
+        self.place_orders()
+        unpaid = create_order([{"product": self.book.id, "quantity": 1,
+                                "price": 5}],
+                              total_amount=5)
+        paid = self.category_sales()
+
+        self.assertEqual(paid["Books"], (Decimal("15.00"), 1, 3))
+
+        call_command("update_sales_rollups", "--rebuild", stdout=mock.Mock())
+        self.assertEqual(self.category_sales(), paid)
+
+        cancel_order(unpaid)
+        self.assertEqual(self.category_sales(), paid)
+
+    def test_batch_job_matches_inline_rollups(self):
+        self.place_orders()
+        inline = self.category_sales()
+
+        call_command("update_sales_rollups", "--rebuild", "--batch-size=1",
+                     stdout=mock.Mock())
+
+        self.assertEqual(self.category_sales(), inline)
+
+    @override_settings(SALES_ROLLUP_INLINE=False)
+    def test_batch_job_folds_settled_orders_once(self):
+        self.place_orders()
+        self.assertFalse(DailyCategorySales.objects.exists())
+
+        Order.objects.update(created_at=timezone.now() - timedelta(hours=1))
+        call_command("update_sales_rollups", stdout=mock.Mock())
+        call_command("update_sales_rollups", stdout=mock.Mock())
+
+        self.assertEqual(self.category_sales()["Home"],
+                         (Decimal("80.00"), 2, 4))
+
+    def test_report_reads_the_rollups(self):
+        self.place_orders()
+        client = APIClient()
+        client.force_authenticate(self.admin)
+
+        with self.assertNumQueries(1):
+            res = client.get("/api/reports/sales/?by=product&period=month")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [(row["product__name"], row["revenue"])
+             for row in res.data["rows"]],
+            [("Desk", Decimal("50.00")), ("Lamp", Decimal("30.00")),
+             ("Book", Decimal("15.00"))]
+        )
+
+
+class UserOrderSummaryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="c@example.com")
+        self.lamp = Product.objects.create(name="Lamp", category="Home",
+                                           price=10, stock=100
+                                           )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def place_order(self, total_amount, user=True, paid=True):
+        return create_order([{"product": self.lamp.id, "quantity": 1,
+                              "price": 10}],
+                            user=self.user if user else None,
+                            total_amount=total_amount,
+                            payment_status=(PaymentStatus.PAID if paid else
+                                            PaymentStatus.UNPAID))
+
+    def summary(self):
+        return self.client.get("/api/me/orders/summary/").data["summary"]
+
+    def test_summary_follows_new_and_deleted_orders(self):
+        self.assertEqual(self.summary(), {"orders": 0, "total_spent": 0,
+                                          "last_order_at": None})
+
+        first = self.place_order(10)
+        Order.objects.filter(pk=first.pk).update(
+            created_at=timezone.now() - timedelta(days=3))
+        first.refresh_from_db()
+        latest = self.place_order(25.5)
+        self.place_order(10, user=False)
+
+        with self.assertNumQueries(1):
+            summary = self.summary()
+
+        self.assertEqual(summary["orders"], 2)
+        self.assertEqual(summary["total_spent"], 35)
+        self.assertEqual(summary["last_order_at"],
+                         latest.created_at.isoformat().replace("+00:00",
+                                                               "Z"))
+
+        res = self.client.delete(
+            "/api/orders/{id}/delete/".format(id=latest.id))
+
+        self.assertEqual(res.status_code, 200)
+        summary = UserOrderSummary.objects.get(user=self.user)
+        self.assertEqual((summary.orders, summary.total_spent,
+                          summary.last_order_at),
+                         (1, 10, first.created_at))
+
+    def test_unpaid_orders_are_not_spent(self):
+        self.place_order(10)
+        unpaid = self.place_order(20, paid=False)
+
+        summary = self.summary()
+        self.assertEqual((summary["orders"], summary["total_spent"]),
+                         (2, 10))
+
+        cancel_order(unpaid)
+
+        summary = UserOrderSummary.objects.get(user=self.user)
+        self.assertEqual((summary.orders, summary.total_spent), (1, 10))
+
+    def test_rebuild_matches_the_maintained_summaries(self):
+        self.place_order(10)
+        self.place_order(40)
+        self.place_order(15, paid=False)
+        maintained = list(UserOrderSummary.objects.values(
+            "user", "orders", "total_spent", "last_order_at"))
+        UserOrderSummary.objects.update(orders=0, total_spent=0)
+
+        call_command("rebuild_order_summaries", "--batch-size=1",
+                     stdout=mock.Mock())
+
+        self.assertEqual(list(UserOrderSummary.objects.values(
+            "user", "orders", "total_spent", "last_order_at")), maintained)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql",
+                     "Partitioning needs PostgreSQL")
+class OrderPartitionTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create(username="admin@example.com",
+                                         is_staff=True
+                                         )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.product = Product.objects.create(name="Lamp", category="Home",
+                                              price=10, stock=100
+                                              )
+
+    def place_order(self, created_at=None):
+        order = create_order([{"product": self.product.id,
+                               "quantity": 1,
+                               "price": 10}],
+                             total_amount=10)
+        if created_at:
+            Order.objects.filter(pk=order.pk).update(created_at=created_at)
+            OrderItem.objects.filter(order=order).update(
+                created_at=created_at
+            )
+        return order
+
+    def test_orders_survive_partitioning_and_archival(self):
+        long_ago = timezone.now() - timedelta(days=1000)
+        old = self.place_order(long_ago)
+        recent = self.place_order()
+
+        call_command("partition_order_tables", stdout=mock.Mock())
+        new = self.place_order()
+
+        for order in (old, recent, new):
+            res = self.client.get("/api/orders/{id}/".format(id=order.id))
+            self.assertEqual(res.data["order"]["orderItems"][0]["name"],
+                             "Lamp")
+        self.assertEqual(
+            self.client.get("/api/orders/").data["count"], 3
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            call_command("archive_order_partitions", directory, "--drop",
+                         stdout=mock.Mock())
+
+            with gzip.open(os.path.join(directory, "{table}.jsonl.gz".format(
+                    table=partition_name("order_order", long_ago)
+                    )), "rt") as archive:
+                rows = [json.loads(line) for line in archive]
+
+        self.assertEqual([row["id"] for row in rows], [old.id])
+        self.assertEqual(
+            self.client.get("/api/orders/{id}/".format(id=old.id)
+                            ).status_code, 404
+        )
+        self.assertEqual(
+            list(Order.objects.values_list("id", flat=True).order_by("id")),
+            [recent.id, new.id]
+        )
+
+    def test_failed_export_is_retried_on_the_next_run(self):
+        long_ago = timezone.now() - timedelta(days=1000)
+        old = self.place_order(long_ago)
+        call_command("partition_order_tables", stdout=mock.Mock())
+
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch("order.partitions.export_table",
+                            side_effect=OSError("Disk full")):
+                with self.assertRaises(OSError):
+                    call_command("archive_order_partitions", directory,
+                                 "--drop", stdout=mock.Mock())
+
+            # Detached, so the listing no longer finds it
+            self.assertFalse(Order.objects.filter(pk=old.pk).exists())
+
+            call_command("archive_order_partitions", directory, "--drop",
+                         stdout=mock.Mock())
+
+            with gzip.open(os.path.join(directory, "{table}.jsonl.gz".format(
+                    table=partition_name("order_order", long_ago)
+                    )), "rt") as archive:
+                rows = [json.loads(line) for line in archive]
+
+        self.assertEqual([row["id"] for row in rows], [old.id])
+
+
+class BulkProcessOrdersTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create(username="admin@example.com",
+                                         is_staff=True
+                                         )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.orders = [Order.objects.create(total_amount=10)
+                       for _ in range(4)]
+        Order.objects.filter(pk=self.orders[3].pk).update(status="DELIVERED")
+
+    def status_of(self, order):
+        order.refresh_from_db()
+        return order.status
+
+    def test_orders_move_forward_in_one_update(self):
+        ids = [order.id for order in self.orders]
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.post("/api/orders/bulk/process/", {
+                "status": "SHIPPED",
+                "orders": ids + [0]
+            }, format="json")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, {
+            "updated": {"SHIPPED": 3},
+            "unchanged": 0,
+            "rejected": {"invalid_transition": [ids[3]], "not_found": [0]},
+        })
+        self.assertEqual(
+            [q["sql"].split()[0] for q in queries].count("UPDATE"), 1
+        )
+        self.assertEqual(self.status_of(self.orders[3]), "DELIVERED")
+
+    def test_csv_upload(self):
+        upload = io.BytesIO("order_id,status\n{0},SHIPPED\n{1},\n"
+                            "{2},PROCESSING\n".format(
+                                *[o.id for o in self.orders]).encode())
+        upload.name = "orders.csv"
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.post("/api/orders/bulk/process/", {
+                "status": "DELIVERED", "file": upload
+            }, format="multipart")
+
+        self.assertEqual(res.data["updated"], {"SHIPPED": 1, "DELIVERED": 1})
+        self.assertEqual(
+            [q["sql"].split()[0] for q in queries].count("UPDATE"), 1
+        )
+        self.assertEqual(self.status_of(self.orders[0]), "SHIPPED")
+        self.assertEqual(res.data["rejected"],
+                         {"unknown_status": [self.orders[2].id]})
+        self.assertEqual(self.status_of(self.orders[1]), "DELIVERED")
+
+    def test_customers_can_not_bulk_process(self):
+        self.client.force_authenticate(User.objects.create(username="c"))
+
+        res = self.client.post("/api/orders/bulk/process/", {
+            "status": "SHIPPED", "orders": [self.orders[0].id]
+        }, format="json")
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(self.status_of(self.orders[0]), "PROCESSING")
+
+
+class OrderEventsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="c@example.com")
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.order = Order.objects.create(user=self.user, total_amount=10)
+        self.channel = ORDER_CHANNEL.format(user_id=self.user.id)
+
+    def ticket(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post("/api/orders/events/ticket/").data["ticket"]
+
+    async def test_stream_carries_the_users_order_changes(self):
+        ticket = await sync_to_async(self.ticket)()
+        res = await self.async_client.get("/api/orders/events/",
+                                          {"ticket": ticket})
+        stream = res.streaming_content
+
+        self.assertEqual(res["Content-Type"], "text/event-stream")
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+
+        get_broker().deliver(self.channel, {"id": self.order.id,
+                                            "status": "SHIPPED"})
+        chunk = await asyncio.wait_for(anext(stream), 5)
+
+        self.assertEqual(chunk, "event: order\ndata: {data}\n\n".format(
+            data=json.dumps({"id": self.order.id, "status": "SHIPPED"})
+        ).encode())
+
+        await stream.aclose()
+
+    @override_settings(ORDER_EVENTS_HEARTBEAT_SECONDS=0.01)
+    async def test_idle_stream_sends_keep_alives(self):
+        res = await self.async_client.get(
+            "/api/orders/events/",
+            AUTHORIZATION="Bearer " + self.token
+        )
+        stream = res.streaming_content
+        await anext(stream)
+
+        self.assertEqual(await anext(stream), b": keep-alive\n\n")
+        await stream.aclose()
+
+    async def test_tickets_are_single_use(self):
+        ticket = await sync_to_async(self.ticket)()
+
+        res = await self.async_client.get("/api/orders/events/",
+                                          {"ticket": ticket})
+        await res.streaming_content.aclose()
+        res = await self.async_client.get("/api/orders/events/",
+                                          {"ticket": ticket})
+
+        self.assertEqual(res.status_code, 401)
+
+    async def test_expired_ticket_is_refused(self):
+        ticket = await sync_to_async(self.ticket)()
+        await StreamTicket.objects.aupdate(
+            expires_at=timezone.now() - timedelta(seconds=1))
+
+        res = await self.async_client.get("/api/orders/events/",
+                                          {"ticket": ticket})
+
+        self.assertEqual(res.status_code, 401)
+
+    async def test_access_token_is_not_taken_from_the_url(self):
+        res = await self.async_client.get("/api/orders/events/",
+                                          {"token": self.token})
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_stream_is_not_served_over_wsgi(self):
+        res = self.client.get("/api/orders/events/",
+                              HTTP_AUTHORIZATION="Bearer " + self.token)
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_status_changes_are_published_after_commit(self):
+        admin = User.objects.create(username="admin", is_staff=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        with mock.patch.object(get_broker(), "deliver") as deliver, \
+                self.captureOnCommitCallbacks(execute=True):
+            client.put("/api/orders/{id}/process/".format(id=self.order.id),
+                       {"status": "SHIPPED"}, format="json")
+            client.post("/api/orders/bulk/process/", {
+                "status": "DELIVERED", "orders": [self.order.id]
+            }, format="json")
+            self.assertFalse(deliver.called)
+
+        self.assertEqual([c.args for c in deliver.call_args_list], [
+            (self.channel, {"id": self.order.id, "status": "SHIPPED",
+                            "payment_status": "UNPAID"}),
+            (self.channel, {"id": self.order.id, "status": "DELIVERED",
+                            "payment_status": "UNPAID"}),
+        ])
+
+
+@unittest.skipUnless(connection.vendor == "postgresql",
+                     "LISTEN/NOTIFY needs PostgreSQL")
+class PostgresBrokerTests(TransactionTestCase):
+
+    async def test_notifications_reach_subscribers_after_commit(self):
+        broker = PostgresBroker()
+        subscription = broker.subscribe("orders:user:1")
+
+        def publish():
+            with transaction.atomic():
+                broker.publish("orders:user:1", {"id": 1})
+                broker.publish("orders:user:2", {"id": 2})
+            with transaction.atomic():
+                broker.publish("orders:user:1", {"id": 3})
+                transaction.set_rollback(True)
+
+        # Wait for the listener before publishing
+        await asyncio.sleep(0.5)
+        await sync_to_async(publish)()
+
+        self.assertEqual(await asyncio.wait_for(subscription.get(), 5),
+                         {"id": 1})
+        await asyncio.sleep(0.2)
+        self.assertTrue(subscription.queue.empty())
+        subscription.close()
+        await sync_to_async(broker.stop)()
+
+
+class IdempotencyKeyTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="buyer@example.com",
+                                        email="buyer@example.com"
+                                        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(name="Lamp", category="Home",
+                                              price=10, stock=10
+                                              )
+
+    def post_order(self, key, quantity=1):
+        return self.client.post("/api/orders/new/", {
+            **SHIPPING,
+            "orderItems": [{"product": self.product.id,
+                            "quantity": quantity,
+                            "price": 10}]
+        }, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.post_order("retry-1")
+        second = self.post_order("retry-1")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data["id"], first.data["id"])
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.count(), 1)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 9)
+
+    def test_key_reused_for_another_request_is_rejected(self):
+        self.post_order("retry-1")
+
+        res = self.post_order("retry-1", quantity=2)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_duplicate_in_progress_is_not_run_twice(self):
+        self.post_order("retry-1")
+        # As seen while the first request is still running
+        IdempotencyKey.objects.update(status_code=None, response=None)
+
+        res = self.post_order("retry-1")
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_server_errors_are_not_stored(self):
+        with mock.patch("order.views.create_order", side_effect=RuntimeError):
+            res = self.post_order("retry-1")
+
+        self.assertEqual(res.status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        res = self.post_order("retry-1")
+        self.assertEqual(res.status_code, 200)
+
+    def test_expired_keys_are_purged(self):
+        self.post_order("retry-1")
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+
+        call_command("purge_idempotency_keys", stdout=mock.Mock())
+
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class CheckoutReservationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="buyer@example.com",
+                                        email="buyer@example.com"
+                                        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(name="Last ones",
+                                              category="Food",
+                                              price=10,
+                                              stock=2
+                                              )
+
+    def checkout(self, quantity):
+        with mock.patch("stripe.checkout.Session.create",
+                        return_value={"id": "cs_test"}) as create:
+            res = self.client.post("/api/create-checkout-session/", {
+                **SHIPPING,
+                "orderItems": [{"product": self.product.id,
+                                "name": self.product.name,
+                                "image": "",
+                                "quantity": quantity,
+                                "price": 10}]
+            }, format="json")
+        return res, create
+
+    def test_checkout_holds_stock(self):
+        res, create = self.checkout(2)
+
+        self.assertEqual(res.status_code, 200)
+        reference = create.call_args.kwargs["metadata"]["reservation"]
+        self.assertEqual(
+            StockReservation.objects.get(reference=reference).quantity, 2
+        )
+
+        res, _ = self.checkout(1)
+        self.assertEqual(res.status_code, 400)
+
+        with self.assertRaises(OrderError):
+            create_order([{"product": self.product.id,
+                           "quantity": 1,
+                           "price": 10}],
+                         total_amount=10)
+
+    def test_paid_checkout_converts_its_reservation(self):
+        _, create = self.checkout(2)
+        reference = create.call_args.kwargs["metadata"]["reservation"]
+
+        create_order([{"product": self.product.id,
+                       "quantity": 2,
+                       "price": 10}],
+                     reservation=reference,
+                     total_amount=20)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_paid_checkout_is_never_refused(self):
+        _, create = self.checkout(2)
+        reference = create.call_args.kwargs["metadata"]["reservation"]
+
+        # The webhook is late and another order took the units meanwhile
+        StockReservation.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        create_order([{"product": self.product.id,
+                       "quantity": 2,
+                       "price": 10}],
+                     total_amount=20)
+
+        with self.assertLogs("order.services", level="WARNING"):
+            order = create_order([{"product": self.product.id,
+                                   "quantity": 2,
+                                   "price": 10}],
+                                 reservation=reference,
+                                 paid=True,
+                                 total_amount=20)
+
+        self.assertTrue(order.needs_review)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, -2)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_reservations_hold_units_of_sharded_products(self):
+        product = set_inventory_mode(self.product.id, 2)
+        _, create = self.checkout(2)
+        reference = create.call_args.kwargs["metadata"]["reservation"]
+
+        self.assertFalse(take_sharded_stock(product, 1))
+        with self.assertRaises(OrderError):
+            create_order([{"product": product.id,
+                           "quantity": 1,
+                           "price": 10}],
+                         total_amount=10)
+
+        order = create_order([{"product": product.id,
+                               "quantity": 2,
+                               "price": 10}],
+                             reservation=reference,
+                             paid=True,
+                             total_amount=20)
+
+        self.assertFalse(order.needs_review)
+        self.assertEqual(available_stock(product), 0)
+
+    def test_paid_checkout_of_sharded_product_is_never_refused(self):
+        product = set_inventory_mode(self.product.id, 2)
+        _, create = self.checkout(2)
+        reference = create.call_args.kwargs["metadata"]["reservation"]
+
+        # The webhook is late and another order took the units meanwhile
+        StockReservation.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertTrue(take_sharded_stock(product, 2))
+
+        with self.assertLogs("order.services", level="WARNING"):
+            order = create_order([{"product": product.id,
+                                   "quantity": 2,
+                                   "price": 10}],
+                                 reservation=reference,
+                                 paid=True,
+                                 total_amount=20)
+
+        self.assertTrue(order.needs_review)
+        self.assertEqual(available_stock(product), -2)
+
+    def test_expired_reservations_are_released(self):
+        self.checkout(2)
+        StockReservation.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        res, _ = self.checkout(2)
+        self.assertEqual(res.status_code, 200)
+
+        call_command("release_expired_reservations", stdout=mock.Mock())
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+    def test_checkout_uses_catalog_prices(self):
+        Product.objects.filter(pk=self.product.pk).update(price=12)
+
+        with mock.patch("stripe.checkout.Session.create",
+                        return_value={"id": "cs_test"}) as create:
+            self.client.post("/api/create-checkout-session/", {
+                **SHIPPING,
+                "orderItems": [{"product": self.product.id,
+                                "name": "Free",
+                                "image": "",
+                                "quantity": 1,
+                                "price": 0}]
+            }, format="json")
+
+        line_item = create.call_args.kwargs["line_items"][0]
+        self.assertEqual(line_item["price_data"]["unit_amount"], 1200)
+        self.assertEqual(line_item["price_data"]["product_data"]["name"],
+                         "Last ones")
+
+    def test_synced_products_are_sent_by_price_id(self):
+        Product.objects.filter(pk=self.product.pk).update(
+            stripe_price_id="price_test", stripe_price_amount=10
+        )
+
+        _, create = self.checkout(1)
+
+        self.assertEqual(create.call_args.kwargs["line_items"],
+                         [{"price": "price_test", "quantity": 1}])
+
+        # A price changed since the last sync is not sent by its stale id
+        Product.objects.filter(pk=self.product.pk).update(price=11)
+
+        _, create = self.checkout(1)
+
+        self.assertNotIn("price", create.call_args.kwargs["line_items"][0])
+
+    def test_failed_session_releases_stock(self):
+        with mock.patch("stripe.checkout.Session.create",
+                        side_effect=RuntimeError):
+            res = self.client.post("/api/create-checkout-session/", {
+                **SHIPPING,
+                "orderItems": [{"product": self.product.id,
+                                "name": self.product.name,
+                                "image": "",
+                                "quantity": 1,
+                                "price": 10}]
+            }, format="json")
+
+        self.assertEqual(res.status_code, 500)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class FakeStripe:
+    """Local stand-in for the Stripe endpoints the webhook worker calls"""
+
+    secret = "whsec_test"
+
+    def __init__(self):
+        self.products = {}
+        self.line_items = {}
+        self.calls = 0
+
+    def add_session(self, session_id, items):
+        self.line_items[session_id] = []
+        for product, quantity, unit_amount in items:
+            stripe_id = "prod_{id}".format(id=product.id)
+            self.products[stripe_id] = {
+                "id": stripe_id,
+                "object": "product",
+                "images": ["https://img.example.com/{id}".format(
+                    id=product.id)],
+                "metadata": {"product_id": str(product.id)},
+            }
+            self.line_items[session_id].append({
+                "object": "item",
+                "description": product.name,
+                "quantity": quantity,
+                "price": {"object": "price",
+                          "product": stripe_id,
+                          "unit_amount": unit_amount},
+            })
+
+    def list_line_items(self, session_id, expand=(), **params):
+        self.calls += 1
+        items = json.loads(json.dumps(self.line_items[session_id]))
+
+        if "data.price.product" in expand:
+            for item in items:
+                item["price"]["product"] = self.products[
+                    item["price"]["product"]]
+
+        return stripe.ListObject.construct_from(
+            {"object": "list", "data": items, "has_more": False}, "sk_test"
+        )
+
+    def retrieve_product(self, stripe_id, **params):
+        self.calls += 1
+        return stripe.Product.construct_from(self.products[stripe_id],
+                                             "sk_test"
+                                             )
+
+    def patch(self):
+        return mock.patch.multiple(
+            "stripe",
+            checkout=mock.Mock(Session=mock.Mock(
+                list_line_items=self.list_line_items)),
+            Product=mock.Mock(retrieve=self.retrieve_product,
+                              construct_from=stripe.Product.construct_from),
+            ListObject=stripe.ListObject,
+        )
+
+    def deliver(self, client, event):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = stripe.WebhookSignature._compute_signature(
+            "{t}.{payload}".format(t=timestamp, payload=payload), self.secret
+        )
+
+        with mock.patch.dict(os.environ,
+                             {"STRIPE_WEBHOOK_SECRET": self.secret}):
+            return client.post(
+                "/api/order/webhook/",
+                payload,
+                content_type="application/json",
+                HTTP_STRIPE_SIGNATURE="t={t},v1={sig}".format(
+                    t=timestamp, sig=signature)
+            )
+
+
+class StripeWebhookTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="buyer@example.com",
+                                        email="buyer@example.com"
+                                        )
+        self.product = Product.objects.create(name="Paid for",
+                                              category="Food",
+                                              price=10,
+                                              stock=5
+                                              )
+        self.stripe = FakeStripe()
+        self.stripe.add_session("cs_test_1", [(self.product, 2, 1000)])
+        self.event = {
+            "id": "evt_test_1",
+            "object": "event",
+            "type": "checkout.session.completed",
+            "data": {"object": {
+                "id": "cs_test_1",
+                "object": "checkout.session",
+                "amount_total": 2000,
+                "metadata": {**SHIPPING, "user": str(self.user.id)},
+            }},
+        }
+
+    def test_webhook_only_queues_the_event(self):
+        with self.stripe.patch():
+            res = self.stripe.deliver(self.client, self.event)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.stripe.calls, 0)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(StripeEvent.objects.get().event_id, "evt_test_1")
+
+    def test_bad_signature_is_rejected(self):
+        with mock.patch.dict(os.environ,
+                             {"STRIPE_WEBHOOK_SECRET": FakeStripe.secret}):
+            res = self.client.post("/api/order/webhook/",
+                                   json.dumps(self.event),
+                                   content_type="application/json",
+                                   HTTP_STRIPE_SIGNATURE="t=1,v1=forged"
+                                   )
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_retried_delivery_creates_one_order(self):
+        with self.stripe.patch():
+            for _ in range(3):
+                self.stripe.deliver(self.client, self.event)
+
+            call_command("process_stripe_events", stdout=mock.Mock())
+            call_command("process_stripe_events", stdout=mock.Mock())
+
+        order = Order.objects.get()
+        self.assertEqual(order.user, self.user)
+        self.assertEqual(order.payment_status, "PAID")
+        self.assertEqual(order.orderitems.get().quantity, 2)
+        self.assertEqual(StripeEvent.objects.get().status,
+                         StripeEventStatus.PROCESSED
+                         )
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_stripe_is_called_outside_transactions(self):
+        list_line_items = self.stripe.list_line_items
+        open_blocks = []
+
+        def spy(*args, **kwargs):
+            open_blocks.extend(block for block in connection.atomic_blocks
+                               if not block._from_testcase)
+            return list_line_items(*args, **kwargs)
+
+        self.stripe.list_line_items = spy
+        with self.stripe.patch():
+            self.stripe.deliver(self.client, self.event)
+            call_command("process_stripe_events", stdout=mock.Mock())
+
+        self.assertEqual(self.stripe.calls, 1)
+        self.assertEqual(open_blocks, [])
+        self.assertTrue(Order.objects.exists())
+
+    def test_paid_order_is_kept_when_stock_ran_out(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=1)
+
+        with self.stripe.patch():
+            self.stripe.deliver(self.client, self.event)
+            with self.assertLogs("order.services", level="WARNING"):
+                call_command("process_stripe_events", stdout=mock.Mock())
+
+        self.assertTrue(Order.objects.get().needs_review)
+        self.assertEqual(StripeEvent.objects.get().status,
+                         StripeEventStatus.PROCESSED
+                         )
+
+    def test_fulfillment_costs_one_stripe_call(self):
+        products = [
+            Product.objects.create(name="Item {i}".format(i=i),
+                                   category="Food", price=10, stock=5)
+            for i in range(20)
+        ]
+        self.stripe.add_session("cs_test_1", [(p, 1, 1000) for p in products])
+
+        with self.stripe.patch():
+            self.stripe.deliver(self.client, self.event)
+            call_command("process_stripe_events", stdout=mock.Mock())
+
+        self.assertEqual(self.stripe.calls, 1)
+        self.assertEqual(Order.objects.get().orderitems.count(), 20)
+
+    def test_failing_event_is_retried_later(self):
+        with mock.patch("order.webhooks.fulfill_checkout_session",
+                        side_effect=stripe.error.APIConnectionError("down")):
+            self.stripe.deliver(self.client, self.event)
+            with self.assertLogs("order.webhooks", level="ERROR"):
+                call_command("process_stripe_events", stdout=mock.Mock())
+
+        event = StripeEvent.objects.get()
+        self.assertEqual(event.status, StripeEventStatus.PENDING)
+        self.assertEqual(event.attempts, 1)
+        self.assertGreater(event.available_at, timezone.now())
+        self.assertFalse(Order.objects.exists())
+
+
+class StripeHTTPClientTests(TestCase):
+
+    def setUp(self):
+        self.server = FakeStripeServer().start()
+        self.addCleanup(self.server.stop)
+
+        self.http_client = StripeHTTPClient(
+            timeout=(1, 1),
+            breaker=CircuitBreaker(threshold=2, reset_seconds=60)
+        )
+        registry.reset()
+        patcher = mock.patch.multiple("stripe",
+                                      default_http_client=self.http_client,
+                                      api_base=self.server.url,
+                                      api_key="sk_test",
+                                      max_network_retries=0
+                                      )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create(username="buyer@example.com",
+                                        email="buyer@example.com"
+                                        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(name="Lamp", category="Home",
+                                              price=10, stock=5
+                                              )
+
+    def checkout(self):
+        return self.client.post("/api/create-checkout-session/", {
+            **SHIPPING,
+            "orderItems": [{"product": self.product.id, "quantity": 2}]
+        }, format="json")
+
+    def test_checkout_over_http(self):
+        res = self.checkout()
+
+        self.assertEqual(res.status_code, 200)
+        session_id = res.data["session"]["id"]
+        line_items = stripe.checkout.Session.list_line_items(
+            session_id, expand=["data.price.product"]
+        )
+        self.assertEqual(line_items.data[0].price.unit_amount, 1000)
+        latency = registry.snapshot()["upstream_latency"]
+        self.assertEqual(sum(latency["stripe|ok"][:-1]), 2)
+
+    def test_breaker_fails_fast_while_stripe_is_down(self):
+        self.server.error_rate = 1
+
+        for _ in range(2):
+            with self.assertRaises(stripe.APIError):
+                stripe.Product.retrieve("prod_missing")
+
+        requests_made = self.server.requests
+        res = self.checkout()
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(self.server.requests, requests_made)
+        self.assertFalse(StockReservation.objects.exists())
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot["upstream_rejected"], {"stripe": 1})
+        self.assertEqual(snapshot["breakers_open"], {"stripe": 1})
+        self.assertIn('upstream_calls_rejected_total{service="stripe"} 1',
+                      render_prometheus(snapshot))
+
+    def test_slow_stripe_times_out(self):
+        self.server.latency = 2
+        self.http_client._timeout = (1, 0.2)
+
+        with self.assertRaises(stripe.APIConnectionError):
+            stripe.Product.retrieve("prod_missing")
+
+        latency = registry.snapshot()["upstream_latency"]
+        self.assertEqual(sum(latency["stripe|error"][:-1]), 1)
+        self.assertNotIn("stripe|ok", latency)
+
+
+class HotProductConcurrencyTests(TransactionTestCase):
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_hot_product_is_never_oversold(self):
+        stock = 10
+        buyers = 40
+        product = Product.objects.create(name="Hot", category="Food",
+                                         price=10, stock=stock
+                                         )
+        start = threading.Barrier(buyers)
+        results = []
+
+        def buy():
+            start.wait()
+            try:
+                create_order(
+                    [{"product": product.id, "quantity": 1, "price": 10}],
+                    total_amount=10,
+                    **SHIPPING
+                )
+                results.append(True)
+            except OrderError:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(buyers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        product.refresh_from_db()
+        self.assertEqual(results.count(True), stock)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(OrderItem.objects.filter(product=product).count(),
+                         stock
+                         )
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_concurrent_retries_create_one_order(self):
+        retries = 8
+        user = User.objects.create(username="buyer@example.com")
+        product = Product.objects.create(name="Lamp", category="Home",
+                                         price=10, stock=10
+                                         )
+        start = threading.Barrier(retries)
+        statuses = []
+
+        def retry():
+            client = APIClient()
+            client.force_authenticate(user)
+            start.wait()
+            try:
+                statuses.append(client.post("/api/orders/new/", {
+                    **SHIPPING,
+                    "orderItems": [{"product": product.id,
+                                    "quantity": 1,
+                                    "price": 10}]
+                }, format="json", HTTP_IDEMPOTENCY_KEY="retry-1").status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=retry) for _ in range(retries)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(set(statuses) - {200, 409}, set())
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_sharded_hot_product_is_never_oversold(self):
+        stock = 10
+        buyers = 40
+        product = Product.objects.create(name="Hot", category="Food",
+                                         price=10, stock=stock
+                                         )
+        set_inventory_mode(product.id, 4)
+        start = threading.Barrier(buyers)
+        results = []
+
+        def buy():
+            start.wait()
+            try:
+                create_order(
+                    [{"product": product.id, "quantity": 1, "price": 10}],
+                    total_amount=10,
+                    **SHIPPING
+                )
+                results.append(True)
+            except OrderError:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(buyers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        product.refresh_from_db()
+        self.assertEqual(results.count(True), stock)
+        self.assertEqual(available_stock(product), 0)
@@ -4,6 +4,13 @@ from . import views
 urlpatterns = [
     path("orders/new/", views.new_order, name="new_order"),
     path("orders/", views.get_orders, name="get_orders"),
+    path("orders/events/", views.order_events, name="order_events"),
+    path("orders/events/ticket/", views.order_events_ticket,
+         name="order_events_ticket"
+         ),
+    path("orders/bulk/process/", views.bulk_process_orders,
+         name="bulk_process_orders"
+         ),
     path("orders/<str:pk>/", views.get_order, name="get_order"),
     path("orders/<str:pk>/process/",
          views.process_order, name="process_order"),
@@ -15,4 +22,8 @@ urlpatterns = [
          name="create_checkout_session"
          ),
     path("order/webhook/", views.stripe_webhook, name="stripe_webhook"),
+    path("me/orders/summary/", views.get_order_summary,
+         name="order_summary"
+         ),
+    path("reports/sales/", views.get_sales_report, name="sales_report"),
 ]
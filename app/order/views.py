@@ -1,23 +1,53 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import AuthenticationFailed
+from account.authentication import StatelessJWTAuthentication
+from rest_framework.decorators import (api_view, permission_classes,
+                                       throttle_classes)
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import status
-from .models import Order, OrderItem
-from product.models import Product
-from .serializers import OrderSerializer
+from .models import (DailyCategorySales, DailyProductSales, Order,
+                     UserOrderSummary)
+from .serializers import OrderSerializer, UserOrderSummarySerializer
+from .events import (ORDER_CHANNEL, issue_stream_ticket, publish_order_changes,
+                     redeem_stream_ticket)
 from .filters import OrdersFilter
-from rest_framework.pagination import PageNumberPagination
+from .idempotency import idempotent, IDEMPOTENCY_HEADER
+from .services import (cancel_order, create_order, reserve_stock,
+                       update_order_statuses, OrderError)
+from .webhooks import queue_event
+from product.inventory import release_reservations
+from .pagination import OrderCursorPagination, OrderPagePagination
 import stripe
+import asyncio
+import csv
+import io
 import os
-from utils.helpers import get_current_host
-from django.contrib.auth.models import User
+import json
+import uuid
+from datetime import date, timedelta
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth
+from django.conf import settings
+from django.utils import timezone
+from urllib.parse import urlencode
+from utils.helpers import count_rows, get_current_host
+from utils.pubsub import get_broker
+from utils.throttling import token_bucket
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
 
 # Create your views here.
 
+idempotency_key_parameter = openapi.Parameter(
+    IDEMPOTENCY_HEADER, openapi.IN_HEADER, type=openapi.TYPE_STRING,
+    description="Repeating a key replays the first response"
+)
+
 
 @swagger_auto_schema(
     method='POST',
@@ -44,10 +74,12 @@ from drf_yasg.utils import swagger_auto_schema
         },
         required=['street', 'city', 'state', 'zip_code', 'phone_no',
                   'country', 'orderItems']
-    )
+    ),
+    manual_parameters=[idempotency_key_parameter]
 )
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@idempotent
 def new_order(request):
     """Create New Order"""
     user = request.user
@@ -55,19 +87,19 @@ def new_order(request):
 
     order_items = data["orderItems"]
 
-    if order_items and len(order_items) == 0:
+    if not order_items:
         return Response({
             "error": "No order Items. Please add at least one product"
             },
                         status=status.HTTP_400_BAD_REQUEST)
 
-    else:
-        # Create order
-        total_amount = sum(
-           item["price"] * item["quantity"] for item in order_items
-        )
+    total_amount = sum(
+       item["price"] * item["quantity"] for item in order_items
+    )
 
-        order = Order.objects.create(
+    try:
+        order = create_order(
+            order_items,
             user=user,
             street=data["street"],
             city=data["city"],
@@ -76,28 +108,16 @@ def new_order(request):
             phone_no=data["phone_no"],
             country=data["country"],
             total_amount=total_amount,
-
         )
 
-        # Create order items and set order to order items
-        for i in order_items:
-            product = Product.objects.get(id=i["product"])
-
-            item = OrderItem.objects.create(
-                product=product,
-                order=order,
-                name=product.name,
-                quantity=i["quantity"],
-                price=i["price"]
-            )
-
-        # Update product stock
-        product.stock -= item.quantity
-        product.save()
+    except OrderError as e:
+        return Response({"error": str(e)},
+                        status=status.HTTP_400_BAD_REQUEST
+                        )
 
-        serializer = OrderSerializer(order, many=False)
+    serializer = OrderSerializer(order, many=False)
 
-        return Response(serializer.data)
+    return Response(serializer.data)
 
 
 @swagger_auto_schema(method='GET')
@@ -106,25 +126,51 @@ def new_order(request):
 def get_orders(request):
     """Get All Orders
        Example of filter use:
-       /api/orders/?user=2&page=4"""
-    filterset = OrdersFilter(request.GET,
-                             queryset=Order.objects.all().order_by("id")
-                             )
-
-    count = filterset.queryset.count()
+       /api/orders/?user=2&page=4
+       Cursor pagination: /api/orders/?paginate=cursor, then follow next"""
+    queryset = Order.objects.prefetch_related("orderitems")
+
+    # Customers only ever see their own orders
+    if not request.user.is_staff:
+        queryset = queryset.filter(user_id=request.user.id)
+
+    filterset = OrdersFilter(request.GET, queryset=queryset)
+
+    params = sorted((key, value) for key, value in request.GET.items()
+                    if key not in ("page", "cursor", "paginate"))
+    count, estimated = count_rows(
+        filterset.qs,
+        "orders:count:{user}:{params}".format(
+            user="all" if request.user.is_staff else request.user.id,
+            params=urlencode(params)
+        ),
+        settings.ORDER_COUNT_CACHE_SECONDS,
+        settings.ORDER_COUNT_ESTIMATE_ABOVE
+    )
 
     # Pagination
-    resPerPage = 10
-    paginator = PageNumberPagination()
-    paginator.page_size = resPerPage
+    if "cursor" in request.GET or request.GET.get("paginate") == "cursor":
+        paginator = OrderCursorPagination()
+        queryset = filterset.qs
+    else:
+        paginator = OrderPagePagination(count, estimated)
+        queryset = filterset.qs.order_by("id")
+
+    queryset = paginator.paginate_queryset(queryset, request)
 
-    queryset = paginator.paginate_queryset(filterset.qs, request)
+    # A page past an estimated count has the rows counted exactly
+    if isinstance(paginator, OrderPagePagination):
+        count = paginator.page.paginator.count
+        estimated = paginator.page.paginator.estimated
 
     serializer = OrderSerializer(queryset, many=True)
 
     return Response({
         "count": count,
-        "resPerPage": resPerPage,
+        "countIsEstimate": estimated,
+        "resPerPage": paginator.page_size,
+        "next": paginator.get_next_link(),
+        "previous": paginator.get_previous_link(),
         "orders": serializer.data
         })
 
@@ -141,6 +187,85 @@ def get_order(request, pk):
     return Response({"order": serializer.data})
 
 
+async def order_events(request):
+    """Server-Sent Events stream of changes to the user's orders.
+
+    Only served by the ASGI app, where an idle stream is a parked
+    coroutine; under WSGI it would hold a worker for as long as it is
+    open. EventSource can not send headers, so browsers authenticate
+    with ?ticket= from orders/events/ticket/ instead of Authorization.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Order events are served by the "
+                                      "events service"},
+                            status=status.HTTP_404_NOT_FOUND
+                            )
+
+    user = await authenticate_stream(request)
+    if user is None:
+        return JsonResponse({"error": "Authentication required"},
+                            status=status.HTTP_401_UNAUTHORIZED
+                            )
+
+    subscription = get_broker().subscribe(
+        ORDER_CHANNEL.format(user_id=user.id)
+    )
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(
+                        subscription.get(),
+                        settings.ORDER_EVENTS_HEARTBEAT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield "event: order\ndata: {data}\n\n".format(
+                    data=json.dumps(message)
+                )
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(),
+                                     content_type="text/event-stream"
+                                     )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def authenticate_stream(request):
+    ticket = request.GET.get("ticket")
+    if ticket:
+        return await sync_to_async(redeem_stream_ticket)(ticket)
+
+    try:
+        result = await sync_to_async(
+            StatelessJWTAuthentication().authenticate
+        )(request)
+    except AuthenticationFailed:
+        return None
+
+    return result[0] if result else None
+
+
+@swagger_auto_schema(method="POST")
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def order_events_ticket(request):
+    """Single use ticket to open orders/events/ with ?ticket=
+       Tickets expire after ORDER_EVENTS_TICKET_SECONDS, so unlike the
+       access token they are no use to anyone reading access logs"""
+    ticket = issue_stream_ticket(request.user)
+
+    return Response({"ticket": ticket,
+                     "expires_in": settings.ORDER_EVENTS_TICKET_SECONDS})
+
+
 @swagger_auto_schema(
     method="PUT",
     request_body=openapi.Schema(
@@ -161,23 +286,151 @@ def process_order(request, pk):
 
     order.save()
 
+    publish_order_changes([order])
+
     serializer = OrderSerializer(order, many=False)
 
     return Response({"order": serializer.data})
 
 
+@swagger_auto_schema(
+    method="POST",
+    request_body=openapi.Schema(
+        type='object',
+        properties={
+            "status": openapi.Schema(type='string'),
+            "orders": openapi.Schema(
+                type='array', items=openapi.Schema(type='integer')
+            ),
+        },
+        required=["status", "orders"]
+    )
+)
+@api_view(["POST"])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def bulk_process_orders(request):
+    """Move many orders to a new status at once
+       JSON: {"status": "SHIPPED", "orders": [1, 2, 3]}
+       or multipart with a CSV "file" of order_id[,status] rows, status
+       defaulting to the "status" field"""
+    try:
+        changes = parse_status_changes(request)
+
+    except (KeyError, ValueError, UnicodeDecodeError) as e:
+        return Response({"error": "Can not read the orders: {e}".format(e=e)},
+                        status=status.HTTP_400_BAD_REQUEST
+                        )
+
+    if len(changes) > settings.BULK_ORDER_MAX_ROWS:
+        return Response({"error": "At most {max} orders per request".format(
+            max=settings.BULK_ORDER_MAX_ROWS)},
+                        status=status.HTTP_400_BAD_REQUEST
+                        )
+
+    return Response(update_order_statuses(changes))
+
+
+def parse_status_changes(request):
+    """``{order_id: status}`` from a JSON list or an uploaded CSV file"""
+    default_status = request.data.get("status", "")
+
+    if "file" not in request.FILES:
+        return {int(order_id): default_status
+                for order_id in request.data["orders"]}
+
+    rows = csv.DictReader(io.TextIOWrapper(request.FILES["file"],
+                                           encoding="utf-8-sig"))
+    return {int(row["order_id"]): row.get("status") or default_status
+            for row in rows}
+
+
 @api_view(["DELETE"])
 @permission_classes([IsAuthenticated])
 def delete_order(request, pk):
     """Delete Order by ID"""
     order = get_object_or_404(Order, id=pk)
 
-    order.delete()
+    cancel_order(order)
 
     return Response({"details": "Order cancelled."})
 
 
-stripe.api_key = os.environ.get("STRIPE_PRIVATE_KEY")
+@swagger_auto_schema(method='GET')
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def get_order_summary(request):
+    """Order count, total spend and last order date of the current user"""
+    summary = (UserOrderSummary.objects.filter(user=request.user).first() or
+               UserOrderSummary(user=request.user))
+
+    serializer = UserOrderSummarySerializer(summary, many=False)
+
+    return Response({"summary": serializer.data})
+
+
+@swagger_auto_schema(
+    method='GET',
+    manual_parameters=[
+        openapi.Parameter("start", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          format=openapi.FORMAT_DATE),
+        openapi.Parameter("end", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          format=openapi.FORMAT_DATE),
+        openapi.Parameter("by", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          enum=["category", "product"]),
+        openapi.Parameter("period", openapi.IN_QUERY,
+                          type=openapi.TYPE_STRING, enum=["day", "month"]),
+    ]
+)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def get_sales_report(request):
+    """Revenue of paid orders by category or product per day or month
+       Example: /api/reports/sales/?start=2024-01-01&by=product&period=month
+       Reads the daily rollups, not the orders"""
+    try:
+        end = date.fromisoformat(request.GET.get("end") or
+                                 timezone.localdate().isoformat())
+        start = date.fromisoformat(request.GET.get("start") or
+                                   (end - timedelta(days=29)).isoformat())
+    except ValueError:
+        return Response({"error": "Dates have to look like 2024-01-31"},
+                        status=status.HTTP_400_BAD_REQUEST
+                        )
+
+    by = request.GET.get("by", "category")
+    period = request.GET.get("period", "day")
+    if by not in ("category", "product") or period not in ("day", "month"):
+        return Response({"error": "by is category or product, "
+                                  "period is day or month"},
+                        status=status.HTTP_400_BAD_REQUEST
+                        )
+
+    if by == "category":
+        model = DailyCategorySales
+        group = ["category"]
+        totals = {"revenue": Sum("revenue"),
+                  "orders": Sum("orders"),
+                  "units": Sum("units")}
+    else:
+        model = DailyProductSales
+        group = ["product", "product__name"]
+        totals = {"revenue": Sum("revenue"), "units": Sum("units")}
+
+    rows = (model.objects
+            .filter(day__gte=start, day__lte=end)
+            .annotate(period=TruncMonth("day") if period == "month"
+                      else F("day"))
+            .values("period", *group)
+            .annotate(**totals)
+            .order_by("period", "-revenue"))
+
+    return Response({
+        "start": start,
+        "end": end,
+        "by": by,
+        "period": period,
+        "rows": list(rows)
+        })
 
 
 @swagger_auto_schema(
@@ -197,20 +450,21 @@ stripe.api_key = os.environ.get("STRIPE_PRIVATE_KEY")
                     type='object',
                     properties={
                         'product': openapi.Schema(type='integer'),
-                        'name': openapi.Schema(type='string'),
                         'image': openapi.Schema(type='string'),
                         'quantity': openapi.Schema(type='integer'),
-                        'price': openapi.Schema(type='integer'),
                     }
                 )
             )
         },
         required=['street', 'city', 'state', 'zip_code', 'phone_no',
                   'country', 'orderItems']
-    )
+    ),
+    manual_parameters=[idempotency_key_parameter]
 )
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@throttle_classes([token_bucket("checkout")])
+@idempotent
 def create_checkout_session(request):
     """Create a Stripe Checkout Session"""
     YOUR_DOMAIN = get_current_host(request)
@@ -230,37 +484,83 @@ def create_checkout_session(request):
         "user": user.id
     }
 
+    reservation = uuid.uuid4().hex
+    expires_at = timezone.now() + timedelta(
+        minutes=settings.STOCK_RESERVATION_MINUTES
+    )
+
+    try:
+        products = reserve_stock(order_items, reservation, expires_at)
+
+    except OrderError as e:
+        return Response({"error": str(e)},
+                        status=status.HTTP_400_BAD_REQUEST
+                        )
+
+    shipping_details["reservation"] = reservation
+
+    # Lets the webhook map line items without asking Stripe; metadata
+    # values are capped at 500 characters.
+    product_ids = ",".join(str(item["product"]) for item in order_items)
+    if len(product_ids) <= 500:
+        shipping_details["products"] = product_ids
+
+    # Prices come from our catalog, never from the client. Products
+    # mirrored by sync_stripe_catalog are sent by their Stripe price id.
     checkout_order_items = []
     for item in order_items:
+        product = products[int(item["product"])]
+
+        if (product.stripe_price_id and
+                product.stripe_price_amount == product.price):
+            checkout_order_items.append({
+                "price": product.stripe_price_id,
+                "quantity": item["quantity"]
+            })
+            continue
+
         checkout_order_items.append({
             "price_data": {
                 "currency": "USD",
                 "product_data": {
-                    "name": item["name"],
-                    "images": [item["image"]],
-                    "metadata": {"product_id": item["product"]}
+                    "name": product.name,
+                    "images": [item["image"]] if item.get("image") else [],
+                    "metadata": {"product_id": product.id}
                 },
-                "unit_amount": item["price"] * 100
+                "unit_amount": int(product.price * 100)
             },
             "quantity": item["quantity"]
         })
 
-    session = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        metadata=shipping_details,
-        line_items=checkout_order_items,
-        customer_email=user.email,
-        mode="payment",
-        success_url=YOUR_DOMAIN,
-        cancel_url=YOUR_DOMAIN
-    )
+    try:
+        session = stripe.checkout.Session.create(
+            payment_method_types=["card"],
+            metadata=shipping_details,
+            line_items=checkout_order_items,
+            customer_email=user.email,
+            mode="payment",
+            success_url=YOUR_DOMAIN,
+            cancel_url=YOUR_DOMAIN,
+            expires_at=int(expires_at.timestamp())
+        )
+
+    except stripe.APIConnectionError:
+        # Timed out, or Stripe is down and the circuit breaker is open
+        release_reservations(reservation)
+        return Response({"error": "Payments are unavailable, try again later"},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE
+                        )
+
+    except Exception:
+        release_reservations(reservation)
+        raise
 
     return Response({"session": session})
 
 
 @api_view(["POST"])
 def stripe_webhook(request):
-    """Stripe WebHook for Completing Checkout"""
+    """Stripe WebHook, queues verified events for process_stripe_events"""
     webhook_secret = os.environ.get("STRIPE_WEBHOOK_SECRET")
     payload = request.body
     sig_header = request.META["HTTP_STRIPE_SIGNATURE"]
@@ -281,44 +581,6 @@ def stripe_webhook(request):
                         status=status.HTTP_400_BAD_REQUEST
                         )
 
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-
-        line_items = stripe.checkout.Session.list_line_items(session["id"])
-
-        price = session["amount_total"] / 100
-
-        order = Order.objects.create(
-            user=get_object_or_404(User, id=session.metadata.user),
-            street=session.metadata.street,
-            city=session.metadata.city,
-            state=session.metadata.state,
-            zip_code=session.metadata.zip_code,
-            phone_no=session.metadata.phone_no,
-            country=session.metadata.country,
-            total_amount=price,
-            payment_status="PAID"
-        )
-
-        for item in line_items["data"]:
-
-            print("item", item)
-
-            line_product = stripe.Product.retrieve(item.price.product)
-            product_id = line_product.metadata.product_id
-
-            product = Product.objects.get(id=product_id)
-
-            item = OrderItem.objects.create(
-                product=product,
-                order=order,
-                name=product.name,
-                quantity=item.quantity,
-                price=item.price.unit_amount / 100,
-                image=line_product.images[0]
-            )
-
-            product.stock -= item.quantity
-            product.save()
+    queue_event(event, json.loads(payload))
 
-        return Response({"details": "Payment succesful"})
+    return Response({"details": "Event received"})
@@ -0,0 +1,194 @@
+import logging
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from product.inventory import release_reservations
+from .events import publish_order_changes
+from .models import StripeEvent, StripeEventStatus
+from .services import create_order, OrderError
+
+logger = logging.getLogger(__name__)
+
+STRIPE_PRODUCT_CACHE_KEY = "stripe:product:{id}"
+
+# How long a worker has to fetch what an event needs from Stripe before
+# another worker may pick the event up
+CLAIM_TIME = timedelta(minutes=5)
+
+
+def queue_event(event, payload):
+    """Store a verified event once, however often Stripe delivers it"""
+    StripeEvent.objects.bulk_create(
+        [StripeEvent(event_id=event["id"],
+                     type=event["type"],
+                     payload=payload
+                     )],
+        ignore_conflicts=True
+    )
+
+
+def process_next_event():
+    """Handle the oldest due event; returns False when none is waiting.
+
+    The event is claimed for CLAIM_TIME in a short transaction, then the
+    Stripe calls it needs are made with no transaction open. The event
+    row is locked again only to write the order and mark the event done,
+    in one transaction, so every event is applied exactly once even with
+    several workers, a claim running out or a crash half way.
+    """
+    with transaction.atomic():
+        event = (StripeEvent.objects
+                 .select_for_update(skip_locked=True)
+                 .filter(status=StripeEventStatus.PENDING,
+                         available_at__lte=timezone.now())
+                 .order_by("available_at")
+                 .first())
+
+        if event is None:
+            return False
+
+        event.attempts += 1
+        # Other workers skip the event until the claim runs out
+        event.available_at = timezone.now() + CLAIM_TIME
+        event.save(update_fields=["attempts", "available_at"])
+
+    pending = StripeEvent.objects.filter(pk=event.pk,
+                                         status=StripeEventStatus.PENDING)
+    stripe_event = stripe.Event.construct_from(event.payload, stripe.api_key)
+
+    try:
+        prepared = prepare_event(stripe_event)
+
+        with transaction.atomic():
+            if not pending.select_for_update().exists():
+                # Another worker finished it after the claim ran out
+                return True
+
+            handle_event(stripe_event, prepared)
+
+            pending.update(status=StripeEventStatus.PROCESSED,
+                           processed_at=timezone.now(),
+                           last_error="")
+
+    except OrderError as e:
+        # Retrying does not bring stock back, hand it to a human.
+        logger.error("Stripe event %s failed: %s", event.event_id, e)
+        pending.update(status=StripeEventStatus.FAILED, last_error=str(e))
+
+    except Exception as e:
+        logger.exception("Stripe event %s failed", event.event_id)
+
+        if event.attempts >= settings.STRIPE_EVENT_MAX_ATTEMPTS:
+            pending.update(status=StripeEventStatus.FAILED,
+                           last_error=repr(e))
+        else:
+            pending.update(available_at=timezone.now() + timedelta(
+                               seconds=2 ** event.attempts
+                           ),
+                           last_error=repr(e))
+
+    return True
+
+
+def prepare_event(event):
+    """Make the Stripe calls ``event`` needs, before any row is locked"""
+    if event.type == "checkout.session.completed":
+        return checkout_order_lines(event.data.object)
+
+
+def handle_event(event, prepared=None):
+    if event.type == "checkout.session.completed":
+        fulfill_checkout_session(event.data.object, prepared)
+
+    elif event.type == "checkout.session.expired":
+        release_reservations(event.data.object.metadata.get("reservation"))
+
+
+def checkout_order_lines(session):
+    """create_order lines of a Checkout Session.
+
+    The line items come back with their Stripe products expanded, so this
+    costs one Stripe call for up to 100 items instead of one per item.
+    """
+    line_items = stripe.checkout.Session.list_line_items(
+        session.id, limit=100, expand=["data.price.product"]
+    )
+
+    # Product ids in cart order, written by create_checkout_session
+    product_ids = [i for i in session.metadata.get("products", "").split(",")
+                   if i]
+
+    order_items = []
+    for index, item in enumerate(line_items.auto_paging_iter()):
+        product_id, image = resolve_stripe_product(item.price.product)
+
+        if not product_id and index < len(product_ids):
+            product_id = product_ids[index]
+
+        order_items.append({
+            "product": product_id,
+            "name": item.get("description") or "",
+            "quantity": item.quantity,
+            "price": item.price.unit_amount / 100,
+            "image": image
+        })
+
+    return order_items
+
+
+def fulfill_checkout_session(session, order_items=None):
+    """Turn a paid Checkout Session into an Order.
+
+    ``order_items`` are the checkout_order_lines of the session, fetched
+    here when not given.
+    """
+    if order_items is None:
+        order_items = checkout_order_lines(session)
+
+    order = create_order(
+        order_items,
+        user_id=session.metadata.user,
+        street=session.metadata.street,
+        city=session.metadata.city,
+        state=session.metadata.state,
+        zip_code=session.metadata.zip_code,
+        phone_no=session.metadata.phone_no,
+        country=session.metadata.country,
+        total_amount=session.amount_total / 100,
+        payment_status="PAID",
+        reservation=session.metadata.get("reservation"),
+        paid=True
+    )
+
+    publish_order_changes([order])
+
+    return order
+
+
+def resolve_stripe_product(product):
+    """Local product id and image of a Stripe product.
+
+    ``product`` is either the expanded object or its id; ids are looked up
+    in a local cache before asking Stripe.
+    """
+    if isinstance(product, str):
+        mapping = cache.get(STRIPE_PRODUCT_CACHE_KEY.format(id=product))
+        if mapping is not None:
+            return mapping
+
+        product = stripe.Product.retrieve(product)
+
+    mapping = (product.metadata.get("product_id"),
+               product.images[0] if product.images else "")
+
+    cache.set(STRIPE_PRODUCT_CACHE_KEY.format(id=product.id),
+              mapping,
+              settings.STRIPE_PRODUCT_CACHE_SECONDS
+              )
+
+    return mapping
@@ -0,0 +1,159 @@
+from django.db import transaction
+from django.db.models import (Case, ExpressionWrapper, F, IntegerField,
+                              OuterRef, Subquery, Sum, When)
+from django.db.models.functions import Coalesce, Now
+
+from .models import InventoryMode, Product, StockReservation, StockShard
+
+
+def with_available_stock(queryset):
+    """Annotate ``available_stock`` on a Product queryset in the same query.
+
+    Units held by unexpired reservations are not available; both sums are
+    served by an index on their product.
+    """
+    shard_total = (StockShard.objects
+                   .filter(product=OuterRef("pk"))
+                   .values("product")
+                   .annotate(total=Sum("stock"))
+                   .values("total"))
+
+    reserved = (StockReservation.objects
+                .filter(product=OuterRef("pk"), expires_at__gt=Now())
+                .values("product")
+                .annotate(total=Sum("quantity"))
+                .values("total"))
+
+    return queryset.annotate(available_stock=ExpressionWrapper(
+        Case(
+            When(inventory_mode=InventoryMode.SHARDED,
+                 then=Coalesce(Subquery(shard_total), 0)),
+            default=F("stock")
+        ) - Coalesce(Subquery(reserved), 0),
+        output_field=IntegerField()
+    ))
+
+
+def available_stock(product):
+    """Units left for a product that no checkout is holding"""
+    if hasattr(product, "available_stock"):
+        return product.available_stock
+
+    return (with_available_stock(Product.objects.filter(pk=product.pk))
+            .values_list("available_stock", flat=True)
+            .first())
+
+
+def release_reservations(reference):
+    """Give back the units held for a checkout"""
+    StockReservation.objects.filter(reference=reference).delete()
+
+
+def reserved_stock(product):
+    """Units of a product held by unexpired reservations"""
+    return (StockReservation.objects
+            .filter(product=product, expires_at__gt=Now())
+            .aggregate(total=Coalesce(Sum("quantity"), 0))["total"])
+
+
+def take_sharded_stock(product, quantity, force=False):
+    """Take ``quantity`` units from one shard of a SHARDED product.
+
+    A random shard that holds enough and is not locked by another order is
+    picked, so concurrent buyers spread over the shards and never wait for
+    each other. Only when no such shard is left, or while checkouts hold
+    reservations for the product, are all shards locked and the units
+    left after the reservations taken from them together. Returns False
+    when those are short; with ``force`` the units are taken anyway,
+    leaving a shard below zero.
+    """
+    with transaction.atomic():
+        savepoint = transaction.savepoint()
+        shard = (StockShard.objects
+                 .select_for_update(skip_locked=True)
+                 .filter(product=product, stock__gte=quantity)
+                 .order_by("?")
+                 .first())
+
+        # reserve_stock locks every shard, so a reservation made since
+        # the shard was picked is seen here
+        if shard is not None and not reserved_stock(product):
+            StockShard.objects.filter(pk=shard.pk).update(
+                stock=F("stock") - quantity
+            )
+            return True
+
+        # Let go of the shard, all of them are locked in order below
+        transaction.savepoint_rollback(savepoint)
+
+        shards = list(StockShard.objects
+                      .select_for_update()
+                      .filter(product=product)
+                      .order_by("shard"))
+
+        enough = (sum(s.stock for s in shards) - reserved_stock(product) >=
+                  quantity)
+        if not enough and not force:
+            return False
+
+        remaining = quantity
+        for s in shards:
+            taken = min(max(s.stock, 0), remaining)
+            s.stock -= taken
+            remaining -= taken
+        shards[-1].stock -= remaining
+
+        StockShard.objects.bulk_update(shards, ["stock"])
+
+    return enough
+
+
+def set_sharded_stock(product, stock):
+    """Replace the stock of a SHARDED product, spread evenly over its shards"""
+    with transaction.atomic():
+        StockShard.objects.filter(product=product).delete()
+        StockShard.objects.bulk_create(_split(product, stock))
+
+
+def set_inventory_mode(product_id, shards):
+    """Switch a product to ``shards`` stock counters, or back to one with 0.
+
+    The units left are carried over, so this can run while the product is
+    on sale.
+    """
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(id=product_id)
+
+        stock = product.stock
+        if product.inventory_mode == InventoryMode.SHARDED:
+            stock = sum(StockShard.objects
+                        .select_for_update()
+                        .filter(product=product)
+                        .values_list("stock", flat=True))
+            StockShard.objects.filter(product=product).delete()
+
+        if shards:
+            product.inventory_mode = InventoryMode.SHARDED
+            product.stock_shards = shards
+            product.stock = 0
+            StockShard.objects.bulk_create(_split(product, stock))
+        else:
+            product.inventory_mode = InventoryMode.SINGLE
+            product.stock_shards = 0
+            product.stock = stock
+
+        product.save(update_fields=["inventory_mode", "stock_shards", "stock"])
+
+    return product
+
+
+def _split(product, stock):
+    share, rest = divmod(stock, product.stock_shards)
+
+    return [
+        StockShard(product=product,
+                   shard=shard,
+                   stock=share + (1 if shard < rest else 0)
+                   )
+        for shard in range(product.stock_shards)
+    ]
@@ -0,0 +1,136 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import groupby, islice
+from operator import itemgetter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from order.models import Order, OrderItem
+from order.rollups import BATCH_SETTLE_TIME
+from product.models import (ProductPairCount, ProductRecommendation,
+                            RecommendationCursor)
+from utils.upserts import increment_rows
+
+
+class Command(BaseCommand):
+    help = ("Build 'frequently bought together' recommendations from the "
+            "OrderItem rows of orders placed since the last run")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=10,
+                            help="Related products kept per product")
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="Order ids folded in per transaction")
+        parser.add_argument("--rebuild", action="store_true",
+                            help="Drop stored recommendations and start "
+                                 "again from the first order")
+        parser.add_argument("--settle-seconds", type=int,
+                            default=int(BATCH_SETTLE_TIME.total_seconds()),
+                            help="Leave orders younger than this to the "
+                                 "next run, so orders still being committed "
+                                 "are not skipped")
+
+    def handle(self, *args, **options):
+        top = options["top"]
+        batch_size = options["batch_size"]
+
+        cursor, _ = RecommendationCursor.objects.get_or_create(pk=1)
+
+        # Recommendations built before pair counts were kept have nothing
+        # to add new orders onto
+        if options["rebuild"] or (cursor.last_order_id and
+                                  not ProductPairCount.objects.exists()):
+            with transaction.atomic():
+                ProductPairCount.objects.all().delete()
+                ProductRecommendation.objects.all().delete()
+                cursor.last_order_id = 0
+                cursor.save()
+
+        settled = timezone.now() - timedelta(seconds=options["settle_seconds"])
+        last_order_id = (Order.objects
+                         .filter(created_at__lte=settled)
+                         .aggregate(last=Max("id"))["last"] or 0)
+
+        while cursor.last_order_id < last_order_id:
+            start = cursor.last_order_id
+            end = min(start + batch_size, last_order_id)
+
+            counts = self.count_pairs(start, end)
+
+            with transaction.atomic():
+                self.merge(counts, top)
+                cursor.last_order_id = end
+                cursor.save()
+
+            self.stdout.write("Orders {start}-{end}: {products} products "
+                              "updated".format(start=start + 1, end=end,
+                                               products=len(counts)))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Recommendations are up to date with order {id}".format(
+                id=cursor.last_order_id)
+            ))
+
+    def count_pairs(self, start, end):
+        """Sparse co-occurrence counts for orders in (start, end]"""
+        rows = (OrderItem.objects
+                .filter(order_id__gt=start,
+                        order_id__lte=end,
+                        product__isnull=False)
+                .order_by("order_id")
+                .values_list("order_id", "product_id")
+                .iterator(chunk_size=2000))
+
+        counts = defaultdict(Counter)
+
+        for _, items in groupby(rows, key=itemgetter(0)):
+            basket = {product_id for _, product_id in items}
+
+            if len(basket) < 2:
+                continue
+
+            # One C-level Counter.update per product instead of a Python
+            # loop over every pair; the self-count is dropped afterwards.
+            for product_id in basket:
+                counts[product_id].update(basket)
+
+        for product_id, related in counts.items():
+            del related[product_id]
+
+        return counts
+
+    def merge(self, counts, top):
+        """Add new counts onto the pair counts and pick the top-K rows of
+        every product they touch again, so results match --rebuild"""
+        increment_rows(ProductPairCount, ["product", "related"], [
+            {"product": product_id, "related": related_id, "count": count}
+            for product_id, related in counts.items()
+            for related_id, count in related.items()
+        ])
+
+        product_ids = list(counts)
+
+        pairs = (ProductPairCount.objects
+                 .filter(product_id__in=product_ids)
+                 .order_by("product_id", "-count", "related_id")
+                 .values_list("product_id", "related_id", "count"))
+
+        ProductRecommendation.objects.filter(
+            product_id__in=product_ids
+            ).delete()
+
+        ProductRecommendation.objects.bulk_create(
+            [
+                ProductRecommendation(product_id=product_id,
+                                      recommended_id=recommended_id,
+                                      score=score
+                                      )
+                for product_id, rows in groupby(pairs.iterator(),
+                                                key=itemgetter(0))
+                for _, recommended_id, score in islice(rows, top)
+            ],
+            batch_size=1000
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from product.inventory import available_stock, set_inventory_mode
+from product.models import Product
+
+
+class Command(BaseCommand):
+    help = ("Split a product's stock across several counter rows for "
+            "flash sales, or merge it back into Product.stock")
+
+    def add_arguments(self, parser):
+        parser.add_argument("product_id", type=int)
+        parser.add_argument("--shards", type=int, default=8,
+                            help="Counter rows to spread the stock over; "
+                                 "0 switches back to a single counter")
+
+    def handle(self, *args, **options):
+        if options["shards"] < 0:
+            raise CommandError("--shards can not be negative")
+
+        try:
+            product = set_inventory_mode(options["product_id"],
+                                         options["shards"]
+                                         )
+        except Product.DoesNotExist:
+            raise CommandError("Product {id} does not exist".format(
+                id=options["product_id"]))
+
+        self.stdout.write(self.style.SUCCESS(
+            "{name}: {mode} inventory, {stock} in stock".format(
+                name=product.name,
+                mode=product.inventory_mode,
+                stock=available_stock(product)
+            )))
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+import stripe
+
+from product.models import Product
+
+
+class Command(BaseCommand):
+    help = ("Mirror products to persistent Stripe Products and Prices so "
+            "checkout can refer to them by price id")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--currency", default="usd")
+
+    def handle(self, *args, **options):
+        stale = (Product.objects
+                 .filter(Q(stripe_price_id="") |
+                         ~Q(stripe_price_amount=F("price")))
+                 .order_by("id"))
+
+        synced = 0
+        for product in stale.iterator(chunk_size=500):
+            self.sync(product, options["currency"])
+            synced += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            "Synced {count} products to Stripe".format(count=synced)
+        ))
+
+    def sync(self, product, currency):
+        if not product.stripe_product_id:
+            product.stripe_product_id = stripe.Product.create(
+                name=product.name,
+                metadata={"product_id": product.id},
+                idempotency_key="product-{id}".format(id=product.id)
+            ).id
+
+        unit_amount = int(product.price * 100)
+
+        # Prices can not change on Stripe, a new one replaces the old. The
+        # key names the price replaced, so a retry gets the same price back
+        # but going back to an earlier amount does not replay the old one.
+        price = stripe.Price.create(
+            product=product.stripe_product_id,
+            unit_amount=unit_amount,
+            currency=currency,
+            idempotency_key="price-{id}-{replaced}-{amount}".format(
+                id=product.id,
+                replaced=product.stripe_price_id or "none",
+                amount=unit_amount
+            )
+        )
+
+        stripe.Product.modify(product.stripe_product_id,
+                              default_price=price.id
+                              )
+
+        if product.stripe_price_id:
+            stripe.Price.modify(product.stripe_price_id, active=False)
+
+        # Only touch the Stripe columns, the product may be on sale
+        Product.objects.filter(pk=product.pk).update(
+            stripe_product_id=product.stripe_product_id,
+            stripe_price_id=price.id,
+            stripe_price_amount=product.price
+        )
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.6 on 2026-10-19 01:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("product", "0005_productrecommendation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="inventory_mode",
+            field=models.CharField(
+                choices=[("SINGLE", "Single"), ("SHARDED", "Sharded")],
+                default="SINGLE",
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="stock_shards",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="StockShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("shard", models.PositiveSmallIntegerField()),
+                ("stock", models.IntegerField(default=0)),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="shards",
+                        to="product.product",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="stockshard",
+            constraint=models.UniqueConstraint(
+                fields=("product", "shard"), name="unique_stock_shard"
+            ),
+        ),
+    ]
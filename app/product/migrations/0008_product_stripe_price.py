@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-19 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("product", "0007_stockreservation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="stripe_price_amount",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=7, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="stripe_price_id",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="stripe_product_id",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+    ]
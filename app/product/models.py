@@ -15,6 +15,11 @@ class Category(models.TextChoices):
     KITCHEN = "Kitchen"
 
 
+class InventoryMode(models.TextChoices):
+    SINGLE = "SINGLE"
+    SHARDED = "SHARDED"
+
+
 class Product(models.Model):
     name = models.CharField(max_length=200, default="", blank=False)
     description = models.TextField(max_length=1000, default="", blank=False)
@@ -23,6 +28,23 @@ class Product(models.Model):
     category = models.CharField(max_length=30, choices=Category.choices)
     ratings = models.DecimalField(max_digits=3, decimal_places=2, default=0)
     stock = models.IntegerField(default=0)
+    inventory_mode = models.CharField(
+        max_length=20,
+        choices=InventoryMode.choices,
+        default=InventoryMode.SINGLE
+    )
+    stock_shards = models.PositiveSmallIntegerField(default=0)
+    stripe_product_id = models.CharField(max_length=100, default="",
+                                         blank=True
+                                         )
+    stripe_price_id = models.CharField(max_length=100, default="",
+                                       blank=True
+                                       )
+    stripe_price_amount = models.DecimalField(max_digits=7,
+                                              decimal_places=2,
+                                              null=True,
+                                              blank=True
+                                              )
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     crteatedAT = models.DateTimeField(auto_now_add=True)
 
@@ -30,6 +52,45 @@ class Product(models.Model):
         return self.name
 
 
+class StockShard(models.Model):
+    """One slice of a SHARDED product's stock, decremented independently"""
+    product = models.ForeignKey(Product,
+                                on_delete=models.CASCADE,
+                                related_name="shards"
+                                )
+    shard = models.PositiveSmallIntegerField()
+    stock = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "shard"],
+                                    name="unique_stock_shard"
+                                    ),
+        ]
+
+
+class StockReservation(models.Model):
+    """Units held for a checkout until it is paid for or expires"""
+    product = models.ForeignKey(Product,
+                                on_delete=models.CASCADE,
+                                related_name="reservations"
+                                )
+    reference = models.CharField(max_length=64, db_index=True)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["product", "expires_at"],
+                         include=["quantity"],
+                         name="reservation_available"
+                         ),
+        ]
+
+    def __str__(self):
+        return str(self.reference)
+
+
 class ProductImages(models.Model):
     product = models.ForeignKey(Product,
                                 on_delete=models.CASCADE, null=True,
@@ -56,3 +117,59 @@ class Review(models.Model):
 
     def __str__(self):
         return str(self.comment)
+
+
+class ProductRecommendation(models.Model):
+    product = models.ForeignKey(Product,
+                                on_delete=models.CASCADE,
+                                related_name="recommendations"
+                                )
+    recommended = models.ForeignKey(Product,
+                                    on_delete=models.CASCADE,
+                                    related_name="+"
+                                    )
+    score = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "recommended"],
+                                    name="unique_product_recommendation"
+                                    ),
+        ]
+        indexes = [
+            models.Index(fields=["product", "-score"],
+                         name="product_recommendation_top"
+                         ),
+        ]
+
+    def __str__(self):
+        return "{product} -> {recommended}".format(
+            product=self.product_id, recommended=self.recommended_id
+        )
+
+
+class ProductPairCount(models.Model):
+    """Orders that had both products, the exact counts the top-K
+    ProductRecommendation rows are picked from"""
+    product = models.ForeignKey(Product,
+                                on_delete=models.CASCADE,
+                                related_name="+"
+                                )
+    related = models.ForeignKey(Product,
+                                on_delete=models.CASCADE,
+                                related_name="+"
+                                )
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "related"],
+                                    name="unique_product_pair_count"
+                                    ),
+        ]
+
+
+class RecommendationCursor(models.Model):
+    """Last order folded into ProductRecommendation by the batch job"""
+    last_order_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
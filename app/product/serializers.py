@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Product, ProductImages, Review
+from .inventory import available_stock
+from .models import Product, ProductImages, ProductRecommendation, Review
 
 
 class ProductImagesSerializer(serializers.ModelSerializer):
@@ -12,6 +13,9 @@ class ProductImagesSerializer(serializers.ModelSerializer):
 class ProductSerializer(serializers.ModelSerializer):
 
     images = ProductImagesSerializer(many=True, read_only=True)
+    stock = serializers.SerializerMethodField(method_name="get_stock",
+                                              read_only=True
+                                              )
     reviews = serializers.SerializerMethodField(method_name="get_reviews",
                                                 read_only=True
                                                 )
@@ -28,6 +32,9 @@ class ProductSerializer(serializers.ModelSerializer):
             "category": {"required": True, "allow_blank": False},
         }
 
+    def get_stock(self, obj):
+        return available_stock(obj)
+
     def get_reviews(self, obj):
         reviews = obj.reviews.all()
         serializer = ReviewSerializer(reviews, many=True)
@@ -40,3 +47,18 @@ class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = "__all__"
+
+
+class ProductRecommendationSerializer(serializers.ModelSerializer):
+
+    id = serializers.IntegerField(source="recommended_id", read_only=True)
+    name = serializers.CharField(source="recommended.name", read_only=True)
+    price = serializers.DecimalField(source="recommended.price",
+                                     max_digits=7,
+                                     decimal_places=2,
+                                     read_only=True
+                                     )
+
+    class Meta:
+        model = ProductRecommendation
+        fields = ("id", "name", "price", "score")
@@ -1,3 +1,150 @@
+import io
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from order.models import Order, OrderItem
+from .inventory import available_stock, set_inventory_mode, take_sharded_stock
+from .models import (InventoryMode, Product, ProductRecommendation,
+                     RecommendationCursor, StockShard)
 
 # Create your tests here.
+
+
+class ShardedStockTests(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(name="Hot", category="Food",
+                                              stock=10
+                                              )
+
+    def test_switching_modes_keeps_stock(self):
+        product = set_inventory_mode(self.product.id, 4)
+
+        self.assertEqual(product.inventory_mode, InventoryMode.SHARDED)
+        self.assertEqual(
+            sorted(StockShard.objects.values_list("stock", flat=True)),
+            [2, 2, 3, 3]
+        )
+        self.assertEqual(available_stock(product), 10)
+
+        product = set_inventory_mode(self.product.id, 0)
+
+        self.assertEqual(product.inventory_mode, InventoryMode.SINGLE)
+        self.assertEqual(product.stock, 10)
+        self.assertFalse(StockShard.objects.exists())
+
+    def test_takes_fall_back_to_other_shards(self):
+        product = set_inventory_mode(self.product.id, 4)
+
+        for _ in range(10):
+            self.assertTrue(take_sharded_stock(product, 1))
+
+        self.assertFalse(take_sharded_stock(product, 1))
+        self.assertEqual(available_stock(product), 0)
+
+    def test_large_take_spans_shards(self):
+        product = set_inventory_mode(self.product.id, 4)
+
+        self.assertTrue(take_sharded_stock(product, 7))
+        self.assertFalse(take_sharded_stock(product, 4))
+        self.assertEqual(available_stock(product), 3)
+
+
+class RecommendationTests(TestCase):
+
+    def setUp(self):
+        self.products = [Product.objects.create(name=str(n), category="Food",
+                                                price=n)
+                         for n in range(5)]
+
+    def order(self, *indexes, age=timedelta(minutes=5)):
+        order = Order.objects.create()
+        Order.objects.filter(pk=order.pk).update(
+            created_at=timezone.now() - age)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=self.products[index],
+                      name=str(index), price=index)
+            for index in indexes
+        ])
+
+    def build(self, *args):
+        call_command("build_recommendations", "--top", "1", *args,
+                     stdout=io.StringIO())
+        return set(ProductRecommendation.objects.values_list(
+            "product__name", "recommended__name", "score"))
+
+    def test_incremental_runs_match_rebuild(self):
+        self.order(0, 1)
+        self.order(0, 1)
+        self.order(0, 2)
+        self.build()
+
+        # 0-2 was cut from the top of 0 but overtakes 0-1 now
+        self.order(0, 2)
+        self.order(0, 2, 3)
+        incremental = self.build()
+
+        self.assertIn(("0", "2", 3), incremental)
+        self.assertEqual(incremental, self.build("--rebuild"))
+
+    def test_orders_still_settling_are_not_skipped(self):
+        self.order(0, 1)
+        first = Order.objects.get()
+        # Placed just now, its transaction may not have committed yet
+        self.order(2, 3, age=timedelta(0))
+
+        self.assertEqual(self.build(), {("0", "1", 1), ("1", "0", 1)})
+        self.assertEqual(RecommendationCursor.objects.get().last_order_id,
+                         first.id)
+
+        recommendations = self.build("--settle-seconds", "0")
+
+        self.assertIn(("2", "3", 1), recommendations)
+        self.assertEqual(recommendations,
+                         self.build("--rebuild", "--settle-seconds", "0"))
+
+    def test_most_frequent_first(self):
+        self.order(0, 1)
+        self.order(0, 2)
+        self.order(0, 2)
+        call_command("build_recommendations", stdout=io.StringIO())
+
+        res = self.client.get("/api/products/{id}/recommendations/".format(
+            id=self.products[0].id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [(row["score"], row["name"])
+             for row in res.json()["recommendations"]],
+            [(2, "2"), (1, "1")]
+        )
+
+
+class SyncStripeCatalogTests(TestCase):
+
+    def test_going_back_to_a_price_creates_a_new_one(self):
+        product = Product.objects.create(name="Lamp", category="Home",
+                                         price=10)
+        prices = iter(range(1, 100))
+        keys = []
+
+        def create_price(idempotency_key, **params):
+            keys.append(idempotency_key)
+            return mock.Mock(id="price_{n}".format(n=next(prices)))
+
+        with mock.patch.multiple(
+                "stripe",
+                Product=mock.Mock(create=mock.Mock(
+                    return_value=mock.Mock(id="prod_1"))),
+                Price=mock.Mock(create=create_price)):
+            for price in (10, 12, 10):
+                Product.objects.filter(pk=product.pk).update(price=price)
+                call_command("sync_stripe_catalog", stdout=io.StringIO())
+
+        product.refresh_from_db()
+        self.assertEqual(product.stripe_price_id, "price_3")
+        self.assertEqual(len(set(keys)), 3)
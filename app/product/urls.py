@@ -13,6 +13,10 @@ urlpatterns = [
          name="delete_single_image"
          ),
     path("products/<str:pk>/", views.get_product, name="get_product_detail"),
+    path("products/<str:pk>/recommendations/",
+         views.get_recommendations,
+         name="product_recommendations"
+         ),
     path("products/<str:pk>/update/",
          views.update_product,
          name="update_product"
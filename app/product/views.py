@@ -1,8 +1,11 @@
 from django.shortcuts import get_object_or_404
 from rest_framework.decorators import api_view, permission_classes
-from .models import Product, ProductImages, Review
+from .inventory import set_sharded_stock, with_available_stock
+from .models import (InventoryMode, Product, ProductImages,
+                     ProductRecommendation, Review)
 from rest_framework.response import Response
-from .serializers import ProductSerializer, ProductImagesSerializer
+from .serializers import (ProductSerializer, ProductImagesSerializer,
+                          ProductRecommendationSerializer)
 from .filters import ProductsFilter
 from rest_framework.pagination import PageNumberPagination
 from rest_framework import status
@@ -21,7 +24,10 @@ from rest_framework.parsers import MultiPartParser
 def get_products(request):
     """Get All Products"""
     filterset = ProductsFilter(
-        request.GET, queryset=Product.objects.all().order_by("id")
+        request.GET,
+        queryset=with_available_stock(
+            Product.objects.prefetch_related("reviews", "images")
+        ).order_by("id")
         )
 
     count = filterset.qs.count()
@@ -51,6 +57,22 @@ def get_product(request, pk):
     return Response({"product": serializer.data})
 
 
+@swagger_auto_schema(method='GET')
+@api_view(['GET'])
+def get_recommendations(request, pk):
+    """Get Products Frequently Bought Together with a Product"""
+    recommendations = (ProductRecommendation.objects
+                       .filter(product_id=pk)
+                       .select_related("recommended")
+                       .only("score", "recommended__name",
+                             "recommended__price")
+                       .order_by("-score"))
+
+    serializer = ProductRecommendationSerializer(recommendations, many=True)
+
+    return Response({"recommendations": serializer.data})
+
+
 @swagger_auto_schema(
     method='POST',
     request_body=openapi.Schema(
@@ -162,7 +184,11 @@ def update_product(request, pk):
     product.category = request.data["category"]
     product.brand = request.data["brand"]
     product.ratings = request.data["ratings"]
-    product.stock = request.data["stock"]
+
+    if product.inventory_mode == InventoryMode.SHARDED:
+        set_sharded_stock(product, int(request.data["stock"]))
+    else:
+        product.stock = request.data["stock"]
 
     product.save()
 
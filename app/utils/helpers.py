@@ -1,5 +1,50 @@
+import json
+
+from django.core.cache import cache
+from django.db import connections
+
+
 def get_current_host(request):
     protocol = request.is_secure() and "https" or "http"
     host = request.get_host()
 
     return "{protocol}://{host}/".format(protocol=protocol, host=host)
+
+
+def count_rows(queryset, cache_key, timeout, estimate_above):
+    """Row count of ``queryset`` as ``(count, is_estimate)``.
+
+    On PostgreSQL the planner's estimate is used instead of COUNT(*) once
+    it passes ``estimate_above`` rows, where an exact count means reading
+    the whole result. Only those estimates are cached; smaller counts are
+    cheap, and a cached one goes stale as soon as an order is added.
+    """
+    result = cache.get(cache_key)
+    if result is not None:
+        return result
+
+    estimate = planner_estimate(queryset)
+    if estimate is None or estimate <= estimate_above:
+        return (queryset.count(), False)
+
+    result = (estimate, True)
+    cache.set(cache_key, result, timeout)
+
+    return result
+
+
+def planner_estimate(queryset):
+    """Rows PostgreSQL expects ``queryset`` to return, None elsewhere"""
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The process wide broker named by settings.PUBSUB_BROKER"""
+    global _broker
+
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.PUBSUB_BROKER)()
+
+    return _broker
+
+
+class Subscription:
+    """Messages of one channel for one async consumer"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=100)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def put(self, message):
+        # Called from any thread; a consumer too slow to keep up loses
+        # messages rather than growing without bound.
+        def put():
+            if not self.queue.full():
+                self.queue.put_nowait(message)
+
+        try:
+            self.loop.call_soon_threadsafe(put)
+        except RuntimeError:
+            # The consumer's event loop is gone without closing us
+            self.close()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """Fans messages out to the subscribers of this process only.
+
+    Enough when the code that publishes runs in the same process as the
+    subscribers; otherwise use PostgresBroker.
+    """
+
+    def __init__(self):
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self.lock:
+            self.subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            channel = self.subscriptions.get(subscription.channel, set())
+            channel.discard(subscription)
+            if not channel:
+                self.subscriptions.pop(subscription.channel, None)
+
+    def publish(self, channel, message):
+        """Deliver ``message`` once the current transaction commits"""
+        transaction.on_commit(lambda: self.deliver(channel, message))
+
+    def deliver(self, channel, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+
+        for subscription in subscriptions:
+            subscription.put(message)
+
+
+class PostgresBroker(LocalBroker):
+    """Carries messages between processes with PostgreSQL LISTEN/NOTIFY.
+
+    Messages are sent with NOTIFY in the publisher's transaction, so they
+    go out only if it commits. Every process keeps a single listening
+    connection, in a background thread, and fans out to its subscribers
+    in memory, so idle subscribers cost no database connections.
+    """
+
+    channel = "pubsub"
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+        self.stopping = threading.Event()
+
+    def subscribe(self, channel):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen,
+                                                 daemon=True)
+                self.listener.start()
+        return super().subscribe(channel)
+
+    def publish(self, channel, message):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [
+                self.channel,
+                json.dumps({"channel": channel, "message": message})
+            ])
+
+    def listen(self):
+        database = connections["default"]
+
+        while not self.stopping.is_set():
+            listener = None
+            try:
+                listener = database.Database.connect(
+                    **database.get_connection_params()
+                )
+                listener.autocommit = True
+                listener.cursor().execute(
+                    "LISTEN {channel}".format(channel=self.channel)
+                )
+
+                while not self.stopping.is_set():
+                    if select.select([listener], [], [], 1) == ([], [], []):
+                        continue
+
+                    listener.poll()
+                    while listener.notifies:
+                        payload = json.loads(listener.notifies.pop(0).payload)
+                        self.deliver(payload["channel"], payload["message"])
+
+            except Exception:
+                logger.exception("Lost the LISTEN connection, reconnecting")
+                time.sleep(1)
+
+            finally:
+                if listener is not None:
+                    listener.close()
+
+    def stop(self):
+        """End the listening thread and close its connection"""
+        self.stopping.set()
+        if self.listener is not None:
+            self.listener.join()
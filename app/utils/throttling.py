@@ -0,0 +1,185 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The process wide shared tier named by settings.RATE_LIMIT_BACKEND"""
+    global _backend
+
+    with _backend_lock:
+        if _backend is None:
+            _backend = import_string(settings.RATE_LIMIT_BACKEND)()
+
+    return _backend
+
+
+def refill(tokens, last, now, rate, burst):
+    """Take a token from a bucket holding ``tokens`` at ``last``.
+
+    Returns ``(allowed, tokens, wait)``; ``wait`` is how long until the
+    next token when the bucket is empty.
+    """
+    tokens = min(burst, tokens + max(0.0, now - last) * rate)
+    if tokens < 1:
+        return False, tokens, (1 - tokens) / rate
+    return True, tokens - 1, 0.0
+
+
+class LocalBuckets:
+    """Buckets of this process only, in a plain dict.
+
+    Lock free: under concurrent threads a bucket may hand out a token
+    too many, which the shared tier behind it still catches. Floods are
+    refused here without touching the shared tier.
+    """
+
+    max_keys = 10000
+
+    def __init__(self):
+        self.buckets = {}
+
+    def take(self, key, rate, burst, now):
+        tokens, last = self.buckets.get(key, (burst, now))
+        allowed, tokens, wait = refill(tokens, last, now, rate, burst)
+
+        if len(self.buckets) >= self.max_keys:
+            # Forgetting a bucket only refills it; the shared tier holds
+            self.buckets.clear()
+        self.buckets[key] = (tokens, now)
+
+        return allowed, wait
+
+    def reset(self):
+        self.buckets.clear()
+
+
+class SharedMemoryBackend:
+    """Buckets shared by the workers of one host through a memory mapped
+    file, by default in /dev/shm.
+
+    Keys are hashed onto a fixed table of slots, each locked with a
+    record lock only while it is updated. Keys that share a slot share
+    its bucket, which only ever limits them sooner.
+    """
+
+    slot = struct.Struct("dd")
+
+    def __init__(self):
+        self.slots = settings.RATE_LIMIT_SHM_SLOTS
+        size = self.slots * self.slot.size
+
+        self.fd = os.open(settings.RATE_LIMIT_SHM_PATH,
+                          os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        # Record locks are per process; threads queue on this first
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        offset = (zlib.crc32(key.encode()) % self.slots) * self.slot.size
+
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.slot.size, offset)
+            try:
+                tokens, last = self.slot.unpack_from(self.map, offset)
+                if not last:
+                    tokens = burst
+
+                allowed, tokens, wait = refill(tokens, last, now, rate,
+                                               burst)
+                self.slot.pack_into(self.map, offset, tokens, now)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, self.slot.size, offset)
+
+        return allowed, wait
+
+    def reset(self):
+        with self.lock:
+            self.map[:] = bytes(len(self.map))
+
+
+class CacheBackend:
+    """Buckets in the RATE_LIMIT_CACHE Django cache, for limits shared
+    by several hosts.
+
+    The read and the write are separate calls, so concurrent requests
+    of one client can each take the same token.
+    """
+
+    def __init__(self):
+        self.cache = caches[settings.RATE_LIMIT_CACHE]
+
+    def take(self, key, rate, burst, now):
+        key = "ratelimit:" + key
+        tokens, last = self.cache.get(key, (burst, now))
+        allowed, tokens, wait = refill(tokens, last, now, rate, burst)
+        self.cache.set(key, (tokens, now), int(burst / rate) + 1)
+        return allowed, wait
+
+    def reset(self):
+        self.cache.clear()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Token bucket per client and ``scope``, see settings.RATE_LIMITS.
+
+    Clients are told apart by user id when authenticated, else by IP
+    address. A request has to get a token from this process's bucket
+    and then from the shared bucket; a scope missing from RATE_LIMITS
+    is not limited.
+    """
+
+    scope = None
+    local = LocalBuckets()
+
+    def allow_request(self, request, view):
+        policy = settings.RATE_LIMITS.get(self.scope)
+        if policy is None:
+            return True
+
+        per_minute, burst = policy
+        rate = per_minute / 60.0
+
+        if request.user and request.user.is_authenticated:
+            ident = "user:{id}".format(id=request.user.id)
+        else:
+            ident = self.get_ident(request)
+        key = "{scope}:{ident}".format(scope=self.scope, ident=ident)
+
+        now = time.time()
+        allowed, self.retry_after = self.local.take(key, rate, burst, now)
+        if allowed:
+            allowed, self.retry_after = get_backend().take(key, rate,
+                                                           burst, now)
+
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+def token_bucket(scope):
+    """TokenBucketThrottle subclass for ``scope``, for @throttle_classes"""
+    return type("{name}TokenBucketThrottle".format(
+        name=scope.title().replace("_", "")
+    ), (TokenBucketThrottle,), {"scope": scope})
+
+
+def reset_rate_limits():
+    """Refill every bucket, e.g. between test runs"""
+    TokenBucketThrottle.local.reset()
+    get_backend().reset()
@@ -0,0 +1,46 @@
+from django.db import connection
+
+
+def increment_rows(model, unique_fields, rows, batch_size=200):
+    """Add ``rows`` onto the rows of ``model`` with the same unique fields.
+
+    ``rows`` are dicts of field name to value; missing rows are inserted.
+    Each batch is one INSERT ... ON CONFLICT DO UPDATE, so concurrent
+    writers never lose an increment. Rows are written in key order to
+    keep concurrent transactions from deadlocking.
+    """
+    if not rows:
+        return
+
+    opts = model._meta
+    quote = connection.ops.quote_name
+    names = list(rows[0])
+    fields = [opts.get_field(name) for name in names]
+    table = quote(opts.db_table)
+
+    sql = ("INSERT INTO {table} ({columns}) VALUES {{values}} "
+           "ON CONFLICT ({keys}) DO UPDATE SET {updates}").format(
+        table=table,
+        columns=", ".join(quote(f.column) for f in fields),
+        keys=", ".join(quote(opts.get_field(name).column)
+                       for name in unique_fields),
+        updates=", ".join(
+            "{column} = {table}.{column} + EXCLUDED.{column}".format(
+                column=quote(f.column), table=table
+            )
+            for f in fields if f.name not in unique_fields
+        )
+    )
+    placeholder = "({marks})".format(marks=", ".join(["%s"] * len(fields)))
+
+    rows = sorted(rows, key=lambda row: [row[name] for name in unique_fields])
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                sql.format(values=", ".join([placeholder] * len(batch))),
+                [f.get_db_prep_save(row[name], connection)
+                 for row in batch
+                 for name, f in zip(names, fields)]
+            )